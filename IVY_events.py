@@ -12,8 +12,13 @@ fit and guarantees a thread-safe means of passing information from the
 acquisition thread to the main GUI.
 """
 
+import time
+from threading import RLock, Timer
+import wx
 import wx.lib.newevent
 
+GUI_RATE = 10  # Maximum rate of coalesced GUI updates (per second)
+
 # Event used to pass an updated string to the 'comment' TextCtrl on RunPage
 UpdateCommentEvent, EVT_UPDATE_COM_STR = wx.lib.newevent.NewEvent()
 
@@ -51,4 +56,74 @@ FilePathEvent, EVT_FILEPATH = wx.lib.newevent.NewEvent()
 SB_ConfEvent, EVT_SBCONF = wx.lib.newevent.NewEvent()
 
 # Event to update log file
-LogEvent, EVT_LOG = wx.lib.newevent.NewEvent()
\ No newline at end of file
+LogEvent, EVT_LOG = wx.lib.newevent.NewEvent()
+
+# Event to have the Analysis page analyse a completed (batch) run
+AnalyzeEvent, EVT_ANALYZE = wx.lib.newevent.NewEvent()
+
+# Event to set the RunPage V1 display (and so the source - see OnV1Set())
+SetV1Event, EVT_SET_V1 = wx.lib.newevent.NewEvent()
+
+
+class EventChannel(object):
+    """
+    Rate-limited, coalescing route for events from the acquisition thread
+    to the GUI.
+    DataEvents for the same window are merged (the latest value of each
+    'ud' item wins) and StatusEvents for the same status-bar field replace
+    each other. Merged events are posted at most rate times per second.
+    Other events, and 'urgent' ones (end of row, end of run), are posted
+    straight away - after any pending updates, so order is kept.
+    """
+    def __init__(self, rate=GUI_RATE):
+        self.period = 1.0/rate
+        self._lock = RLock()  # Held while posting, so order is kept
+        self.pending = []  # [(key, target, event),...] in posting order
+        self.t_last = 0.0  # Time of last flush
+        self.timer = None
+
+    def Post(self, target, ev, urgent=False):
+        if isinstance(ev, DataEvent):
+            if ev.ud.get('end_flag'):
+                urgent = True
+            self.Merge(('data', id(target)), target, ev, urgent)
+        elif isinstance(ev, StatusEvent):
+            self.Merge(('stat', id(target), ev.field), target, ev, urgent)
+        else:
+            with self._lock:
+                self.Flush()
+                wx.PostEvent(target, ev)
+
+    def Merge(self, key, target, ev, urgent):
+        with self._lock:
+            for (i, (k, t, e)) in enumerate(self.pending):
+                if k == key:
+                    if key[0] == 'data':  # Combine updates
+                        ud = dict(e.ud)
+                        ud.update(ev.ud)
+                        ev = DataEvent(ud=ud)
+                    del self.pending[i]
+                    break
+            if key[0] == 'stat' and ev.field == 'b':  # Supersedes 0 and 1
+                self.pending = [p for p in self.pending if p[0][:2] != key[:2]]
+            self.pending.append((key, target, ev))
+            due = time.time() - self.t_last >= self.period
+            if not (urgent or due) and self.timer is None:
+                wait = self.period - (time.time() - self.t_last)
+                self.timer = Timer(wait, self.Flush)
+                self.timer.daemon = True
+                self.timer.start()
+        if urgent or due:
+            self.Flush()
+
+    def Flush(self):
+        # Post all pending events now (wx.PostEvent() doesn't block)
+        with self._lock:
+            pending = self.pending
+            self.pending = []
+            self.t_last = time.time()
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            for (key, target, ev) in pending:
+                wx.PostEvent(target, ev)
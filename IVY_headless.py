@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+IVY_headless.py
+
+Acquisition and analysis without the GUI.
+Drives the same measurement sequence (acquisition.AqnThread) and analysis
+(analysis.RunAnalysis) as the wx application, but never creates a wx.App,
+so it can be run from a script or a scheduled task on a rack PC, e.g.:
+
+    python -m IVY_headless data.xlsx --gain 1e6 --Rs 1M --duc "I2V s/n1"
+    python -m IVY_headless data.xlsx --batch runs.csv --duc "I2V s/n1"
+    python -m IVY_headless data.xlsx --resume
+    python -m IVY_headless data.xlsx --analyse 45
+
+Instruments are assigned to roles as by the Setup page's auto-populate
+button (devices.DEFAULT_ROLES); override with --role, e.g.
+--role "DVM12=DVM: HP3458A, s/n066".
+A single run is analysed as soon as it's complete (batch runs are
+analysed one by one, as in the GUI). Progress goes to the console and the
+day's log file, next to the workbook. Ctrl-C aborts the run safely.
+"""
+
+import os
+import sys
+import argparse
+import datetime as dt
+
+import devices
+import acquisition as acq
+import analysis
+import batch
+import journal
+import xlwriter
+import xlstream
+import params
+
+VERSION = "0.2"  # As IVY_main.VERSION (which can't be imported without wx)
+
+
+class HeadlessUI(object):
+    """
+    Console front end of an acquisition run (see acquisition.AqnThread).
+    """
+    def __init__(self, xlfilename, wb, writer, log, roles, store=None):
+        self.xlfilename = xlfilename
+        self.wb = wb
+        self.store = store
+        self.writer = writer
+        self.log = log
+        self.roles = roles
+        self.finished = False  # Set when the run ends (complete or aborted)
+        self.progress = 0
+
+    def Roles(self):
+        return dict(self.roles)
+
+    def Status(self, msg, field):
+        if msg != '':
+            print 'IVY_headless:', msg
+
+    def Data(self, ud, urgent=False):
+        if urgent and 'Vm' in ud:  # Row result
+            print 'IVY_headless: row %s, %s = %s (sd %s)' % (ud['row'], ud['node'], ud['Vm'], ud['Vsd'])
+        if int(ud.get('progress', 0))/10 > self.progress/10:
+            self.progress = int(ud['progress'])
+            print 'IVY_headless: %d%% done' % self.progress
+        if ud.get('end_flag'):
+            self.finished = True
+
+    def StartRow(self, row):
+        print 'IVY_headless: start row', row
+
+    def ClearPlot(self):
+        pass
+
+    def Plot(self, t, V12, V3, clear, node):
+        pass
+
+    def SetV1(self, V):
+        acq.SetSource(V)
+
+    def Analyse(self, start_row):
+        Analyse(self.wb, start_row, self.log, self.store)
+
+
+def Analyse(wb, start_row, log=None, store=None):
+    # Analyse the run starting at start_row of the Data sheet and print results
+    summary = analysis.RunAnalysis(wb, VERSION, store).AnalyzeRun(start_row)
+    print 'IVY_headless: analysed rows %d - %d (gain %.2e)' % (summary['start_row'], summary['stop_row'], summary['DUC_gain'])
+    for result in summary['results']:
+        line = 'Vout = %4s V: I+ = %.8g, I- = %.8g, U = %.3g (k = %.0f)' % (result['Vout'], result['I_pos'].x, result['I_neg'].x, result['EU'], result['k'])
+        print line
+        if log is not None:
+            print >>log, line
+    return summary
+
+
+def OpenLog(xlfilename):
+    # The GUI's log file for today (see nbpages.SetupPage.UpdateFilepath())
+    logname = 'IVYv'+VERSION+'_'+str(dt.date.today())+'.log'
+    return open(os.path.join(os.path.dirname(os.path.abspath(xlfilename)), logname), 'a')
+
+
+def ParseArgs(argv):
+    parser = argparse.ArgumentParser(description='IVY v%s without the GUI' % VERSION)
+    parser.add_argument('workbook', help='IVY workbook (.xlsx)')
+    parser.add_argument('--gain', type=float, help='nominal DUC gain (V/A)')
+    parser.add_argument('--Rs', choices=batch.RS_NAMES, help='input resistor')
+    parser.add_argument('--duc', default='CHANGE_THIS!', help='DUC name')
+    parser.add_argument('--comment', default='', help='extra notes for the run comment')
+    parser.add_argument('--settle', type=int, default=0, help='initial settle delay (s)')
+    parser.add_argument('--role', action='append', default=[],
+                        metavar='ROLE=DESCR', help='instrument for a role')
+    parser.add_argument('--batch', metavar='CSV', help='run a batch file (see batch.py)')
+    parser.add_argument('--order', action='store_true', help='re-order batch to minimise Rs switching')
+    parser.add_argument('--resume', action='store_true', help='continue the interrupted run')
+    parser.add_argument('--analyse', type=int, metavar='ROW',
+                        help='only analyse the run starting at ROW')
+    args = parser.parse_args(argv)
+    if args.analyse is None and not (args.resume or args.batch):
+        if args.gain is None or args.Rs is None:
+            parser.error('--gain and --Rs are needed for a run')
+    return args
+
+
+def main(argv=None):
+    args = ParseArgs(argv)
+    xlfilename = os.path.abspath(args.workbook)
+    log = OpenLog(xlfilename)
+    wb = xlstream.Open(xlfilename)  # Cell VALUES, not formulae
+    store = params.Load(wb, xlfilename, log)
+
+    if args.analyse is not None:
+        Analyse(wb, args.analyse, log, store)
+        wb.save(xlfilename)
+        log.close()
+        return 0
+
+    if args.resume and not journal.CanResume(journal.JournalPath(xlfilename)):
+        print 'IVY_headless: No interrupted run to resume'
+        return 1
+
+    writer = xlwriter.WorkbookWriter(wb, log)
+    writer.start()
+
+    devices.LoadInstrData(store, log)
+    roles = dict(devices.DEFAULT_ROLES)
+    for assignment in args.role:
+        r, d = assignment.split('=', 1)
+        assert r in roles, 'Unknown role: %s' % r
+        roles[r] = d
+    for r in roles:
+        devices.CreateInstr(roles[r], r)
+
+    # As the Run page's auto-generated comment and run id:
+    autocomment = 'IVY v.' + VERSION + '. DUC: ' + args.duc + ' monitored by ' + roles['GMH']
+    run_id = 'IVY.v' + VERSION + ' ' + args.duc + ' ' + dt.datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+    start_row = wb.get_sheet_by_name('Data')['B1'].value
+    ui = HeadlessUI(xlfilename, wb, writer, log, roles, store)
+    if args.resume:
+        thread = acq.AqnThread(ui, resume=True)
+    elif args.batch:
+        configs = batch.LoadBatch(args.batch)
+        if args.order:
+            configs = batch.OrderBatch(configs)
+        runs = batch.RunConfigs(configs, run_id, autocomment, start_row)
+        thread = acq.AqnThread(ui, runs, is_batch=True)
+    else:
+        config = {'run_id': run_id, 'comment': autocomment + args.comment,
+                  'DUC_G': args.gain, 'Rs': batch.RS_VALUES[args.Rs],
+                  'start_row': start_row, 'settle_time': args.settle}
+        thread = acq.AqnThread(ui, [config])
+
+    try:
+        while thread.is_alive():
+            thread.join(0.5)  # (join() without timeout blocks Ctrl-C)
+    except KeyboardInterrupt:
+        print 'IVY_headless: Aborting run...'
+        thread.abort()
+        thread.join()
+
+    status = 0
+    if thread.failed or not ui.finished:  # (A failed run is also 'finished')
+        print 'IVY_headless: Run FAILED'
+        status = 1
+    elif not (thread.ctrl.aborted or thread.is_batch):
+        writer.Flush()
+        Analyse(wb, thread.start_row, log, store)
+        writer.Save(xlfilename, wait=True)
+
+    writer.Stop()
+    writer.join()
+    for r in devices.ROLES_INSTR.keys():
+        devices.ROLES_INSTR[r].Close()
+    devices.CloseRM()
+    log.close()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
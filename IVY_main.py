@@ -21,15 +21,21 @@ The same data input/output protocol as the original is used, i.e.
 initiation parameters are read from the same spreadsheet as the results
 are output to.
 
-NOTE: Because the 'Parameters' sheet of the Excel file is interogated twice -
-once for obtaining instrument control info (INSTR_DATA) and a second time to
-get calibration and uncertainty info (R_INFO and I_INFO), there is redundancy
-of information (especially for instruments). Bear in mind that data stored in
-INSTR_DATA is just plain numbers or strings, whereas R_INFO and I_INFO can
-also contain GTC.ureals.
+NOTE: The 'Parameters' sheet of the Excel file is parsed once, when the file
+is opened, into a params.ParamStore (cached on disk as
+'<workbook>_params.json' and re-used while the Parameters sheet is
+unchanged). It has two views of the same
+items: Plain() - plain numbers or strings, for instrument control info
+(INSTR_DATA) - and Uncertain() - with GTC.ureals, for calibration and
+uncertainty info (R_INFO and I_INFO, see analysis.py).
+
+Start with 'python IVY_main.py --analysis' for an analysis-only session:
+no splash screen and only the Analysis page - instruments (VISA, GMH) are
+never touched and matplotlib is never loaded, so it starts quickly.
 """
 
 import os
+import sys
 import wx
 import nbpages as page
 import IVY_events as evts
@@ -37,6 +43,7 @@ import devices
 import time
 
 VERSION = "0.2"
+ANALYSIS_ONLY = '--analysis' in sys.argv[1:]
 
 print 'IVY', VERSION
 
@@ -45,9 +52,14 @@ print 'IVY', VERSION
 
 class MainFrame(wx.Frame):
     def __init__(self, *args, **kwargs):
+        self.analysis_only = kwargs.pop('analysis_only', False)
         wx.Frame.__init__(self, size=(900, 500), *args, **kwargs)
         self.version = VERSION
         self.ExcelPath = ""
+        self.log = None  # Log file, once a file is open
+        self.wb = None
+        self.wb_writer = None  # xlwriter.WorkbookWriter, once a file is open
+        self.params = None  # params.ParamStore, once a file is open
         self.Center()
 
         # Event bindings
@@ -87,16 +99,22 @@ class MainFrame(wx.Frame):
         self.NoteBook = wx.Notebook(self.MainPanel)
 
         # Create the page windows as children of the notebook
-        self.page1 = page.SetupPage(self.NoteBook)
-        self.page2 = page.RunPage(self.NoteBook)
-        self.page3 = page.PlotPage(self.NoteBook)
-        self.page4 = page.CalcPage(self.NoteBook)
-
-        # Add the pages to the notebook with the label to show on the tab
-        self.NoteBook.AddPage(self.page1, "Setup")
-        self.NoteBook.AddPage(self.page2, "Run")
-        self.NoteBook.AddPage(self.page3, "Plots")
-        self.NoteBook.AddPage(self.page4, "Analysis")
+        if self.analysis_only:
+            self.page1 = self.page2 = self.page3 = None
+            self.page4 = page.CalcPage(self.NoteBook)
+            self.NoteBook.AddPage(self.page4, "Analysis")
+        else:
+            import plotpage  # (matplotlib) - only needed for the Plots page
+            self.page1 = page.SetupPage(self.NoteBook)
+            self.page2 = page.RunPage(self.NoteBook)
+            self.page3 = plotpage.PlotPage(self.NoteBook)
+            self.page4 = page.CalcPage(self.NoteBook)
+
+            # Add the pages to the notebook with the label to show on the tab
+            self.NoteBook.AddPage(self.page1, "Setup")
+            self.NoteBook.AddPage(self.page2, "Run")
+            self.NoteBook.AddPage(self.page3, "Plots")
+            self.NoteBook.AddPage(self.page4, "Analysis")
 
         # Finally, put the notebook in a sizer for the panel to manage
         # the layout
@@ -122,11 +140,11 @@ I-to-V converter program for Light Standards."
 
     def OnSave(self, event=None):
         if self.ExcelPath is not "":
-            print 'Main.OnSave(): Saving', self.page1.XLFile.GetValue(), '...'
-            self.page1.wb.save(self.page1.XLFile.GetValue())
+            print 'Main.OnSave(): Saving', self.ExcelPath, '...'
+            # Merged with any save already queued by a run:
+            self.wb_writer.Save(self.ExcelPath)
         else:
             print 'Main.OnSave(): Nothing to Save.'
-        print 'DONE.'
 
     def OnOpen(self, event=None):
         dlg = wx.FileDialog(self, message="Select data file",
@@ -138,22 +156,30 @@ I-to-V converter program for Light Standards."
             self.directory = dlg.GetDirectory()
             print self.directory
             print self.ExcelPath
-            file_evt = evts.FilePathEvent(XLpath=self.ExcelPath,
-                                          d=self.directory, v=VERSION)
-            wx.PostEvent(self.page1, file_evt)
+            if self.analysis_only:  # No instruments to set up
+                page.OpenWorkbook(self, self.ExcelPath, self.directory,
+                                  VERSION)
+            else:
+                file_evt = evts.FilePathEvent(XLpath=self.ExcelPath,
+                                              d=self.directory, v=VERSION)
+                wx.PostEvent(self.page1, file_evt)
         dlg.Destroy()
 
     def CloseInstrSessions(self, event=None):
         for r in devices.ROLES_INSTR.keys():
             devices.ROLES_INSTR[r].Close()
             time.sleep(0.1)
-        devices.RM.close()
-        print'Main.CloseInstrSessions(): closed VISA resource manager.'
+        devices.CloseRM()  # Also closes any sessions still pooled
+        print'Main.CloseInstrSessions(): closed VISA sessions and resource manager.'
 
     def OnQuit(self, event=None):
         self.CloseInstrSessions()
         self.OnSave()
-        self.page1.log.close()
+        if self.wb_writer is not None:  # Let queued save(s) finish
+            self.wb_writer.Stop()
+            self.wb_writer.join()
+        if self.log is not None:
+            self.log.close()
         time.sleep(0.1)
         print 'Closing IVY...'
         self.Close()
@@ -176,12 +202,16 @@ class MainApp(wx.App):
     """Class MainApp."""
     def OnInit(self):
         """Initiate Main App."""
-        Splash = SplashScreen()
-        Splash.Show()
-        self.frame = MainFrame(None, wx.ID_ANY)
+        if not ANALYSIS_ONLY:
+            Splash = SplashScreen()
+            Splash.Show()
+        self.frame = MainFrame(None, wx.ID_ANY, analysis_only=ANALYSIS_ONLY)
         self.frame.Show(True)
         self.SetTopWindow(self.frame)
-        self.frame.SetTitle("IVY v"+VERSION)
+        if ANALYSIS_ONLY:
+            self.frame.SetTitle("IVY v"+VERSION+" (analysis only)")
+        else:
+            self.frame.SetTitle("IVY v"+VERSION)
         return True
 
 if __name__ == '__main__':
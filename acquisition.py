@@ -14,39 +14,73 @@ Contains definitions for usual __init__() and run() methods
 @author: t.lawson
 """
 
-import wx
 from threading import Thread
 import datetime as dt
 import time
+import traceback
 import numpy as np
 
 from openpyxl.styles import Font, Border, Side
 
-import IVY_events as evts
 import devices
+import datasink
+import replies
+import settle
+import environment
+import journal
+import sequence
+import batch
+import timeline
+import runcontrol
+import drivers
 
 NREADS = 20
-TEST_V_OUT = [0.1, 1, 10]  # O/P test voltage selection
-NODES = ['V1', 'V2']  # Input node selection
-TEST_V_MASK = [0, -1, 1, 0]  # Polarity / zero selection
-I_MIN = 1e-11  # 10 pA (S/N issues, noise limit)
-I_MAX = 0.01  # 10 mA (Opamp overheating limit)
-V1_MIN = 0.01  # 10 mV (S/N issues, noise limit)
-V1_MAX = 10  # 10 V (Opamp output limit)
 P_MAX = 480  # Maximum progress (20 measurement-cycles * 24 rows)
+DATA_HEADINGS = {'A': 'Comment', 'B': 'DUC gain (V/A)', 'C': 'Rs (Ohm)',
+                 'D': 'I/P node (V1,V2?)', 'E': 'Date, time',
+                 'F': 'N meas.', 'G': 'Nom. Vout ', 'H': 'O/P V (V3)',
+                 'I': 'Stdev', 'J': 'I/P V (V1 or V2)', 'K': 'Stdev',
+                 'L': 'T(GMH)', 'M': 'Pt (DVM)', 'N': 'IP DVM range',
+                 'O': 'OP DVM range', 'P': 'T (room)', 'Q': 'P (room)',
+                 'R': 'RH (room)', 'S': 'Role',
+                 'T': 'Instrument description'}
+SAMPLE_MODE = 'auto'  # 'sequential', 'concurrent', 'burst' or 'auto' reads
+BURST_FORMAT = 'DREAL'  # Preferred binary format for 'burst' mode
+DATA_SINK = 'csv'  # Per-row persistence: 'xlsx' (save workbook), 'csv', 'jsonl'
+ADAPTIVE_SETTLE = True  # If False, always wait the full SETTLE_MAX_* delays
+SETTLE_MAX_V = 35  # Upper bound on settling after applying V (s)
+SETTLE_MAX_AZ = 30  # Upper bound on settling after DVM auto-zero (s)
+SETTLE_MIN = 3  # Always wait at least this long (s)
+SEQUENCE_ORDER = sequence.ORDER  # 'node-major' or 'interleaved'
 
 
 class AqnThread(Thread):
-    """Acquisition Thread Class."""
-    def __init__(self, parent):
+    """
+    Acquisition Thread Class.
+    ui is the front end the thread reports to and takes its workbook from
+    (see nbpages.RunUI, or IVY_headless.HeadlessUI for runs without wx).
+    It provides:
+    * attributes xlfilename, wb (the open workbook), writer
+      (its xlwriter.WorkbookWriter) and log,
+    * Roles() - {role: instrument description} for the run,
+    * Status(msg, field), Data(ud, urgent=False), StartRow(row),
+      ClearPlot() and Plot(t, V12, V3, clear, node) - progress displays,
+    * SetV1(V) - apply (and show) source output V and
+    * Analyse(start_row) - analyse a completed run; returns when done.
+    configs is a list of run configurations (dictionaries with keys
+    'run_id', 'comment', 'DUC_G', 'Rs', 'start_row' and 'settle_time'),
+    measured in turn. If is_batch is True, each run is analysed as soon as
+    it's complete (see batch.RunConfigs()).
+    If resume is True, the run recorded in the workbook's journal is
+    continued from its first unfinished row, instead of starting a new run.
+    """
+    def __init__(self, ui, configs=None, resume=False, is_batch=False):
         # This runs when an instance of the class is created
         Thread.__init__(self)
-        self.RunPage = parent
-        self.SetupPage = self.RunPage.GetParent().GetPage(0)
-        self.PlotPage = self.RunPage.GetParent().GetPage(2)
-        self.TopLevel = self.RunPage.GetTopLevelParent()
-        self.Comment = self.RunPage.Comment.GetValue()
-        self._want_abort = 0
+        self.ui = ui
+        self.resume = resume
+        self.env = None  # Background environment sampler (see run())
+        self.failed = False  # Set if the run ended on an error (see run())
 
         self.V12Data = {'V1': [], 'V2': []}
         self.V3Data = []
@@ -54,15 +88,18 @@ class AqnThread(Thread):
         self.V12m = {'V1': 0, 'V2': 0}
         self.V12sd = {'V1': 0, 'V2': 0}
 
-        self.log = self.SetupPage.log
+        self.log = self.ui.log
+        # Abort / pause / resume (source to standby while paused)
+        self.ctrl = runcontrol.RunControl(self.Standby, self.log)
 
+        self.roles = self.ui.Roles()  # {role: instrument description}
         print'Role -> Instrument:'
         print >>self.log, 'Role -> Instrument:'
         print'------------------------------'
         print >>self.log, '------------------------------'
         # Print all device objects
-        for r in devices.ROLES_WIDGETS.keys():
-            d = devices.ROLES_WIDGETS[r]['icb'].GetValue()
+        for r in self.roles.keys():
+            d = self.roles[r]
             print'%s \t-> %s' % (devices.INSTR_DATA[d]['role'], d)
             print >>self.log, '%s \t-> %s' % (devices.INSTR_DATA[d]['role'], d)
             if r != devices.INSTR_DATA[d]['role']:
@@ -71,21 +108,30 @@ class AqnThread(Thread):
                 print >>self.log, 'Role data corrected to:', r, '->', d
 
         # Get filename of Excel file
-        self.xlfilename = self.SetupPage.XLFile.GetValue()  # Full path
-        self.path_components = self.xlfilename.split('\\')
-        self.directory = '\\'.join(self.path_components[0:-1])
+        self.xlfilename = self.ui.xlfilename  # Full path
 
         # Find existing workbook
-        self.wb_io = self.SetupPage.wb
+        self.wb_io = self.ui.wb
         self.ws = self.wb_io.get_sheet_by_name('Data')
+        # All workbook changes go through the background writer:
+        self.writer = self.ui.writer
+
+        # Run configuration - from the journal if resuming a run
+        self.journal = journal.RunJournal(journal.JournalPath(self.xlfilename))
+        if self.resume:
+            state = journal.LoadJournal(self.journal.path)
+            assert state is not None, 'No run journal to resume from!'
+            self.configs = [state['config']]
+            self.done = state['done']  # Rows already completed
+        else:
+            assert configs, 'No run configuration!'
+            self.configs = configs
+            self.done = {}
+        self.is_batch = is_batch and not self.resume
+        self.SetConfig(self.configs[0])
 
-        # read start row number from Excel file
-        self.start_row = self.ws['B1'].value
-
-        strt_ev = evts.StartRowEvent(row=self.start_row)
-        wx.PostEvent(self.RunPage, strt_ev)
-
-        self.settle_time = self.RunPage.SettleDel.GetValue()
+        # Where each completed row is persisted (see datasink.py)
+        self.sink = datasink.MakeSink(DATA_SINK, self.xlfilename, self.writer)
 
         # Local record of GMH ports and addresses
         self.GMH1Demo_status = devices.ROLES_INSTR['GMH'].demo
@@ -99,269 +145,366 @@ class AqnThread(Thread):
         This is where all the important stuff goes, in a repeated cycle.
         '''
         print'\nRUN START...\n'
+        try:
+            self.RunAll()
+        except runcontrol.RunAborted:
+            self.AbortRun()
+        except Exception as err:  # E.g. devices.BurstError, VisaIOError
+            self.failed = True
+            print'AqnThread.run(): Run FAILED:\n', traceback.format_exc()
+            print >>self.log, 'AqnThread.run(): Run FAILED:\n', traceback.format_exc()
+            self.ui.Status('Run FAILED: %s' % err, 0)
+            self.AbortRun()
 
-        # Set button availability
-        self.RunPage.StopBtn.Enable(True)
-        self.RunPage.StartBtn.Enable(False)
-
+    def RunAll(self):
+        '''
+        Initialise, then measure every run configuration in turn.
+        Raises runcontrol.RunAborted if aborted.
+        '''
         # Clear plots
-        clr_plot_ev = evts.ClearPlotEvent()
-        wx.PostEvent(self.PlotPage, clr_plot_ev)
+        self.ui.ClearPlot()
 
-        self.WriteHeadings()
+        self.BeginRun()
 
-        stat_ev = evts.StatusEvent(msg='AqnThread.run():', field=0)
-        wx.PostEvent(self.TopLevel, stat_ev)
-        stat_ev = evts.StatusEvent(msg='Waiting to settle...', field=1)
-        wx.PostEvent(self.TopLevel, stat_ev)
+        self.ui.Status('AqnThread.run():', 0)
+        self.ui.Status('Waiting to settle...', 1)
 
-        time.sleep(self.settle_time)
+        self.ctrl.Wait(self.settle_time, 'settle delay')
 
         # Initialise all instruments (doesn't open GMH sensors yet)
-        if self._want_abort:
-            self.AbortRun()
-            return
         self.initialise()
 
-        stat_ev = evts.StatusEvent(msg='',
-                                   field='b')  # write to both status fields
-        wx.PostEvent(self.TopLevel, stat_ev)
+        self.ui.Status('', 'b')  # write to both status fields
 
-        if self._want_abort:
-            self.AbortRun()
-            return
-        stat_ev = evts.StatusEvent(msg=' Post-initialise delay (3s)', field=1)
-        wx.PostEvent(self.TopLevel, stat_ev)
-        time.sleep(3)
+        if self.resume or self.is_batch:
+            self.SelectRs()
+
+        self.ui.Status(' Post-initialise delay (3s)', 1)
+        self.ctrl.Wait(3, 'post-initialise delay')
 
         self.WriteInstrAssignments()
 
-        row = self.start_row  # Start of data
-        pbar = 0
+        # Start polling GMH, GMHroom and DVMT in the background
+        self.env = environment.EnvSampler(self.log)
+        self.env.start()
+
+        for i_run in range(len(self.configs)):
+            if i_run > 0:  # Next run of a batch
+                self.configs[i_run]['start_row'] = self.next_row + 3
+                self.SetConfig(self.configs[i_run])
+                self.done = {}
+                self.ui.ClearPlot()
+                self.BeginRun()
+                self.WriteInstrAssignments()
+                self.SelectRs()
+                self.ui.Status('Waiting to settle...', 1)
+                self.ctrl.Wait(self.settle_time, 'settle delay')
+            self.RunSequence()
+            if self.is_batch:
+                self.AnalyseThisRun()
+
+        self.FinishRun()
+
+    def RunSequence(self):
+        '''
+        Work through the measurement sequence for the current run
+        configuration.
+        '''
+        self.pbar = 0
+        self.next_row = self.start_row  # First row after those written so far
 
         '''
-        The following sequence progresses through three blocks with nominal
-        output voltage of 0.1, 1 or 10 V. In each output voltage sub-block
-        the input DVM switches between the two nodes V1 and V2.
-        For each input node, a mask is applied to the output voltage (and
-        thus input V) causing the value to be set to 0 V, each polarity,
-        then 0 V again.
-
-        Nominal input voltage and current are calculated based on nominal
-        DUC gain and Rs. If the nominal input current would be outside the
-        scope {1e-11 < I < 1e-3} A, that 8-row block is skipped. If the nominal
-        calculated input voltage, required to result in the prescribed output,
-        would be outside the scope {0.01V < V < 10V}, that 8-row block is
-        skipped.
+        The measurement sequence (see sequence.py) progresses through three
+        blocks with nominal output voltage of 0.1, 1 or 10 V. In each block
+        the input DVM switches between the two nodes V1 and V2, and a mask
+        is applied to the output voltage (and thus input V) causing the
+        value to be set to 0 V, each polarity, then 0 V again.
+
+        If the nominal input current would be outside the scope
+        {1e-11 < I < 1e-3} A, or the nominal input voltage outside the
+        scope {0.01V < V < 10V}, that 8-row block is skipped.
         '''
-        self.Rs = self.RunPage.Rs_val
-        self.DUC_G = float(self.RunPage.DUCgain.GetValue())
-
-        for abs_V3 in TEST_V_OUT:  # Loop over desired output voltages
-            print'\nV3:', abs_V3, 'V'
-            self.V1_nom = self.Rs*abs_V3/self.DUC_G
-            self.I_nom = self.V1_nom/self.Rs
-            if (abs(self.I_nom) <= I_MIN or abs(self.I_nom) >= I_MAX):
-                warning = '\nNominal I/P test-I outside scope! (%.1g A)\n' % self.I_nom
+        self.plan = sequence.Plan(self.start_row, self.Rs, self.DUC_G,
+                                  SEQUENCE_ORDER)
+        self.node = None  # Currently-selected I/P node
+        for block in self.plan:  # Loop over desired output voltages
+            print'\nV3:', block.abs_V3, 'V'
+            self.V1_nom = block.V1_nom
+            self.I_nom = block.I_nom
+            if block.skip is not None:
+                warning = '\n' + block.skip + '\n'
                 print warning
-                stat_ev = evts.StatusEvent(msg=warning, field=1)
-                wx.PostEvent(self.TopLevel, stat_ev)
-                pbar += 160
+                self.ui.Status(warning, 1)
+                self.pbar += 160
                 Update = {'node': '-', 'Vm': 0, 'Vsc': 0, 'time': '-',
-                          'row': row, 'progress': 100.0*pbar/P_MAX,
-                          'end_flag': 0}
+                          'row': self.next_row,
+                          'progress': 100.0*self.pbar/P_MAX, 'end_flag': 0}
 
-                update_ev = evts.DataEvent(ud=Update)
-                wx.PostEvent(self.RunPage, update_ev)
+                self.ui.Data(Update)
                 continue
 
-            if abs(self.V1_nom) < V1_MIN or abs(self.V1_nom) > V1_MAX:
-                warning = '\nNom. I/P test-V outside scope! (%.1g V)\n' % self.V1_nom
-                print warning
-                stat_ev = evts.StatusEvent(msg=warning, field=1)
-                wx.PostEvent(self.TopLevel, stat_ev)
-                pbar += 160
-                Update = {'node': '-', 'Vm': 0, 'Vsc': 0, 'time': '-',
-                          'row': row, 'progress': 100.0*pbar/P_MAX,
-                          'end_flag': 0}
-                update_ev = evts.DataEvent(ud=Update)
-                wx.PostEvent(self.RunPage, update_ev)
-                continue
-            Update = {'node': '-', 'Vm': 0, 'Vsc': 0, 'time': '-', 'row': row,
-                      'progress': 100.0*pbar/P_MAX, 'end_flag': 0}
-            update_ev = evts.DataEvent(ud=Update)
-            wx.PostEvent(self.RunPage, update_ev)
-            for node in NODES:  # Select input node (V1 then V2)
-                self.SetNode(node)
+            Update = {'node': '-', 'Vm': 0, 'Vsc': 0, 'time': '-',
+                      'row': self.next_row,
+                      'progress': 100.0*self.pbar/P_MAX, 'end_flag': 0}
+            self.ui.Data(Update)
+            for step in block.steps:
+                pbar = self.pbar
+                while True:  # Repeat the step if paused part-way through
+                    try:
+                        self.MeasureStep(step)
+                        break
+                    except runcontrol.RowRestart:
+                        print'AqnThread.RunSequence(): Restarting row after pause'
+                        print >>self.log, 'AqnThread.RunSequence(): Restarting row after pause'
+                        self.pbar = pbar
+                        self.node = None  # Re-select node
+            # (end of step loop)
+        # (end of block loop)
+
+    def MeasureStep(self, step):
+        '''
+        Apply one of the {0,+,-,0} test voltages (assumes negative
+        gain) and measure one or more I/P nodes under it. Rows already
+        done (before a resume, or before a pause) are skipped.
+        '''
+        abs_V3 = step.abs_V3
+        todo = []
+        for (node, row) in step.rows:
+            key = journal.StepKey(abs_V3, node, step.i_mask)
+            if key in self.done:  # Completed already
+                self.next_row = max(self.next_row, row + 1)
+                self.pbar = max(self.pbar, self.done[key]['pbar'])
+            else:
+                todo.append((node, row))
+        if len(todo) == 0:
+            return
+
+        self.ctrl.restartable = True
+        try:
+            self.MeasureRows(step, todo)
+        finally:
+            self.ctrl.restartable = False
+
+    def MeasureRows(self, step, todo):
+        # Measure rows todo [(node, row),...] of step
+        abs_V3 = step.abs_V3
+        V3_mask = step.V3_mask
+        self.Vout = abs_V3*V3_mask  # Nominal output
+        self.V1_set = -1.0*self.Vout*self.Rs/self.DUC_G
+        if abs(self.V1_set) == 0:
+            self.V1_set = 0.0
+        print'I/P test-V =', self.V1_set, '\tO/P test-V =',self.Vout
+
+        self.ui.Status('AqnThread.run():', 0)
+        self.ui.Status('I/P test-V = ' + str(self.V1_set) +
+                       '. O/P test-V = ' + str(self.Vout), 1)
+
+        node = todo[0][0]
+        timeline.SetRow(todo[0][1])  # Setting up V counts to 1st row
+        if node != self.node:
+            self.SetNode(node)
+        self.SetUpMeasThisRow(node)  # Clear F5520A errors, data
+        self.ctrl.Wait(3, 'post-CheckErr delay')  # Wait 3s after checking F5520A error
 
-                for V3_mask in TEST_V_MASK:
-                    '''
-                    Loop over {0,+,-,0} test voltages (assumes negative gain)
-                    '''
-                    self.Vout = abs_V3*V3_mask  # Nominal output
-                    self.V1_set = -1.0*self.Vout*self.Rs/self.DUC_G
-                    if abs(self.V1_set) == 0:
-                        self.V1_set = 0.0
-                    print'I/P test-V =', self.V1_set, '\tO/P test-V =',self.Vout
-
-                    stat_ev = evts.StatusEvent(msg='AqnThread.run():', field=0)
-                    wx.PostEvent(self.TopLevel, stat_ev)
-                    stat_ev = evts.StatusEvent(msg='I/P test-V = ' +
-                                               str(self.V1_set) +
-                                               '. O/P test-V = ' +
-                                               str(self.Vout), field=1)
-                    wx.PostEvent(self.TopLevel, stat_ev)
-
-                    self.SetUpMeasThisRow(node)  # Clear F5520A errors, data
-                    if self._want_abort:
-                        self.AbortRun()
-                        return
-                    time.sleep(3)  # Wait 3s after checking F5520A error
-
-                    '''
-                    Set DVM ranges to suit voltages that they're
-                    about to be exposed to. Start on 10V range:
-                    '''
-                    devices.ROLES_INSTR['DVM12'].SendCmd('DCV AUTO')
-                    devices.ROLES_INSTR['DVM3'].SendCmd('DCV AUTO')
-                    time.sleep(0.5)  # wait 0.5s after setting range
-                    
-                    print 'Aqn_thread.run(): masked V1_set =',self.V1_set
-                    self.RunPage.V1Setting.SetValue(str(self.V1_set))
-                    time.sleep(0.5)  # wait 0.5s after setting V
-                    if self.V1_set == 0:
-                        devices.ROLES_INSTR['SRC'].Oper()  # Over-ride 0V STBY
-                    if self._want_abort:
-                        self.AbortRun()
-                        return
-                    time.sleep(30)  # wait 30s after applying V
-                    
-#                    cmd = 'DCV ' + str(abs(self.Vout))
-#                    print'DVM3 range cmd:',cmd
-#                    devices.ROLES_INSTR['DVM3'].SendCmd(cmd)
+        '''
+        Set DVM ranges to suit voltages that they're
+        about to be exposed to. Start on 10V range:
+        '''
+        devices.ROLES_INSTR['DVM12'].Cmd('autorange')
+        devices.ROLES_INSTR['DVM3'].Cmd('autorange')
+        self.ctrl.Wait(0.5, 'post-range delay')  # wait 0.5s after setting range
+
+        print 'Aqn_thread.run(): masked V1_set =',self.V1_set
+        self.ui.SetV1(self.V1_set)
+        self.ctrl.Wait(0.5, 'post-SetV delay')  # wait 0.5s after setting V
+        if self.V1_set == 0:
+            devices.ROLES_INSTR['SRC'].Oper()  # Over-ride 0V STBY
+        # wait (up to 35s) for V to settle after applying it
+        settle_t = self.WaitToSettle(node, SETTLE_MAX_V)
+
+#        cmd = 'DCV ' + str(abs(self.Vout))
+#        print'DVM3 range cmd:',cmd
+#        devices.ROLES_INSTR['DVM3'].SendCmd(cmd)
 #
-#                    cmd = 'DCV ' + str(abs(self.V1_set))
-#                    print'DVM12 range cmd:',cmd
-#                    devices.ROLES_INSTR['DVM12'].SendCmd(cmd)
-
-#                    time.sleep(0.5)  # wait 0.5s after setting range
-
-                    if self._want_abort:
-                        self.AbortRun()
-                        return
-                    time.sleep(5)  # wait 5s after setting voltage
-
-                    # Prepare DVMs...
-                    stat_ev = evts.StatusEvent(msg='Preparing DVMs...',
-                                               field=1)
-                    wx.PostEvent(self.TopLevel, stat_ev)
-
-                    devices.ROLES_INSTR['DVM12'].SendCmd('LFREQ LINE')
-                    devices.ROLES_INSTR['DVM3'].SendCmd('LFREQ LINE')
-                    if self._want_abort:
-                        self.AbortRun()
-                        return
-                    time.sleep(3)
-
-                    devices.ROLES_INSTR['DVM12'].SendCmd('AZERO ONCE')
-                    devices.ROLES_INSTR['DVM3'].SendCmd('AZERO ON')
-                    if self._want_abort:
-                        self.AbortRun()
-                        return
-                    time.sleep(30)  # 30
-
-                    status_msg = 'Making {0:d} measurements each of {1:s} and V3 (V1_nom = {2:.2f} V)'.format(NREADS, node, self.V1_nom)
-                    print status_msg
-                    stat_ev = evts.StatusEvent(msg=status_msg, field=1)
-                    wx.PostEvent(self.TopLevel, stat_ev)
-
-                    for n in range(NREADS):  # Acquire all V and t readings
-                        self.MeasureV(node)
-                        self.MeasureV('V3')
-                        pbar += 1
-                        Update = {'node': '-', 'Vm': 0, 'Vsd': 0, 'time': '-',
-                                  'row': row, 'progress': 100.0*pbar/(P_MAX),
-                                  'end_flag': 0}
-
-                        update_ev = evts.DataEvent(ud=Update)
-                        wx.PostEvent(self.RunPage, update_ev)
-                        if self._want_abort:
-                            self.AbortRun()
-                            return
-                    print'\n'
-                    time.sleep(1)
-
-                    assert len(self.V12Data[node]) == NREADS,'Number of {0:s} readings != {1:d}!'.format(node, NREADS)
-                    assert len(self.Times) == NREADS,'Number of timestamps != {1:d}!'.format(NREADS)
-                    self.tm = dt.datetime.fromtimestamp(np.mean(self.Times)).strftime("%d/%m/%Y %H:%M:%S")
-                    self.V12m[node] = np.mean(self.V12Data[node])
-                    self.V12sd[node] = np.std(self.V12Data[node], ddof=1)
-                    print 'V12m[{0:s}] = {1:.6f}'.format(node, self.V12m[node])
-                    self.SetNode(node)
-                    Update = {'node': node, 'Vm': self.V12m[node],
-                              'Vsd': self.V12sd[node], 'time': self.tm,
-                              'row': row, 'progress': 100.0*pbar/(P_MAX),
-                              'end_flag': 0}
+#        cmd = 'DCV ' + str(abs(self.V1_set))
+#        print'DVM12 range cmd:',cmd
+#        devices.ROLES_INSTR['DVM12'].SendCmd(cmd)
+
+#        time.sleep(0.5)  # wait 0.5s after setting range
+
+        # Prepare DVMs...
+        self.ui.Status('Preparing DVMs...', 1)
+
+        devices.ROLES_INSTR['DVM12'].Cmd('line_sync')
+        devices.ROLES_INSTR['DVM3'].Cmd('line_sync')
+        self.ctrl.Wait(3, 'post-LFREQ delay')
+
+        devices.ROLES_INSTR['DVM12'].Cmd('azero_once')
+        devices.ROLES_INSTR['DVM3'].Cmd('azero_on')
+        self.ctrl.Check()
+        settle_t += self.WaitToSettle(node, SETTLE_MAX_AZ)
+
+        for (node, row) in todo:  # Measure each node under this V
+            timeline.SetRow(row)
+            if node != self.node:
+                '''
+                Test V is already applied and settled - only the
+                I/P relay (and so DVM12's reading) changes
+                '''
+                self.SetNode(node)
+                self.SetUpMeasThisRow(node)
+                settle_t = self.WaitToSettle(node, SETTLE_MAX_AZ)
+            self.env.StartWindow()  # Average env. data over this row
+            self.ctrl.Check()
+            print 'AqnThread.run(): row %d settled in %.1f s' % (row, settle_t)
+            print >>self.log, 'AqnThread.run(): row %d settled in %.1f s' % (row, settle_t)
+
+            status_msg = 'Making {0:d} measurements each of {1:s} and V3 (V1_nom = {2:.2f} V)'.format(NREADS, node, self.V1_nom)
+            print status_msg
+            self.ui.Status(status_msg, 1)
+
+            if SAMPLE_MODE in ('concurrent', 'burst', 'auto'):
+                if SAMPLE_MODE in ('burst', 'auto') and self.CanBurst():
+                    # Both DVMs fill their memories, then transfer
+                    self.MeasureVBurst(node)
+                else:  # Read both DVMs at once, on separate threads
+                    self.MeasureVConcurrent(node)
+                self.pbar += NREADS
+                Update = {'node': '-', 'Vm': 0, 'Vsd': 0, 'time': '-',
+                          'row': row, 'progress': 100.0*self.pbar/(P_MAX),
+                          'end_flag': 0}
 
-                    update_ev = evts.DataEvent(ud=Update)
-                    wx.PostEvent(self.RunPage, update_ev)
-                    self.IPrange = float(devices.ROLES_INSTR['DVM12'].SendCmd('RANGE?'))
-
-                    time.sleep(2)  # Give user time to read values before update
-
-                    assert len(self.V3Data) == NREADS,'Number of V3 readings != {1:d}!'.format(NREADS)
-                    self.V3m = np.mean(self.V3Data)
-                    self.V3sd = np.std(self.V3Data, ddof=1)
-                    self.T = devices.ROLES_INSTR['GMH'].Measure('T')
-                    self.OPrange = float(devices.ROLES_INSTR['DVM3'].SendCmd('RANGE?'))
-
-                    self.SetNode('V3')
-                    Update = {'node': 'V3', 'Vm': self.V3m, 'Vsd': self.V3sd,
-                              'time': self.tm, 'row': row, 'end_flag': 0}
-                    update_ev = evts.DataEvent(ud=Update)
-                    wx.PostEvent(self.RunPage, update_ev)
-
-                    if self._want_abort:
-                        self.AbortRun()
-                        return
-                    stat_ev = evts.StatusEvent(msg="Post-acqisn. delay (5s)",
-                                               field=1)
-                    wx.PostEvent(self.TopLevel, stat_ev)
-                    time.sleep(5)
-
-                    # Record room conditions
-                    self.Troom = devices.ROLES_INSTR['GMHroom'].Measure('T')
-                    self.Proom = devices.ROLES_INSTR['GMHroom'].Measure('P')
-                    self.RHroom = devices.ROLES_INSTR['GMHroom'].Measure('RH')
-
-                    self.WriteDataThisRow(row, node)
-                    self.PlotThisRow(row, node)
-                    time.sleep(1)
-                    row += 1
-
-                    # Reset start row for next measurement
-                    self.ws['B1'].value = row+3
-                # (end of V3_mask loop)
-            # (end of node loop)
-        # (end of abs_V3 loop)
+                self.ui.Data(Update)
+                self.ctrl.Check()
+            else:
+                for n in range(NREADS):  # Acquire all V and t readings
+                    self.MeasureV(node)
+                    self.MeasureV('V3')
+                    self.pbar += 1
+                    Update = {'node': '-', 'Vm': 0, 'Vsd': 0,
+                              'time': '-', 'row': row,
+                              'progress': 100.0*self.pbar/(P_MAX),
+                              'end_flag': 0}
 
-        self.FinishRun()
-        return
+                    self.ui.Data(Update)
+                    self.ctrl.Check()
+            print'\n'
+            self.ctrl.Wait(1)
+
+            assert len(self.V12Data[node]) == NREADS,'Number of {0:s} readings != {1:d}!'.format(node, NREADS)
+            assert len(self.Times) == NREADS,'Number of timestamps != {1:d}!'.format(NREADS)
+            self.tm = dt.datetime.fromtimestamp(np.mean(self.Times)).strftime("%d/%m/%Y %H:%M:%S")
+            self.V12m[node] = np.mean(self.V12Data[node])
+            self.V12sd[node] = np.std(self.V12Data[node], ddof=1)
+            print 'V12m[{0:s}] = {1:.6f}'.format(node, self.V12m[node])
+            self.SetNode(node)
+            Update = {'node': node, 'Vm': self.V12m[node],
+                      'Vsd': self.V12sd[node], 'time': self.tm,
+                      'row': row, 'progress': 100.0*self.pbar/(P_MAX),
+                      'end_flag': 0}
+
+            self.ui.Data(Update, urgent=True)  # Row result
+            self.IPrange = devices.ROLES_INSTR['DVM12'].GetRange()
+
+            self.ctrl.Wait(2, 'display delay')  # Give user time to read values before update
+
+            assert len(self.V3Data) == NREADS,'Number of V3 readings != {1:d}!'.format(NREADS)
+            self.V3m = np.mean(self.V3Data)
+            self.V3sd = np.std(self.V3Data, ddof=1)
+            # Environmental conditions, averaged over this row
+            env = self.env.Snapshot()
+            self.T = env['T']
+            self.Troom = env['Troom']
+            self.Proom = env['Proom']
+            self.RHroom = env['RHroom']
+            self.PtR = env['PtR']
+            self.OPrange = devices.ROLES_INSTR['DVM3'].GetRange()
+
+            self.SetNode('V3')
+            Update = {'node': 'V3', 'Vm': self.V3m, 'Vsd': self.V3sd,
+                      'time': self.tm, 'row': row, 'end_flag': 0}
+            self.ui.Data(Update, urgent=True)  # Row result
+
+            self.ui.Status("Post-acqisn. delay (5s)", 1)
+            self.ctrl.Wait(5, 'post-acquisition delay')
+
+            cells = self.WriteDataThisRow(row, node)
+            self.journal.RecordRow(abs_V3, node, V3_mask,
+                                   step.i_mask, row, self.pbar, cells)
+            key = journal.StepKey(abs_V3, node, step.i_mask)
+            self.done[key] = {'row': row, 'pbar': self.pbar, 'cells': cells}
+            self.PlotThisRow(row, node)
+            self.next_row = max(self.next_row, row + 1)
+            timeline.SetRow(None)
+
+            # Reset start row for next measurement
+            self.writer.Put('Data', 'B1', self.next_row+3)
+            self.ctrl.Wait(1)
+        # (end of node loop)
+
+    def SetConfig(self, config):
+        # Make config (a dictionary) the current run configuration
+        self.config = config
+        self.run_id = config['run_id']
+        self.Comment = config['comment']
+        self.DUC_G = config['DUC_G']
+        self.Rs = config['Rs']
+        self.start_row = config['start_row']
+        self.settle_time = config['settle_time']
+
+        self.ui.StartRow(self.start_row)
+
+    def BeginRun(self):
+        # Headings, data sink and journal for the current run configuration
+        self.WriteHeadings()
+        self.sink.Open(self.run_id, DATA_HEADINGS)
+        if self.resume:
+            self.journal.Reopen()
+            self.RestoreDoneRows()
+        else:
+            self.journal.Begin(self.config)
+
+    @timeline.traced('aqn')
+    def SelectRs(self):
+        # Select Rs in the IV-box, as RunPage.OnRs() (if relay-switchable)
+        name = batch.RsName(self.Rs)
+        if name in batch.RS_SWITCHABLE:
+            s = devices.IVBOX_CONFIGS[name]
+            print'AqnThread.SelectRs(): Sending IVbox "', s, '" (Rs =', name, ')'
+            devices.ROLES_INSTR['IVbox'].SendCmd(s)
+            self.ctrl.Wait(1)
 
+    @timeline.traced('aqn')
+    def AnalyseThisRun(self):
+        '''
+        End one run of a batch: make its data durable, then have the
+        Analysis page analyse it (on the GUI thread) and wait until done.
+        '''
+        self.sink.Close()
+        self.journal.End('completed')
+        self.writer.Flush()  # All of this run's rows are now in the workbook
+        self.ui.Status('Analysing run ' + self.run_id, 1)
+        self.ui.Analyse(self.start_row)  # Blocks until done
+        self.writer.Save(self.xlfilename, wait=True)
+        timeline.Export(self.xlfilename, self.log)  # One trace per run
+
+    @timeline.traced('aqn')
     def SetNode(self, node):
         '''
         Update Node ComboBox and Change I/P node relays in IV-box
         '''
         print'AqnThread.SetNode(): ', node
-        self.RunPage.Node.SetValue(node)  # Update widget value
+        self.ui.Data({'node': node})  # Update widget value
         s = node[1]
         if s in ('1', '2'):
             print'AqnThread.SetNode():Sending IVbox "', s, '"'
             devices.ROLES_INSTR['IVbox'].SendCmd(s)
+            self.node = node
         else:  # '3'
             print'AqnThread.SetNode():IGNORING IVbox cmd "', s, '"'
-        time.sleep(1)
+        self.ctrl.Wait(1)
 
+    @timeline.traced('aqn')
     def PlotThisRow(self, row, node):
         # Plot data
         Dates = []
@@ -371,30 +514,20 @@ class AqnThread(Thread):
         if row == self.start_row:
             clear_plot = 1  # start each run with a clear plot
 
-        plot_ev = evts.PlotEvent(t=Dates, V12=self.V12Data[node],
-                                 V3=self.V3Data, clear=clear_plot, node=node)
-        wx.PostEvent(self.PlotPage, plot_ev)
+        self.ui.Plot(Dates, self.V12Data[node], self.V3Data, clear_plot, node)
 
+    @timeline.traced('aqn')
     def WriteHeadings(self):
         Id_row = self.start_row-2  # Headings
-        self.ws['A'+str(Id_row)].font = Font(b=True)
-        self.ws['A'+str(Id_row)] = 'Run ID:'
-        self.ws['B'+str(Id_row)].font = Font(b=True)
-        self.ws['B'+str(Id_row)] = self.RunPage.run_id
+        self.writer.Put('Data', 'A'+str(Id_row), 'Run ID:', font=Font(b=True))
+        self.writer.Put('Data', 'B'+str(Id_row), self.run_id,
+                        font=Font(b=True))
 
         Head_row = self.start_row-1  # Headings
 
-        col_headings = {'A': 'Comment', 'B': 'DUC gain (V/A)', 'C': 'Rs (Ohm)',
-                        'D': 'I/P node (V1,V2?)', 'E': 'Date, time',
-                        'F': 'N meas.', 'G': 'Nom. Vout ', 'H': 'O/P V (V3)',
-                        'I': 'Stdev', 'J': 'I/P V (V1 or V2)', 'K': 'Stdev',
-                        'L': 'T(GMH)', 'M': 'Pt (DVM)', 'N': 'IP DVM range',
-                        'O': 'OP DVM range', 'P': 'T (room)', 'Q': 'P (room)',
-                        'R': 'RH (room)', 'S': 'Role',
-                        'T': 'Instrument description'}
-        for k in col_headings.keys():
-            self.ws[k+str(Head_row)] = col_headings[k]
+        self.writer.PutRow('Data', Head_row, DATA_HEADINGS)
 
+    @timeline.traced('aqn')
     def WriteInstrAssignments(self):
         '''
         Record all roles and corresponding instrument descriptions in XL sheet
@@ -406,27 +539,24 @@ class AqnThread(Thread):
         bord_r = Border(right=Side(style='thin'))
         bord_bl = Border(bottom=Side(style='thin'), left=Side(style='thin'))
         bord_br = Border(bottom=Side(style='thin'), right=Side(style='thin'))
-        for r in devices.ROLES_WIDGETS.keys():
+        for r in self.roles.keys():
             if role_row == self.start_row:  # 1st row
-                self.ws['S'+str(role_row)].border = bord_tl
-                self.ws['T'+str(role_row)].border = bord_tr
+                bord_S, bord_T = bord_tl, bord_tr
             elif role_row == self.start_row + 6:  # last row
-                self.ws['S'+str(role_row)].border = bord_bl
-                self.ws['T'+str(role_row)].border = bord_br
+                bord_S, bord_T = bord_bl, bord_br
             else:  # in-between rows
-                self.ws['S'+str(role_row)].border = bord_l
-                self.ws['T'+str(role_row)].border = bord_r
-            self.ws['S'+str(role_row)] = r
-            d = devices.ROLES_WIDGETS[r]['icb'].GetValue()  # descr
-            self.ws['T'+str(role_row)] = d
+                bord_S, bord_T = bord_l, bord_r
+            self.writer.Put('Data', 'S'+str(role_row), r, border=bord_S)
+            d = self.roles[r]  # descr
+            self.writer.Put('Data', 'T'+str(role_row), d, border=bord_T)
             role_row += 1
 
+    @timeline.traced('aqn')
     def initialise(self):
-        stat_ev = evts.StatusEvent(msg='Initialising instruments...', field=0)
-        wx.PostEvent(self.TopLevel, stat_ev)
+        self.ui.Status('Initialising instruments...', 0)
 
         for r in devices.ROLES_INSTR.keys():
-            d = devices.ROLES_WIDGETS[r]['icb'].GetValue()
+            d = self.roles[r]
 
             # Open non-GMH devices:
             if 'GMH' not in devices.ROLES_INSTR[r].Descr:
@@ -437,26 +567,26 @@ class AqnThread(Thread):
                 print'AqnThread.initialise(): %s already open' % d
                 print >>self.log, 'AqnThread.initialise(): %s already open' % d
 
-            stat_ev = evts.StatusEvent(msg=d, field=1)
-            wx.PostEvent(self.TopLevel, stat_ev)
+            self.ui.Status(d, 1)
             devices.ROLES_INSTR[r].Init()
-            time.sleep(1)
-        stat_ev = evts.StatusEvent(msg='Done', field=0)
-        wx.PostEvent(self.TopLevel, stat_ev)
+            self.ctrl.Wait(1)
+        self.ui.Status('Done', 0)
 
+    @timeline.traced('aqn')
     def SetUpMeasThisRow(self, node):
 #        devices.ROLES_INSTR['DVM12'].SendCmd('DCV AUTO')
 #        devices.ROLES_INSTR['DVM3'].SendCmd('DCV AUTO')
-        d = devices.ROLES_INSTR['SRC'].Descr
-        if 'F5520A' in d:
-            err = devices.ROLES_INSTR['SRC'].CheckErr()  # 'ERR?','*CLS'
-            print'Cleared F5520A error:', err
-            print >>self.log, 'Cleared F5520A error:', err
+        src = devices.ROLES_INSTR['SRC']
+        if src.Can('err_queue'):
+            err = src.CheckErr()  # e.g. 'ERR?','*CLS'
+            print'Cleared %s error:' % src.Descr, err
+            print >>self.log, 'Cleared %s error:' % src.Descr, err
 
         del self.V12Data[node][:]
         del self.V3Data[:]
         del self.Times[:]
 
+    @timeline.traced('aqn')
     def MeasureV(self, node):
         assert node in ('V1', 'V2', 'V3'), 'Unknown argument to MeasureV().'
         '''
@@ -470,7 +600,7 @@ class AqnThread(Thread):
                 self.V12Data['V1'].append(dvmOP)
             else:
                 dvmOP = devices.ROLES_INSTR['DVM12'].Read()
-                V = float(filter(self.filt, dvmOP))
+                V = replies.ParseReply(dvmOP)
 #                assert V <= 1.2*self.V1_set, 'DVM12 reading(V1) = ' + str(V)
                 self.V12Data['V1'].append(V)
 
@@ -481,7 +611,7 @@ class AqnThread(Thread):
                 self.V12Data['V2'].append(dvmOP)
             else:
                 dvmOP = devices.ROLES_INSTR['DVM12'].Read()
-                V = float(filter(self.filt, dvmOP))
+                V = replies.ParseReply(dvmOP)
 #                assert V <= 0.12, 'DVM12 reading(V2) = ' + str(V)
                 self.V12Data['V2'].append(V)
 
@@ -493,101 +623,297 @@ class AqnThread(Thread):
                 self.V3Data.append(dvmOP)
             else:
                 dvmOP = devices.ROLES_INSTR['DVM3'].Read()
-                V = float(filter(self.filt, dvmOP))
+                V = replies.ParseReply(dvmOP)
                 print'dvmOP =',V
 #                assert V <= 1.2*self.Vout, 'DVM3 reading = {0}, Vout = {1}'.format(V, self.Vout)
                 self.V3Data.append(V)
 
-        time.sleep(0.1)
+        self.ctrl.Wait(0.1)
         return 1
 
-    def WriteDataThisRow(self, row, node):
-        stat_ev = evts.StatusEvent(msg='AqnThread.WriteDataThisRow():',
-                                   field=0)
-        wx.PostEvent(self.TopLevel, stat_ev)
-        stat_ev = evts.StatusEvent(msg='Row '+str(row), field=1)
-        wx.PostEvent(self.TopLevel, stat_ev)
-
-        self.ws['A'+str(row)] = self.Comment
-        self.ws['B'+str(row)] = self.DUC_G
-        self.ws['C'+str(row)] = self.Rs
-        self.ws['D'+str(row)] = node
-        self.ws['E'+str(row)] = str(dt.datetime.fromtimestamp(np.mean(self.Times)).strftime("%d/%m/%Y %H:%M:%S"))
-        self.ws['F'+str(row)] = NREADS
-        self.ws['G'+str(row)] = self.Vout  # Nominal output
-        self.ws['H'+str(row)] = self.V3m  # Measured output
-        self.ws['I'+str(row)] = self.V3sd
-        self.ws['J'+str(row)] = self.V12m[node]
-        self.ws['K'+str(row)] = self.V12sd[node]
-        self.ws['L'+str(row)] = self.T
-        if devices.ROLES_INSTR['DVMT'].demo is True:
-            TdvmOP = np.random.normal(108.0, 1.0e-2)
+    @timeline.traced('aqn')
+    def WaitToSettle(self, node, max_wait):
+        '''
+        Repeatedly read node (DVM12) and V3 (DVM3) until both readings
+        have settled (see settle.py), the run is aborted or max_wait
+        seconds have passed. Returns the time actually spent waiting.
+        '''
+        t_start = time.time()
+        if not ADAPTIVE_SETTLE:
+            self.ctrl.Wait(max_wait, 'settle')
+            return max_wait
+
+        if node == 'V1':
+            V12_nom = self.V1_set
+        else:
+            V12_nom = 0.0
+        det12 = settle.SettleDetector(V12_nom)
+        det3 = settle.SettleDetector(self.Vout)
+        dvm12 = devices.ROLES_INSTR['DVM12']
+        dvm3 = devices.ROLES_INSTR['DVM3']
+
+        self.ui.Status('Waiting for %s and V3 to settle (max %d s)...' % (node, max_wait), 1)
+
+        settled = False
+        while time.time() - t_start < max_wait:
+            self.ctrl.Check()
+            if dvm12.demo is True:
+                V12 = np.random.normal(V12_nom, 1.0e-5*abs(self.V1_set)+1e-6)
+                self.ctrl.Wait(0.1)
+            else:
+                V12 = replies.ParseReply(dvm12.Read())
+            det12.Add(time.time(), V12)
+            if dvm3.demo is True:
+                V3 = np.random.normal(self.Vout, 1.0e-5*abs(self.Vout)+1e-6)
+                self.ctrl.Wait(0.1)
+            else:
+                V3 = replies.ParseReply(dvm3.Read())
+            det3.Add(time.time(), V3)
+
+            settled_12 = det12.IsSettled()
+            settled_3 = det3.IsSettled()
+            settled = settled_12 and settled_3
+            if settled and time.time() - t_start >= SETTLE_MIN:
+                break
+
+        waited = time.time() - t_start
+        if not settled:
+            print'AqnThread.WaitToSettle(): NOT settled after %.1f s' % waited
+            print >>self.log, 'AqnThread.WaitToSettle(): NOT settled after %.1f s' % waited
+        print'AqnThread.WaitToSettle():', node, det12.Summary()
+        print'AqnThread.WaitToSettle(): V3', det3.Summary()
+        return waited
+
+    def CanBurst(self):
+        # Both DVMs have burst memory and a binary format in common
+        dvm12 = devices.ROLES_INSTR['DVM12']
+        dvm3 = devices.ROLES_INSTR['DVM3']
+        return (dvm12.CanBurst() and dvm3.CanBurst() and
+                drivers.BestFormat([dvm12.driver, dvm3.driver]) is not None)
+
+    @timeline.traced('aqn')
+    def MeasureVBurst(self, node):
+        '''
+        Trigger an NREADS-reading burst on both DVMs (DVM12 and DVM3), then
+        fetch each burst as a single binary block, in the fastest format
+        both support (BURST_FORMAT, if they can). Each reading is timed
+        from its DVM's trigger at the programmed interval (NPLC) and the
+        i'th readings from the two DVMs are paired.
+        '''
+        dvm12 = devices.ROLES_INSTR['DVM12']
+        dvm3 = devices.ROLES_INSTR['DVM3']
+        fmt = drivers.BestFormat([dvm12.driver, dvm3.driver], BURST_FORMAT)
+        dvm12.ArmBurst(NREADS, fmt)
+        dvm3.ArmBurst(NREADS, fmt)
+        V12, t12 = dvm12.FetchBurst(self.ctrl.Stopping)
+        V3, t3 = dvm3.FetchBurst(self.ctrl.Stopping)
+        self.ctrl.Check()  # Burst cut short by abort / pause?
+        self.V12Data[node].extend(V12)
+        self.V3Data.extend(V3)
+        self.Times.extend((t12 + t3)/2.0)
+        print'AqnThread.MeasureVBurst(): %s burst %.3f s, V3 burst %.3f s, trigger skew %.3f s' % (node, t12[-1] - t12[0], t3[-1] - t3[0], t3[0] - t12[0])
+        return 1
+
+    @timeline.traced('aqn')
+    def MeasureVConcurrent(self, node):
+        '''
+        Take NREADS readings of node (DVM12) and V3 (DVM3) at the same time,
+        using one DVMReader thread per DVM. Both take exactly NREADS
+        readings, so the i'th readings are paired (each reading is used
+        once) - the timestamps only give the pair's mean time and the
+        skew report.
+        '''
+        assert node in ('V1', 'V2'), 'Unknown argument to MeasureVConcurrent().'
+        if node == 'V1':
+            V12_nom = self.V1_set
         else:
-            TdvmOP = devices.ROLES_INSTR['DVMT'].Read()  # .SendCmd('READ?')
-        self.ws['M'+str(row)] = float(filter(self.filt, TdvmOP))
-        self.ws['N'+str(row)] = self.IPrange
-        self.ws['O'+str(row)] = self.OPrange
-        self.ws['P'+str(row)] = self.Troom
-        self.ws['Q'+str(row)] = self.Proom
-        self.ws['R'+str(row)] = self.RHroom
+            V12_nom = 0.0
+        V12_sd = 1.0e-5*abs(self.V1_set)+1e-6
+        V3_sd = 1.0e-5*abs(self.Vout)+1e-6
+
+        def abort_fn():
+            return self.ctrl.Stopping()
+
+        rdr12 = DVMReader('DVM12', NREADS,
+                          lambda: np.random.normal(V12_nom, V12_sd),
+                          abort_fn)
+        rdr3 = DVMReader('DVM3', NREADS,
+                         lambda: np.random.normal(self.Vout, V3_sd),
+                         abort_fn)
+        rdr12.start()
+        rdr3.start()
+        rdr12.join()
+        rdr3.join()
+        for rdr in (rdr12, rdr3):
+            if rdr.error is not None:
+                raise rdr.error
+        self.ctrl.Check()  # Stopped early by abort / pause?
+        if len(rdr12.V) == 0 or len(rdr3.V) == 0:
+            return 0
+
+        assert len(rdr12.V) == len(rdr3.V), 'Unequal numbers of %s and V3 readings!' % node
+        t12 = np.array(rdr12.t)
+        t3 = np.array(rdr3.t)
+        self.V12Data[node].extend(rdr12.V)
+        self.V3Data.extend(rdr3.V)
+        self.Times.extend((t12 + t3)/2.0)
+        skew = np.max(np.abs(t12 - t3))
+        print'AqnThread.MeasureVConcurrent(): max. %s-V3 time skew = %.3f s' % (node, skew)
+        print >>self.log, 'AqnThread.MeasureVConcurrent(): max. %s-V3 time skew = %.3f s' % (node, skew)
+        return 1
 
-        # Save after every row
-        self.wb_io.save(self.xlfilename)
+    @timeline.traced('aqn')
+    def WriteDataThisRow(self, row, node):
+        self.ui.Status('AqnThread.WriteDataThisRow():', 0)
+        self.ui.Status('Row '+str(row), 1)
+
+        cells = {'A': self.Comment,
+                 'B': self.DUC_G,
+                 'C': self.Rs,
+                 'D': node,
+                 'E': str(dt.datetime.fromtimestamp(np.mean(self.Times)).strftime("%d/%m/%Y %H:%M:%S")),
+                 'F': NREADS,
+                 'G': self.Vout,  # Nominal output
+                 'H': self.V3m,  # Measured output
+                 'I': self.V3sd,
+                 'J': self.V12m[node],
+                 'K': self.V12sd[node],
+                 'L': self.T,
+                 'M': self.PtR,  # Averaged by self.env
+                 'N': self.IPrange,
+                 'O': self.OPrange,
+                 'P': self.Troom,
+                 'Q': self.Proom,
+                 'R': self.RHroom}
+        self.writer.PutRow('Data', row, cells)
+
+        # Persist after every row (whole-workbook save only if DATA_SINK='xlsx')
+        self.sink.WriteRow(row, cells)
+        return cells
+
+    def RestoreDoneRows(self):
+        '''
+        On resuming a run, re-write the rows completed before the
+        interruption (they may not have reached the saved workbook).
+        '''
+        for key in self.done:
+            rec = self.done[key]
+            self.writer.PutRow('Data', rec['row'], rec['cells'])
+        if len(self.done) > 0:
+            last_row = max(self.done[k]['row'] for k in self.done)
+            self.writer.Put('Data', 'B1', last_row+4)
+        print'AqnThread.RestoreDoneRows(): Resuming run', self.run_id, 'with', len(self.done), 'rows already done'
+        print >>self.log, 'AqnThread.RestoreDoneRows(): Resuming run', self.run_id, 'with', len(self.done), 'rows already done'
 
     def AbortRun(self):
-        # prematurely end run, prompted by regular checks of _want_abort flag
-        self.Standby()  # Set sources to 0V and leave system safe
+        '''
+        Prematurely end run - aborted (prompted by RunControl - see
+        runcontrol.py) or failed. Every step is attempted, even if an
+        earlier one fails, so the sources are left safe and the UI always
+        gets end_flag.
+        '''
+        steps = [('Standby', self.Standby)]  # Set sources to 0V first
+        if self.env is not None:
+            steps.append(('env.Stop', self.env.Stop))
+        steps += [('sink.Close', self.sink.Close),
+                  ('journal.End', lambda: self.journal.End('aborted')),
+                  ('writer.Save',  # Keep completed rows
+                   lambda: self.writer.Save(self.xlfilename, wait=True)),
+                  ('timeline.Export',
+                   lambda: timeline.Export(self.xlfilename, self.log))]
+        for (name, step) in steps:
+            try:
+                step()
+            except Exception as err:
+                print'AqnThread.AbortRun(): %s failed: %s' % (name, err)
+                print >>self.log, 'AqnThread.AbortRun(): %s failed: %s' % (name, err)
 
         Update = {'progress': 100.0, 'end_flag': 1}
-        stop_ev = evts.DataEvent(ud=Update)
-        wx.PostEvent(self.RunPage, stop_ev)
+        self.ui.Data(Update)
 
-        self.RunPage.StartBtn.Enable(True)
-        self.RunPage.StopBtn.Enable(False)
         print'\nRun aborted.'
 #        devices.ROLES_INSTR['DVM12'].SendCmd('DCV 10')
 #        devices.ROLES_INSTR['DVM3'].SendCmd('DCV 10')
 
     def FinishRun(self):
         # Run complete - leave system safe and final xl save
-        self.wb_io.save(self.xlfilename)
+        self.env.Stop()
+        self.sink.Close()
+        self.journal.End('completed')
+        self.writer.Save(self.xlfilename, wait=True)
+        timeline.Export(self.xlfilename, self.log)
 
         self.Standby()  # Set sources to 0V and leave system safe
 
         Update = {'progress': 100.0, 'end_flag': 1}
-        stop_ev = evts.DataEvent(ud=Update)
-        wx.PostEvent(self.RunPage, stop_ev)
+        self.ui.Data(Update)
 
-        stat_ev = evts.StatusEvent(msg='RUN COMPLETED', field=0)
-        wx.PostEvent(self.TopLevel, stat_ev)
-        stat_ev = evts.StatusEvent(msg='', field=1)
-        wx.PostEvent(self.TopLevel, stat_ev)
+        self.ui.Status('RUN COMPLETED', 0)
+        self.ui.Status('', 1)
 
-        self.RunPage.StartBtn.Enable(True)
-        self.RunPage.StopBtn.Enable(False)
 #        devices.ROLES_INSTR['DVM12'].SendCmd('DCV 10')
 #        devices.ROLES_INSTR['DVM3'].SendCmd('DCV 10')
 
     def Standby(self):
         # Set sources to 0V and disable outputs
-        devices.ROLES_INSTR['SRC'].Stby  # .SendCmd('R0=')
-        self.RunPage.V1Setting.SetValue(str(0))
+        src = devices.ROLES_INSTR['SRC']
+        src.SetV(0)
+        src.Stby()
+        self.ui.SetV1(0)
 
     def abort(self):
         """abort worker thread."""
         # Method for use by main thread to signal an abort
-        stat_ev = evts.StatusEvent(msg='abort(): Run aborted', field=0)
-        wx.PostEvent(self.TopLevel, stat_ev)
-        self._want_abort = 1
-        time.sleep(1)
-
-    def filt(self,char):
-        '''
-        A helper function to filter rubbish from DVM o/p unicode string
-        and retain any number (as a string)
-        '''
-        accept_str = u'-0.12345678eE9'
-        return char in accept_str  # Returns 'True' or 'False'
+        self.ui.Status('abort(): Run aborted', 0)
+        self.ctrl.Abort()
 
 
 """--------------End of Thread class definition-------------------"""
+
+
+def SetSource(V1):
+    # Set the source output to V1, in standby if V1 is 0 (as RunPage.OnV1Set())
+    src = devices.ROLES_INSTR['SRC']
+    src.SetV(V1)
+    time.sleep(0.5)
+    if V1 == 0:
+        src.Stby()
+    else:
+        src.Oper()
+    time.sleep(0.5)
+
+
+class DVMReader(Thread):
+    """
+    Worker thread that takes n timestamped readings from the DVM in one role.
+    Each timestamp is the mid-point of its Read() call. demo_fn supplies
+    readings when the DVM is in demo mode and abort_fn is polled between
+    readings.
+    """
+    def __init__(self, role, n, demo_fn, abort_fn):
+        Thread.__init__(self)
+        self.daemon = True
+        self.role = role
+        self.n = n
+        self.demo_fn = demo_fn
+        self.abort_fn = abort_fn
+        self.t = []
+        self.V = []
+        self.error = None
+
+    def run(self):
+        dvm = devices.ROLES_INSTR[self.role]
+        try:
+            for i in range(self.n):
+                if self.abort_fn():
+                    break
+                t0 = time.time()
+                if dvm.demo is True:
+                    V = self.demo_fn()
+                else:
+                    V = replies.ParseReply(dvm.Read())
+                t1 = time.time()
+                self.t.append((t0 + t1)/2.0)
+                self.V.append(V)
+        except Exception as err:  # Re-raised in the acquisition thread
+            self.error = err
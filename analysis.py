@@ -0,0 +1,506 @@
+# -*- coding: utf-8 -*-
+"""
+analysis.py
+
+Run analysis, separated from the GUI.
+The analysis is done in three steps, each usable on its own (none of them
+needs wx):
+* ReadRun() - read one run's rows from a Data sheet into plain run data
+  (a dict of numbers and strings - see ReadRun()),
+* Calculate() - the calibration calculation itself: offset adjustment,
+  V-drop across Rs, Pt-100 temperature, Rs temperature correction, input
+  current changes and their uncertainty budgets. Pure: it takes the run
+  data and the uncertain parameter views (params.ParamStore.Uncertain())
+  and returns the results, without touching a worksheet,
+* WriteResults() - write the results to a Results sheet.
+RunAnalysis strings them together for an open IVY workbook. CalcPage
+displays the returned summary; IVY_headless.py and reprocess.py use it
+without wx. Scripts can equally build the run data themselves and call
+Calculate() directly.
+"""
+
+import datetime as dt
+import time
+import math
+
+import GTC
+
+import batch
+import budget
+import params
+
+SEARCH_LIMIT = 24
+N_ROLES = 7  # 7 instrument roles in total
+
+'''
+ROW_COLS: {field: Data-sheet column} of the values read from each row of
+a run:
+Rs - nominal Rs value, node - measurement node (V1/V2 label), time -
+'dd/mm/yyyy HH:MM:SS' string, n - number of readings, Vout - nominal
+output voltage, V3, V3_u - DVM3 mean and std. uncert., V12, V12_u - DVM12
+mean and std. uncert., T_GMH - GMH (DUC) temperature, Pt_R - Pt-100
+resistance, P, RH - room pressure and RH.
+'''
+ROW_COLS = {'Rs': 'C', 'node': 'D', 'time': 'E', 'n': 'F', 'Vout': 'G',
+            'V3': 'H', 'V3_u': 'I', 'V12': 'J', 'V12_u': 'K', 'T_GMH': 'L',
+            'Pt_R': 'M', 'P': 'Q', 'RH': 'R'}
+
+RS_VAL_NAME = dict((batch.RS_VALUES[n], 'I-V ' + n) for n in batch.RS_NAMES)
+
+
+def GetStopRow(ws_Data, start_row):
+    # Last row of the run starting at start_row of Data sheet ws_Data
+    row = start_row
+    Test_Vs = []
+    '''
+    Don't search forever and
+    ignore final row:
+    '''
+    while row < start_row + SEARCH_LIMIT - 1:
+        NomVOP = ws_Data['G'+str(row)].value
+        if NomVOP in (None, 'Nom. Vout '):  # Ran out of data
+            print'Break row =', row
+            break
+        elif NomVOP in (0.1, 1, 10):
+            Test_Vs.append(NomVOP)
+        row += 1  # (0,-0.1, -1, -10 are just skipped)
+    Test_V_set = set(Test_Vs)
+    if len(Test_V_set) < 1:
+        print'GetStopRow(): Incomplete data! - ', Test_Vs
+        return start_row
+    else:
+        print 'GetStopRow(): Test Vs:', Test_V_set
+        return start_row + 4 * len(Test_Vs) - 1
+
+
+def GetInstrAssignments(ws_Data, start_row):
+    # {role: description} recorded alongside the run
+    role_descr = {}
+    for row in range(start_row, start_row + N_ROLES):
+        role = ws_Data['S' + str(row)].value
+        descrip = ws_Data['T' + str(row)].value
+        print {role: descrip}
+        assert role is not None, 'Instrument assignment: Missing role!'
+        assert descrip is not None, 'Instrument assignment: Missing description!'
+        role_descr[role] = descrip
+    return role_descr
+
+
+def ReadRun(ws_Data, start_row):
+    '''
+    Read the run whose data starts at row start_row of Data sheet ws_Data.
+    Returns the run data: {'start_row':, 'stop_row':, 'comment':,
+    'run_id':, 'DUC_gain':, 'roles': {role: description},
+    'rows': [{field: value},...]}, with one dict (see ROW_COLS) per row,
+    from start_row to stop_row.
+    '''
+    stop_row = GetStopRow(ws_Data, start_row)
+    rows = []
+    for r in range(start_row, stop_row + 1):
+        rows.append(dict((f, ws_Data[c+str(r)].value)
+                         for f, c in ROW_COLS.items()))
+    return {'start_row': start_row, 'stop_row': stop_row,
+            'comment': ws_Data['A'+str(start_row)].value,
+            'run_id': ws_Data['B'+str(start_row-2)].value,
+            'DUC_gain': ws_Data['B'+str(start_row)].value,
+            'roles': GetInstrAssignments(ws_Data, start_row),
+            'rows': rows}
+
+
+def GetNamefromComment(c):
+    return c[c.find('DUC: ') + 5: c.find(' monitored by GMH')]
+
+
+def GetMeanDate(times):
+    # Mean of times ('dd/mm/yyyy HH:MM:SS' strings), as the same format
+    t_av = 0.0
+    for s in times:
+        # Convert s to a Python datetime object:
+        t_dt = dt.datetime.strptime(s, '%d/%m/%Y %H:%M:%S')
+        t_tup = dt.datetime.timetuple(t_dt)  # A Python time tuple object
+        t_av += time.mktime(t_tup)  # time as float (seconds from epoch)
+    t_av /= len(times)
+    t_av_dt = dt.datetime.fromtimestamp(t_av)
+    return t_av_dt.strftime('%d/%m/%Y %H:%M:%S')  # av. time as string
+
+
+def get_gain_err_param(V):
+    if abs(V) < 0.001:
+        nomV = '0.0001'
+        nomRange = '0.1'
+    elif abs(V) < 0.022:
+        nomV = '0.01'
+        nomRange = '0.1'
+    elif abs(V) < 0.071:
+        nomV = '0.05'
+        nomRange = '0.1'
+    elif abs(V) < 0.22:
+        nomV = '0.1'
+        nomRange = '0.1'
+    elif abs(V) < 0.71:
+        nomV = '0.5'
+        nomRange = '1'
+    elif abs(V) < 2.2:
+        nomV = nomRange = '1'
+    else:
+        nomV = nomRange = str(int(abs(round(V))))  # '1' or '10'
+    gain_param = 'Vgain_{0}r{1}'.format(nomV, nomRange)
+    return gain_param
+
+
+def R_to_T(alpha, beta, R, R0, T0):
+    # Convert a resistive T-sensor reading from resistance to temperature
+    if (beta.x == 0 and beta.u == 0):  # No 2nd-order T-Co
+        T = GTC.result((R/R0 - 1)/alpha + T0)
+    else:
+        a = GTC.result(beta)
+        b = GTC.result(alpha - 2*beta*T0, True)
+        c = GTC.result(1 - alpha*T0 + beta*T0**2 - (R/R0))
+        T = GTC.result((-b + GTC.sqrt(b**2 - 4*a*c))/(2*a))
+    return T
+
+
+def Calculate(run, I_INFO, R_INFO):
+    '''
+    The calibration calculation for run data run (as ReadRun()), with
+    instrument and resistor parameters I_INFO and R_INFO (as
+    params.ParamStore.Uncertain()).
+    Returns {'DUC_name':, 'date':, 'T':, 'RH':, 'P':,
+    'results': [{'Vout':, 'I_pos':, 'I_neg':, 'k':, 'EU':,
+    'budget_pos':, 'budget_neg':},...]} - mean date, environmental
+    conditions (ureals) and one result per nominal output voltage, with
+    its uncertainty budgets (budget.Budget).
+    '''
+    role_descr = run['roles']
+    rows = run['rows']
+
+    # Correction for Pt-100 sensor DVM:
+    DVMT_cor = I_INFO[role_descr['DVMT']]['correction_100r']
+
+    '''
+    Pt sensor is a few cm away from input resistors, so assume a
+    fairly large type B Tdef of 0.1 deg C:
+    '''
+    Pt_T_def = GTC.ureal(0, GTC.type_b.distribution['gaussian'](0.1),
+                         3, label='Pt_T_def')
+    Pt_alpha = R_INFO['Pt 100r']['alpha']
+    Pt_beta = R_INFO['Pt 100r']['beta']
+    Pt_R0 = R_INFO['Pt 100r']['R0_LV']
+    Pt_TRef = R_INFO['Pt 100r']['TRef_LV']
+
+    '''
+    GMH sensor is a few cm away from DUC which, itself, has a size of
+    several cm, so assume a fairly large type B Tdef of 0.1 deg C:
+    '''
+    GMH_T_def = GTC.ureal(0, GTC.type_b.distribution['gaussian'](0.1),
+                          3, label='GMH_T_def')
+
+    calc = {'DUC_name': GetNamefromComment(run['comment']),
+            'date': GetMeanDate([r['time'] for r in rows]),
+            'results': []}
+    print 'Mean_date:', calc['date']
+
+    # Determine mean env. conditions
+    d = role_descr['GMH']
+    print'role:GMH ->', d
+    T_GMH_cor = I_INFO[d]['T_correction']  # deg C, additive, ureal
+    T_GMH_raw = GTC.ta.estimate_digitized([r['T_GMH'] for r in rows], 0.01)
+    calc['T'] = T_GMH_raw + T_GMH_cor + GMH_T_def
+
+    d = role_descr['GMHroom']
+    RH_cor = I_INFO[d]['RH_correction']
+    RH_raw = GTC.ta.estimate_digitized([r['RH'] for r in rows], 0.1)
+    calc['RH'] = RH_raw*(1 + RH_cor)
+
+    # Re-use d (same instrument description)
+    if 'P_correction' in I_INFO[d].keys():
+        P_cor = I_INFO[d]['P_correction']
+    else:
+        P_cor = GTC.ureal(0, 0)
+
+    P_raw = GTC.ta.estimate_digitized([r['P'] for r in rows], 0.1)
+    calc['P'] = P_raw*(1 + P_cor)
+
+    for i in range(0, len(rows) - 1, 8):  # One 8-row block per nom. Vout
+        block = rows[i:i+8]
+        influencies = []
+        V1s = []
+        V2s = []
+        V3s = []
+        gains = set()
+        # 'neg' and 'pos' refer to polarity of OUTPUT VOLTAGE, not
+        # input current!
+        neg_nom_Vout = block[1]['Vout']
+        pos_nom_Vout = block[2]['Vout']
+        abs_nom_Vout = pos_nom_Vout
+
+        # Construct ureals from raw voltage data, including gain correction
+        for n in range(4):
+            label_suffix_1 = block[n]['node']+'_'+str(n)
+            label_suffix_2 = block[4+n]['node']+'_'+str(n)
+            label_suffix_3 = 'V3' + '_' + str(n)
+
+            V1_v = block[n]['V12']
+            V1_u = block[n]['V12_u']
+            V1_d = block[n]['n'] - 1
+            V1_l = 'OP'+str(abs_nom_Vout)+'_'+label_suffix_1
+            d1 = role_descr['DVM12']
+            gain = I_INFO[d1][get_gain_err_param(V1_v)]
+            gains.add(gain)
+            V1_raw = GTC.ureal(V1_v, V1_u, V1_d, label=V1_l)
+            V1s.append(GTC.result(V1_raw/gain))
+
+            V2_v = block[4+n]['V12']
+            V2_u = block[4+n]['V12_u']
+            V2_d = block[4+n]['n'] - 1
+            V2_l = 'OP'+str(abs_nom_Vout)+'_'+label_suffix_2
+            d2 = role_descr['DVM12']
+            gain = I_INFO[d2][get_gain_err_param(V2_v)]
+            gains.add(gain)
+            V2_raw = GTC.ureal(V2_v, V2_u, V2_d, label=V2_l)
+            V2s.append(GTC.result(V2_raw/gain))
+
+            V3_v = block[n]['V3']
+            V3_u = block[n]['V3_u']
+            V3_d = block[n]['n'] - 1
+            V3_l = 'OP'+str(abs_nom_Vout)+'_'+label_suffix_3
+            d3 = role_descr['DVM3']
+            gain = I_INFO[d3][get_gain_err_param(V3_v)]
+            gains.add(gain)
+            V3_raw = GTC.ureal(V3_v, V3_u, V3_d, label=V3_l)
+            V3s.append(GTC.result(V3_raw/gain))
+
+            influencies.extend([V1_raw, V2_raw, V3_raw])
+
+        influencies.extend(list(gains))  # A list of unique gain corrections - no copies.
+        print 'list of gains:'
+        for g in list(gains):
+            print g.s
+
+        # Offset-adjustment
+        V1_pos = GTC.result(V1s[2] - (V1s[0] + V1s[3]) / 2)
+        V1_neg = GTC.result(V1s[1] - (V1s[0] + V1s[3]) / 2)
+        V2_pos = GTC.result(V2s[2] - (V2s[0] + V2s[3]) / 2)
+        V2_neg = GTC.result(V2s[1] - (V2s[0] + V2s[3]) / 2)
+        V3_pos = GTC.result(V3s[2] - (V3s[0] + V3s[3]) / 2)
+        V3_neg = GTC.result(V3s[1] - (V3s[0] + V3s[3]) / 2)
+
+        # V-drop across Rs
+        V_Rs_pos = GTC.result(V1_pos - V2_pos)
+        V_Rs_neg = GTC.result(V1_neg - V2_neg)
+
+        # Rs Temperature
+        T_Rs = []
+        Pt_R_cor = []
+        for r in range(8):
+            Pt_R_raw = block[r]['Pt_R']
+            Pt_R_cor.append(GTC.result(Pt_R_raw * (1 + DVMT_cor),
+                                       label='Pt_Rcor'+str(r)))
+            T_Rs.append(GTC.result(R_to_T(Pt_alpha, Pt_beta, Pt_R_cor[r],
+                                          Pt_R0, Pt_TRef)))
+
+        av_T_Rs = GTC.result(GTC.fn.mean(T_Rs),
+                             label='av_T_Rs'+str(abs_nom_Vout))
+        influencies.extend(Pt_R_cor)
+        influencies.extend([Pt_alpha, Pt_beta, Pt_R0, Pt_TRef,
+                            DVMT_cor, Pt_T_def])  # av_T_Rs
+
+        # Value of Rs
+        nom_Rs = block[0]['Rs']
+        print '\nNominal Rs value:', nom_Rs, 'Abs. Nom. Vout:', abs_nom_Vout, '\n'
+        Rs_name = RS_VAL_NAME[nom_Rs]
+        Rs_0 = R_INFO[Rs_name]['R0_LV']  # a ureal
+        Rs_TRef = R_INFO[Rs_name]['TRef_LV']  # a ureal
+        Rs_alpha = R_INFO[Rs_name]['alpha']
+        Rs_beta = R_INFO[Rs_name]['beta']
+
+        # Correct Rs value for temperature
+        dT = GTC.result(av_T_Rs - Rs_TRef + Pt_T_def)
+        Rs = GTC.result(Rs_0*(1 + Rs_alpha*dT + Rs_beta*dT**2))
+
+        influencies.extend([Rs_0, Rs_alpha, Rs_beta, Rs_TRef])
+
+        '''
+        Finally, calculate current-change in,
+        for nominal voltage-change out:
+        '''
+        Iin_pos = GTC.result(V_Rs_pos/Rs)
+        Iin_neg = GTC.result(V_Rs_neg/Rs)
+
+        I_pos = GTC.result(Iin_pos*pos_nom_Vout / V3_pos)
+        I_pos_k = GTC.rp.k_factor(I_pos.df)  # P = 95% by default
+        I_pos_EU = I_pos_k * I_pos.u
+        I_neg = GTC.result(Iin_neg*neg_nom_Vout/V3_neg)
+
+        # build uncertainty budget tables (one component per influence)
+        budget_pos = budget.Budget(I_pos, influencies)
+        budget_neg = budget.Budget(I_neg, influencies)
+        print'Budgets: %d influences, %d (I+) / %d (I-) non-zero' % (len(budget.Unique(influencies)), len(budget_pos), len(budget_neg))
+
+        calc['results'].append({'Vout': abs_nom_Vout, 'I_pos': I_pos,
+                                'I_neg': I_neg, 'k': I_pos_k,
+                                'EU': I_pos_EU, 'budget_pos': budget_pos,
+                                'budget_neg': budget_neg})
+    return calc
+
+
+def Write_Summary(ws_Results, row, version, run, calc):
+    '''
+    Write Run summary and result column-headings from row.
+    Return next row
+    '''
+    DELTA = u'\N{GREEK CAPITAL LETTER DELTA}'
+    proc_date = dt.datetime.now().strftime('%d/%m/%Y %H:%M:%S')
+    proc_string = 'Processesed by IVY v{} on {}'.format(version, proc_date)
+    ws_Results['H'+str(row)].value = proc_string
+    ws_Results['A'+str(row)].value = 'Comment:'
+    ws_Results['B'+str(row)].value = run['comment']
+    ws_Results['A'+str(row+1)].value = 'Run Id:'
+    ws_Results['B'+str(row+1)].value = run['run_id']
+    ws_Results['A'+str(row+2)].value = 'Date:'
+    ws_Results['B'+str(row+2)].value = calc['date']
+    ws_Results['A'+str(row+3)].value = 'DUC Name:'
+    ws_Results['B'+str(row+3)].value = calc['DUC_name']
+    ws_Results['A'+str(row+4)].value = 'Gain (V/A):'
+    ws_Results['B'+str(row+4)].value = run['DUC_gain']
+
+    ws_Results['C'+str(row+2)].value = 'Condition:'
+    ws_Results['C'+str(row+3)].value = 'Value:'
+    ws_Results['C'+str(row+4)].value = 'Exp Uncert.:'
+    ws_Results['C'+str(row+5)].value = 'Cov. factor:'
+
+    for col, quantity, heading in (('D', 'T', 'T (GMH)'),
+                                   ('E', 'RH', 'RH (%)'),
+                                   ('F', 'P', 'P (mBar)')):
+        Q = calc[quantity]
+        Q_k = GTC.rp.k_factor(Q.df)
+        ws_Results[col+str(row+2)].value = heading
+        ws_Results[col+str(row+3)].value = Q.x
+        ws_Results[col+str(row+4)].value = Q_k*Q.u
+        ws_Results[col+str(row+5)].value = Q_k
+
+    # Add blank line below summary
+    ws_Results['H'+str(row+6)].value = 'Uncertainty Budget:'
+    ws_Results['A'+str(row+7)].value = 'Nom. ' + DELTA + 'V'
+    ws_Results['B'+str(row+7)].value = DELTA + 'I in'
+    ws_Results['C'+str(row+7)].value = 'Std. u'
+    ws_Results['D'+str(row+7)].value = 'dof'
+    ws_Results['E'+str(row+7)].value = 'Exp. U'
+    ws_Results['F'+str(row+7)].value = 'k'
+    ws_Results['H'+str(row+7)].value = 'Quantity (label)'
+    ws_Results['I'+str(row+7)].value = 'Value'
+    ws_Results['J'+str(row+7)].value = 'Std. u'
+    ws_Results['K'+str(row+7)].value = 'dof'
+    ws_Results['L'+str(row+7)].value = 'Sens. Co.'
+    ws_Results['M'+str(row+7)].value = 'Uncert. Cont.'
+
+    return row+8
+
+
+def WritePolarity(sh, r, Vout, I, budget_table):
+    # Write one polarity's result and its sorted budget from row r
+    sh['A'+str(r)].value = Vout
+    sh['B'+str(r)].value = I.x
+    sh['C'+str(r)].value = I.u
+    sh['D'+str(r)].value = I.df
+    k = GTC.rp.k_factor(I.df)
+    sh['E'+str(r)].value = k*I.u
+    sh['F'+str(r)].value = k
+
+    for line in budget_table:
+        sh['H'+str(r)] = line[0]  # Quantity (label)
+        sh['I'+str(r)] = line[1]  # Value
+        sh['J'+str(r)] = line[2]  # Uncert.
+        if math.isinf(line[3]):
+            sh['K'+str(r)] = str(line[3])  # dof
+        else:
+            sh['K'+str(r)] = round(line[3])  # dof
+        sh['L'+str(r)] = line[4]  # Sens. coef.
+        sh['M'+str(r)] = line[5]  # Uncert. contrib.
+        r += 1
+    return r
+
+
+def WriteThisResult(ws_Results, r, result):
+    '''
+    Write results and uncert. budget for nom.Vout (BOTH polarities)
+    from row r. Return next row.
+    '''
+    print'WriteThisResult(): Starting result_row =', r
+
+    # Positive results 1st..
+    r = WritePolarity(ws_Results, r, result['Vout'], result['I_pos'],
+                      result['budget_pos'].Table())
+    r += 1  # Blank line between polarities
+
+    # ...then negative results...
+    r = WritePolarity(ws_Results, r, -1*result['Vout'], result['I_neg'],
+                      result['budget_neg'].Table())
+
+    print'WriteThisResult(): Final result_row =', r
+    ws_Results['B1'].value = r+1
+    return r+1  # Blank line between results
+
+
+def WriteResults(ws_Results, row, version, run, calc):
+    '''
+    Write the results calc (as Calculate()) of run data run to Results
+    sheet ws_Results from row. Return next row.
+    '''
+    row = Write_Summary(ws_Results, row, version, run, calc)
+    for result in calc['results']:
+        row = WriteThisResult(ws_Results, row, result)
+    return row
+
+
+class RunAnalysis(object):
+    """
+    Analysis of runs recorded in workbook wb. version is the IVY version
+    recorded with the results. store is the workbook's params.ParamStore,
+    if it's already been loaded.
+    """
+    def __init__(self, wb, version, store=None):
+        self.version = version
+        self.store = store  # params.ParamStore - parsed when needed if None
+        self.ws_Data = wb.get_sheet_by_name('Data')
+        self.ws_Params = wb.get_sheet_by_name('Parameters')
+        self.ws_Results = wb.get_sheet_by_name('Results')
+
+    def AnalyzeRun(self, start_row):
+        '''
+        Analyse the run whose data starts at row start_row of the Data
+        sheet and write the results to the Results sheet.
+        Returns a summary: {'start_row':, 'stop_row':, 'DUC_gain':,
+        'results': [{'Vout':, 'I_pos':, 'I_neg':, 'k':, 'EU':,
+        'budget_pos':, 'budget_neg':},...]}, with one result per nominal
+        output voltage (as Calculate()).
+        '''
+        print'Start row =', start_row
+        run = ReadRun(self.ws_Data, start_row)
+        print'Stop row =', run['stop_row']
+
+        # Set start row for next acquisition run:
+        self.ws_Data['B1'].value = run['stop_row'] + 4
+
+        print'Comment:', run['comment']
+        print'Run_Id:', run['run_id']
+        print'gain =', run['DUC_gain']
+
+        self.GetParams()  # Result: self.I_INFO, self.R_INFO
+        calc = Calculate(run, self.I_INFO, self.R_INFO)
+
+        WriteResults(self.ws_Results, self.ws_Results['B1'].value,
+                     self.version, run, calc)
+
+        return {'start_row': run['start_row'], 'stop_row': run['stop_row'],
+                'DUC_gain': run['DUC_gain'], 'results': calc['results']}
+
+    def GetParams(self):
+        '''
+        Resistor and instrument parameters, with uncertainties (see params.py)
+        '''
+        if self.store is None:
+            self.store = params.Parse(self.ws_Params)
+        self.I_INFO = self.store.Uncertain('instrument')
+        self.R_INFO = self.store.Uncertain('resistor')
+        print len(self.I_INFO), 'instruments,', len(self.R_INFO), 'resistors\n'
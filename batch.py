@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+batch.py
+
+Unattended batch runs.
+A batch is a list of run configurations (DUC gain, Rs, comment, settle
+delay) that one AqnThread measures back-to-back, analysing each run as
+soon as it's complete.
+
+A batch is read from a CSV file with a heading row, e.g.:
+    gain,Rs,comment,settle
+    1e6,1M,gain 1e6 range,600
+    1e7,1M,gain 1e7 range,60
+    1e5,100k,gain 1e5 range,60
+Rs is one of the RunPage Rs choices ('1k',... '1G').
+
+Only the 1k - 1M resistors can be selected by the IV-box relays, so every
+configuration using a larger Rs must use the same (manually-fitted) one.
+Optionally, configurations are re-ordered so that runs sharing an Rs are
+adjacent and the relays switch as few times as possible.
+"""
+
+import csv
+
+import devices
+
+RS_NAMES = ['1k', '10k', '100k', '1M', '10M', '100M', '1G']
+RS_VALUES = dict(zip(RS_NAMES, [1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9]))
+RS_SWITCHABLE = RS_NAMES[: 4]  # Relay-selected in the IV-box
+
+
+def RsName(Rs):
+    # Rs value -> RunPage Rs choice, e.g. 1e5 -> '100k'
+    for name in RS_NAMES:
+        if RS_VALUES[name] == Rs:
+            return name
+    raise ValueError('No standard resistor of %g Ohm' % Rs)
+
+
+def LoadBatch(path):
+    """
+    Read batch configurations from a CSV file.
+    Returns a list of dictionaries with keys 'DUC_G', 'Rs', 'comment' and
+    'settle_time'.
+    """
+    configs = []
+    with open(path, 'rb') as f:
+        for line in csv.DictReader(f):
+            Rs_name = line['Rs'].strip()
+            if Rs_name not in RS_VALUES:
+                raise ValueError('Unknown Rs "%s" in %s' % (Rs_name, path))
+            configs.append({'DUC_G': float(line['gain']),
+                            'Rs': RS_VALUES[Rs_name],
+                            'comment': line.get('comment', '').decode('utf-8'),
+                            'settle_time': int(line.get('settle') or 0)})
+    CheckBatch(configs)
+    return configs
+
+
+def RunConfigs(configs, run_id, comment_prefix, start_row):
+    """
+    Turn batch configurations into AqnThread run configurations: run ids
+    are run_id numbered through the batch, comments have comment_prefix
+    (the auto-generated comment) prepended. The first run starts at
+    Data-sheet row start_row; later start rows are set as each run starts.
+    """
+    runs = []
+    for (i, c) in enumerate(configs):
+        runs.append({'run_id': '%s (batch %d/%d)' % (run_id, i+1, len(configs)),
+                     'comment': comment_prefix + c['comment'],
+                     'DUC_G': c['DUC_G'],
+                     'Rs': c['Rs'],
+                     'start_row': None,  # Set when run starts
+                     'settle_time': c['settle_time']})
+    runs[0]['start_row'] = start_row
+    return runs
+
+
+def CheckBatch(configs):
+    """
+    Raise a ValueError if the batch can't run unattended, i.e. it needs
+    more than one of the resistors that aren't relay-selectable.
+    """
+    fixed = set(c['Rs'] for c in configs if RsName(c['Rs']) not in RS_SWITCHABLE)
+    if len(fixed) > 1:
+        raise ValueError('Batch needs %d manually-fitted resistors (%s) - only one can be used' %
+                         (len(fixed), ', '.join(RsName(Rs) for Rs in sorted(fixed))))
+
+
+def OrderBatch(configs, current_Rs=None):
+    """
+    Return the configurations ordered by IV-box Rs setting (see
+    devices.IVBOX_CONFIGS), starting with any that use current_Rs (the
+    resistor already selected). Runs with the same Rs keep their order.
+    """
+    def key(c):
+        return (c['Rs'] != current_Rs, int(devices.IVBOX_CONFIGS[RsName(c['Rs'])]))
+    return sorted(configs, key=key)
+
+
+def CountSwitches(configs, current_Rs=None):
+    # Number of Rs relay changes needed to work through configs in order
+    n = 0
+    for c in configs:
+        if c['Rs'] != current_Rs and RsName(c['Rs']) in RS_SWITCHABLE:
+            n += 1
+        current_Rs = c['Rs']
+    return n
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+budget.py
+
+Uncertainty budgets.
+A Budget lists the influence quantities (GTC ureals) of one result, with
+each influence's value, standard uncertainty, degrees of freedom,
+sensitivity coefficient and contribution to the result's uncertainty, as
+arrays. Influences are de-duplicated by identity (the same ureal listed
+twice is one influence) and each component, GTC.component(result, x), is
+calculated exactly once, so building a budget is linear in the number of
+influences. Influences that don't contribute (zero component) are left
+out.
+"""
+
+import numpy as np
+import GTC
+
+
+def Unique(influences):
+    # influences, without repeats (by identity), in order of first appearance
+    seen = set()
+    unique = []
+    for x in influences:
+        if id(x) not in seen:
+            seen.add(id(x))
+            unique.append(x)
+    return unique
+
+
+class Budget(object):
+    """
+    Uncertainty budget of result (a ureal) over influences.
+    Attributes: labels (list), value, u, dof, sensitivity and contribution
+    (numpy arrays), one element per contributing influence.
+    """
+    def __init__(self, result, influences):
+        infl = Unique(influences)
+        comp = np.array([GTC.component(result, x) for x in infl], dtype=float)
+        keep = np.flatnonzero(comp != 0)
+        self.labels = [infl[i].label for i in keep]
+        self.value = np.array([infl[i].x for i in keep], dtype=float)
+        self.u = np.array([infl[i].u for i in keep], dtype=float)
+        self.dof = np.array([infl[i].df for i in keep], dtype=float)
+        self.contribution = comp[keep]
+        self.sensitivity = self.contribution/self.u  # (u != 0 if comp != 0)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def Order(self):
+        # Indices in descending order of contribution (ties in input order)
+        return np.argsort(-self.contribution, kind='mergesort')
+
+    def Table(self):
+        '''
+        [[label, value, u, dof, sensitivity, contribution],...] - rows
+        ready to write to the Results sheet, sorted by Order().
+        '''
+        cols = (self.value.tolist(), self.u.tolist(), self.dof.tolist(),
+                self.sensitivity.tolist(), self.contribution.tolist())
+        return [[self.labels[i]] + [c[i] for c in cols] for i in self.Order()]
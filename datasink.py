@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+datasink.py
+
+Per-row persistence of acquired data.
+AqnThread writes every completed row into the (in-memory) Data sheet and
+then hands the same cells to a data sink, which is responsible for making
+the row durable:
+* ExcelSink - saves the whole workbook after every row (original
+  behaviour). The cost of each save grows with the size of the workbook.
+* CSVSink, JSONLSink - append one line per row to a text file next to the
+  workbook, then flush and fsync it. The cost per row is constant.
+  The workbook itself is then saved once, at the end of the run (or on
+  demand via File -> Save).
+
+ReadRows() and RestoreSheet() read an append-only file back, e.g. to
+re-populate a Data sheet after a crash.
+"""
+
+import os
+import csv
+import json
+
+DATA_COLS = 'ABCDEFGHIJKLMNOPQR'  # Data-sheet columns written for each row
+
+
+class DataSink(object):
+    """
+    Base class. Sub-classes must implement WriteRow().
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def Open(self, run_id, headings):
+        self.run_id = run_id
+        self.headings = headings  # {column letter: heading}
+
+    def WriteRow(self, row, cells):
+        """
+        Persist one Data-sheet row. cells is a dictionary of values,
+        keyed by column letter.
+        """
+        raise NotImplementedError
+
+    def Close(self):
+        pass
+
+
+class ExcelSink(DataSink):
+    """
+    Save the entire workbook after every row, via an xlwriter.WorkbookWriter.
+    """
+    def __init__(self, path, writer):
+        DataSink.__init__(self, path)
+        self.writer = writer
+
+    def WriteRow(self, row, cells):
+        self.writer.Save(self.path)
+
+
+class AppendSink(DataSink):
+    """
+    Base class for append-only text-file sinks. Each row is flushed and
+    fsync'd before WriteRow() returns, so a completed row survives a crash.
+    """
+    def __init__(self, path):
+        DataSink.__init__(self, path)
+        self.f = None
+
+    def Open(self, run_id, headings):
+        DataSink.Open(self, run_id, headings)
+        is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self.f = open(self.path, self.mode)
+        if is_new:
+            self.WriteHeader()
+        print 'datasink: appending rows to', self.path
+
+    def WriteHeader(self):
+        pass
+
+    def Sync(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def Close(self):
+        if self.f is not None and not self.f.closed:
+            self.f.close()
+
+
+class CSVSink(AppendSink):
+    mode = 'ab'
+
+    def WriteHeader(self):
+        names = ['Run ID', 'Row'] + [self.headings[c] for c in DATA_COLS]
+        csv.writer(self.f).writerow(names)
+
+    def WriteRow(self, row, cells):
+        line = [self.run_id, row] + [cells.get(c) for c in DATA_COLS]
+        line = [v.encode('utf-8') if isinstance(v, unicode) else v
+                for v in line]
+        csv.writer(self.f).writerow(line)
+        self.Sync()
+
+
+class JSONLSink(AppendSink):
+    mode = 'a'
+
+    def WriteRow(self, row, cells):
+        rec = {'run_id': self.run_id, 'row': row, 'cells': cells}
+        self.f.write(json.dumps(rec) + '\n')
+        self.Sync()
+
+
+SINKS = {'xlsx': ExcelSink, 'csv': CSVSink, 'jsonl': JSONLSink}
+
+
+def MakeSink(kind, xlfilename, writer):
+    """
+    Create a sink of the given kind ('xlsx', 'csv' or 'jsonl') for the
+    workbook saved as xlfilename by writer (an xlwriter.WorkbookWriter). Append-only files are named after
+    the workbook, e.g. 'IVY_data.xlsx' -> 'IVY_data_Data.csv'.
+    """
+    assert kind in SINKS, 'Unknown data sink "%s"' % kind
+    if kind == 'xlsx':
+        return ExcelSink(xlfilename, writer)
+    path = os.path.splitext(xlfilename)[0] + '_Data.' + kind
+    return SINKS[kind](path)
+
+
+def ReadRows(path, run_id=None):
+    """
+    Read back rows from a CSV or JSONL sink file.
+    Returns a list of (row, cells) tuples, optionally only for one run.
+    """
+    records = []
+    if path.endswith('.jsonl'):
+        with open(path, 'r') as f:
+            for line in f:
+                if line.strip() == '':
+                    continue
+                try:
+                    rec = json.loads(line)
+                except ValueError:  # Partly-written last line
+                    break
+                records.append((rec['run_id'], rec['row'], rec['cells']))
+    else:
+        with open(path, 'rb') as f:
+            lines = csv.reader(f)
+            next(lines)  # Skip header
+            for line in lines:
+                if len(line) < 2 + len(DATA_COLS):  # Partly-written row
+                    break
+                cells = {}
+                for c, v in zip(DATA_COLS, line[2:]):
+                    if v == '':
+                        cells[c] = None
+                        continue
+                    try:
+                        cells[c] = float(v)
+                    except ValueError:
+                        cells[c] = v.decode('utf-8')
+                records.append((line[0].decode('utf-8'), int(line[1]), cells))
+    return [(row, vals) for (rid, row, vals) in records
+            if run_id is None or rid == run_id]
+
+
+def RestoreSheet(ws, path, run_id=None):
+    """
+    Write rows read back from a sink file into worksheet ws.
+    Returns the number of rows restored.
+    """
+    rows = ReadRows(path, run_id)
+    for (row, cells) in rows:
+        for c in cells:
+            ws[c+str(row)] = cells[c]
+    return len(rows)
@@ -19,8 +19,14 @@ Created on Fri Mar 17 13:52:15 2017
 
 import numpy as np
 import os
+import time
+import json
 import ctypes as ct
-import visa
+from threading import Lock, RLock
+
+import replies
+import timeline
+import drivers
 
 '''
 INSTR_DATA:Dictionary of instrument parameter dictionaries,
@@ -39,9 +45,158 @@ ROLES_INSTR = {}
 VISA-specific stuff:
 Only ONE VISA resource manager is required at any time -
 All comunications for all GPIB and RS232 instruments (except GMH)
-are handled by RM.
+are handled by RM, which is created on first use (GetRM()) - so
+importing this module doesn't touch the VISA library - pyvisa itself
+(visa and constants) is only imported then (LoadVisa()), so
+analysis-only sessions don't need it installed.
+Setting the environment variable IVY_VISA_BACKEND=sim replaces the real
+VISA library with simulated instruments (see simvisa.py).
+Sessions are opened through POOL (a SessionPool), which keeps one session
+per resource string open for re-use until it's explicitly closed.
 """
-RM = visa.ResourceManager()
+VISA_BACKEND = os.environ.get('IVY_VISA_BACKEND', 'visa')  # 'visa' or 'sim'
+RM = None
+visa = None  # pyvisa modules, once loaded by LoadVisa()
+constants = None
+
+
+def LoadVisa():
+    # Import pyvisa (as visa and constants), on first call
+    global visa, constants
+    if visa is None:
+        import visa
+        from pyvisa import constants
+
+
+def GetRM():
+    # The VISA resource manager - created on first call
+    global RM
+    LoadVisa()
+    if RM is None:
+        if VISA_BACKEND == 'sim':
+            import simvisa
+            RM = simvisa.SimResourceManager()
+        else:
+            RM = visa.ResourceManager()
+    return RM
+
+
+def CloseRM():
+    # Close all pooled sessions, then the VISA resource manager (if any)
+    global RM
+    POOL.CloseAll()
+    if RM is not None:
+        RM.close()
+        RM = None
+
+
+class VisaSession(object):
+    '''
+    A pooled VISA session, used just like the pyvisa resource it wraps.
+    Attribute settings (timeout, terminations) are remembered, so that
+    after an I/O error (other than a time-out) in one of the RECONNECTED
+    calls, the resource can be reopened and set up as before. Only the
+    RETRIED calls (complete, repeatable exchanges) are then tried once
+    more - a read can't be: the new session has no pending reply, so
+    the error is re-raised instead.
+    '''
+    RETRIED = ('write', 'query')
+    RECONNECTED = RETRIED + ('read', 'read_bytes', 'read_raw',
+                             'assert_trigger', 'clear')
+
+    def __init__(self, resource_name):
+        self._name = resource_name
+        self._res = None
+        self._settings = {}
+
+    def Healthy(self):
+        # Cheap probe - no bus traffic: is the session handle still valid?
+        if self._res is None:
+            return False
+        try:
+            return self._res.session is not None and self._res.timeout >= 0
+        except Exception:  # pyvisa.errors.InvalidSession, VisaIOError,...
+            return False
+
+    def Reconnect(self):
+        # (Re-)open the resource. Raises VisaIOError if that's impossible.
+        self.Close()
+        self._res = GetRM().open_resource(self._name)
+        for attr, value in self._settings.items():
+            setattr(self._res, attr, value)
+
+    def Close(self):
+        if self._res is not None:
+            try:
+                self._res.close()
+            except Exception:  # Already dead
+                pass
+            self._res = None
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on VisaSession itself
+        if self._res is None:
+            self.Reconnect()
+        attr = getattr(self._res, name)
+        if name not in self.RECONNECTED:
+            return attr
+
+        def retried(*args, **kwargs):
+            try:
+                return getattr(self._res, name)(*args, **kwargs)
+            except visa.VisaIOError as e:
+                if e.error_code == constants.VI_ERROR_TMO:
+                    raise
+                print'devices.VisaSession: %s on %s - reconnecting' % (e, self._name)
+                self.Reconnect()
+                if name not in self.RETRIED:
+                    raise e  # (Original error, not a time-out on retry)
+                return getattr(self._res, name)(*args, **kwargs)
+        return retried
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+            return
+        self._settings[name] = value
+        if self._res is None:
+            self.Reconnect()
+        setattr(self._res, name, value)
+
+
+class SessionPool(object):
+    '''
+    VISA sessions, keyed by resource string (e.g. 'GPIB0::22::INSTR').
+    Get() re-uses an open session if it passes a health probe, otherwise
+    (re-)opens it, so repeatedly creating instruments or testing the
+    IV-box doesn't leak handles or pay the open latency each time.
+    '''
+    def __init__(self):
+        self.sessions = {}
+        self.lock = Lock()
+
+    def Get(self, resource_name):
+        with self.lock:
+            if resource_name not in self.sessions:
+                self.sessions[resource_name] = VisaSession(resource_name)
+            session = self.sessions[resource_name]
+            if not session.Healthy():
+                session.Reconnect()
+            return session
+
+    def Close(self, resource_name):
+        with self.lock:
+            if resource_name in self.sessions:
+                self.sessions.pop(resource_name).Close()
+
+    def CloseAll(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.Close()
+            self.sessions.clear()
+
+
+POOL = SessionPool()
 
 # Switchbox
 IVBOX_CONFIGS = {'V1': '1', 'V2': '2', '1k': '3', '10k': '4', '100k': '5',
@@ -49,14 +204,107 @@ IVBOX_CONFIGS = {'V1': '1', 'V2': '2', '1k': '3', '10k': '4', '100k': '5',
 
 T_Sensors = ('none', 'Pt', 'SR104t', 'thermistor')
 
+# Default role -> instrument description assignments (see CreateInstr())
+DEFAULT_ROLES = {'SRC': 'SRC: F5520A',
+                 'DVM12': 'DVM: HP3458A, s/n518',
+                 'DVM3': 'DVM: HP3458A, s/n066',
+                 'DVMT': 'DVM: HP34401A, s/n976',
+                 'GMH': 'GMH: s/n627',
+                 'GMHroom': 'GMH: s/n367',
+                 'IVbox': 'IV_box'}
+
+BURST_POLL = 0.05  # Interval between MCOUNT? polls during a burst (s)
+BURST_MARGIN = 5.0  # Allowance (s) beyond a burst's integration time
+LINE_FREQ = 50  # Power-line frequency (Hz), if the DVM can't tell us
+
+
+class BurstError(Exception):
+    """A DVM burst didn't complete in the expected time."""
+    pass
+
 """
 ---------------------------------------------------------------
 GMH-specific stuff:
-GMH probe communications are handled by low-level routines in GMHdll.dll.
+GMH probe communications are handled by low-level routines in GMHdll.dll,
+loaded when the first GMH sensor is opened (LoadGMHLib()). If the dll
+can't be loaded (e.g. not on Windows), GMH sensors stay in demo mode.
+All dll access goes through GMH_SESSIONS (see GMHSessions).
+Each sensor's channel map (measurement -> (address, unit)) is cached in
+GMH_CACHE, keyed by sensor description (which includes its serial no.)
+and COM port, so the full address scan is only needed for a new sensor.
 """
 os.environ['GMHPATH'] = 'I:\MSL\Private\Electricity\Staff\TBL\Python\High_Res_Bridge\GMHdll'
 gmhpath = os.environ['GMHPATH']
-GMHLIB = ct.windll.LoadLibrary(os.path.join(gmhpath, 'GMH3x32E'))
+GMHLIB = None
+
+
+def LoadGMHLib():
+    # Load GMH3x32E.dll on first call. Returns None if it can't be loaded.
+    global GMHLIB
+    if GMHLIB is None:
+        try:
+            GMHLIB = ct.windll.LoadLibrary(os.path.join(gmhpath, 'GMH3x32E'))
+        except (AttributeError, OSError) as err:  # No windll / no dll
+            print 'devices.LoadGMHLib(): GMH dll unavailable (%s)' % err
+    return GMHLIB
+
+
+class GMHSessions(object):
+    '''
+    Serialises access to the GMH dll. GMH_Transmit() talks to whichever
+    COM port is open and GMH_CloseCom() closes ALL of them, so only one
+    port is open at a time. Open(port) closes any other port first and
+    leaves port open afterwards, so consecutive readings from one sensor
+    don't need to re-open it. Hold lock around any Open() - Transmit()
+    sequence.
+    '''
+    def __init__(self):
+        self.lock = RLock()
+        self.port = None  # COM port currently open
+
+    def Open(self, port):
+        # Returns the GMH_OpenCom() code (0 if port is already open)
+        with self.lock:
+            if self.port == port:
+                return 0
+            self.Close()
+            code = GMHLIB.GMH_OpenCom(port)
+            if code in range(0, 4) or code == -2:
+                self.port = port
+            return code
+
+    def Close(self):
+        with self.lock:
+            if GMHLIB is not None:
+                GMHLIB.GMH_CloseCom()
+            self.port = None
+
+
+GMH_SESSIONS = GMHSessions()
+GMH_CACHE = os.environ.get('IVY_GMH_CACHE',
+                           os.path.join(os.path.expanduser('~'),
+                                        '.ivy_gmh_channels.json'))
+
+
+def LoadGMHCache():
+    # {'<descr>@COM<port>': {measurement: [address, unit]}}
+    try:
+        with open(GMH_CACHE) as f:
+            return json.load(f)
+    except (IOError, ValueError):  # No cache yet, or unreadable
+        return {}
+
+
+def SaveGMHCache(key, info):
+    cache = LoadGMHCache()
+    cache[key] = info
+    try:
+        with open(GMH_CACHE, 'w') as f:
+            json.dump(cache, f, indent=1)
+    except IOError as err:
+        print 'devices.SaveGMHCache(): Not saved (%s)' % err
+
+
 GMH_DESCR = ('GMH, s/n627',
              'GMH, s/n628')
 LANG_OFFSET = 4096
@@ -120,77 +368,79 @@ class GMH_Sensor(device):
                            'H_atm': 'Atmospheric Humidity',
                            'H_abs': 'Absolute Humidity'}
         self.info = {}
+        self.pow_off_set = False  # Power-off time sent to sensor yet?
 
+    @timeline.traced('gmh')
     def Open(self):
         """
-        Use COM port number to open device
+        Use COM port number to open device (a no-op if it's already open)
         Returns 1 if successful, 0 if not
         """
-        self.error_code = ct.c_int16(GMHLIB.GMH_OpenCom(self.addr))
-        self.GetErrMsg()  # Get self.error_msg
-
-        if self.error_code.value in range(0, 4) or self.error_code.value == -2:
-            print 'devices.GMH_Sensor.Open(): ', self.str_addr, 'is open.'
-
-            # We're not there yet - test device responsiveness
-            self.GetErrMsg()
-            if self.error_code.value in range(0, 4):  # Sensor responds...
-                # Ensure max poweroff time
-                self.intData.value = 120  # 120 mins B4 power-off
-                self.Transmit(1, self.SetPowOffFn)
-            
-                self.Transmit(1, self.ValFn)
+        if LoadGMHLib() is None:
+            print'devices.GMH_Sensor.Open() FAILED:', self.Descr, '(no GMH dll)'
+            self.demo = True
+            return False
+        with GMH_SESSIONS.lock:
+            self.error_code = ct.c_int16(GMH_SESSIONS.Open(self.addr))
+            if self.error_code.value in range(0, 4) or self.error_code.value == -2:
+                if not self.pow_off_set:  # Ensure max poweroff time
+                    print 'devices.GMH_Sensor.Open(): ', self.str_addr, 'is open.'
+                    self.intData.value = 120  # 120 mins B4 power-off
+                    self.pow_off_set = self.Transmit(1, self.SetPowOffFn)
                 if len(self.info) == 0:  # No device info yet
-                    print 'devices.GMH_Sensor.Open(): Getting sensor info...'
-                    self.GetSensorInfo()
-                    self.demo = False  # If we've got this far, probably OK
-                    return True
-                else:  # Already have device measurement info
-                    print'devices.GMH_Sensor.Open(): Instr ready. demo=False.'
-                    self.demo = False  # If we've got this far, probably OK
-                    return True
-            else:  # No response
-                print 'devices.GMH_Sensor.Open():', self.error_msg.value
+                    if not self.LoadSensorInfo():
+                        print 'devices.GMH_Sensor.Open(): Getting sensor info...'
+                        self.GetSensorInfo()
+                        if len(self.info) > 0:
+                            SaveGMHCache(self.CacheKey(), self.info)
+                    if len(self.info) == 0:  # No response
+                        print 'devices.GMH_Sensor.Open():', self.error_msg.value
+                        self.Close()
+                        return False
+                self.demo = False  # If we've got this far, probably OK
+                return True
+
+            else:  # Com open failed
+                self.GetErrMsg()
+                print'devices.GMH_Sensor.Open() FAILED:', self.Descr, self.error_msg.value
                 self.Close()
                 self.demo = True
                 return False
 
-        else:  # Com open failed
-            print'devices.GMH_Sensor.Open() FAILED:', self.Descr
-            self.Close()
-            self.demo = True
-            return False
-
+    @timeline.traced('gmh')
     def Init(self):
         print'devices.GMH_Sensor.Init():', self.Descr,
         'initiated (nothing happens here).'
         pass
 
+    @timeline.traced('gmh')
     def Close(self):
         """
         Closes all / any GMH devices that are currently open.
         """
         self.demo = True
-        self.error_code = ct.c_int16(GMHLIB.GMH_CloseCom())
+        GMH_SESSIONS.Close()
         return 1
 
-    def Transmit(self, Addr, Func):
+    @timeline.traced('gmh')
+    def Transmit(self, Addr, Func, verbose=True):
         """
         A wrapper for the general-purpose interrogation function
-        GMH_Transmit().
+        GMH_Transmit(). Only failures are reported (if verbose).
         """
         self.error_code = ct.c_int16(GMHLIB.GMH_Transmit(Addr, Func,
                                                          ct.byref(self.Prio),
                                                          ct.byref(self.flData),
                                                          ct.byref(self.intData)))
-        self.GetErrMsg()
         if self.error_code.value < 0:
-            print'\ndevices.GMH_Sensor.Transmit():FAIL'
+            self.GetErrMsg()
+            if verbose:
+                print'devices.GMH_Sensor.Transmit(): %s FAIL (%s)' % (self.Descr, self.error_msg.value)
             return False
         else:
-            print'\ndevices.GMH_Sensor.Transmit():PASS'
             return True
 
+    @timeline.traced('gmh')
     def GetErrMsg(self):
         """
         Translate return code into error message and store in self.error_msg.
@@ -202,6 +452,7 @@ class GMH_Sensor(device):
             self.error_msg.value = 'Success'
         return 1
 
+    @timeline.traced('gmh')
     def GetSensorInfo(self):
         """
         Interrogates GMH sensor.
@@ -223,7 +474,7 @@ class GMH_Sensor(device):
 
         for Address in range(1, 100):
             Addr = ct.c_short(Address)
-            if self.Transmit(Addr, self.MeasFn):  # Result -> self.intData
+            if self.Transmit(Addr, self.MeasFn, verbose=False):  # -> self.intData
                 # Transmit() was successful
                 addresses.append(Address)
 
@@ -256,6 +507,32 @@ class GMH_Sensor(device):
         'demo =', self.demo
         return len(self.info)
 
+    def CacheKey(self):
+        return '%s@COM%d' % (self.Descr, self.addr)
+
+    def LoadSensorInfo(self):
+        """
+        Use the cached channel map for this sensor and port, if there is
+        one and the sensor still reports the same measurement at its first
+        address (a single Transmit(), instead of a full address scan).
+        Returns True if the cached map is used.
+        """
+        cached = LoadGMHCache().get(self.CacheKey())
+        if not cached:
+            return False
+        meas, (Address, unit) = min(cached.items(), key=lambda m: m[1][0])
+        if not self.Transmit(ct.c_short(Address), self.MeasFn, verbose=False):
+            return False
+        meas_code = ct.c_int16(self.intData.value + self.lang_offset.value)
+        GMHLIB.GMH_GetMeasurement(meas_code, ct.byref(self.meas_str))
+        if self.meas_str.value != meas:
+            print'devices.GMH_Sensor.LoadSensorInfo(): cached info for', self.CacheKey(), 'out of date'
+            return False
+        self.info = dict((m, (a, u)) for m, (a, u) in cached.items())
+        print'devices.GMH_Sensor.LoadSensorInfo(): using cached info for', self.CacheKey()
+        return True
+
+    @timeline.traced('gmh')
     def Measure(self, meas):
         """
         Measure either temperature, pressure or humidity, based on parameter
@@ -263,21 +540,22 @@ class GMH_Sensor(device):
         Returns a float.
         meas is one of: 'T', 'P', 'RH', 'T_dew', 't_wb', 'H_atm' or 'H_abs'.
 
-        NOTE that because GMH_CloseCom() acts on ALL open GMH devices it makes
-        sense to only have a device open when communicating with it and to
-        immediately close it afterwards. This way the default state is closed
-        and the open state is treated as a special case. Hence an
-        Open()-Close() 'bracket' surrounds the Measure() function.
+        NOTE that because GMH_CloseCom() acts on ALL open GMH devices, the
+        port is opened through GMH_SESSIONS, which leaves it open until
+        another sensor's port is needed (or Close()). With the sensor's port
+        already open, a reading is a single Transmit().
         """
 
         self.flData.value = 0
-        if self.Open():  # port and device open success
-            assert self.demo is False, 'Illegal access to demo device!'
-            Address = self.info[self.meas_alias[meas]][0]
-            Addr = ct.c_short(Address)
-            self.Transmit(Addr, self.ValFn)
-            self.Close()
-
+        with GMH_SESSIONS.lock:
+            is_open = self.Open()  # port and device open success
+            if is_open:
+                assert self.demo is False, 'Illegal access to demo device!'
+                Address = self.info[self.meas_alias[meas]][0]
+                Addr = ct.c_short(Address)
+                if not self.Transmit(Addr, self.ValFn):
+                    GMH_SESSIONS.Close()  # Re-open next time
+        if is_open:
             print'devices.Measure():', self.meas_alias[meas],
             '=', self.flData.value
             return self.flData.value
@@ -287,6 +565,39 @@ class GMH_Sensor(device):
             demo_rtn = {'T': (20.5, 0.2), 'P': (1013, 5), 'RH': (50, 10)}
             return np.random.normal(*demo_rtn[meas])
 
+    @timeline.traced('gmh')
+    def MeasureMany(self, meas_list):
+        """
+        Measure several quantities (see Measure()) with the port opened
+        once and held (so no other sensor can take it) until all are read.
+        Returns a dictionary keyed by meas, of (value, time) tuples, where
+        time is the mid-point of that quantity's Transmit(). A quantity that
+        fails to read is left out.
+        """
+        results = {}
+        with GMH_SESSIONS.lock:
+            is_open = self.Open()
+            if is_open:
+                assert self.demo is False, 'Illegal access to demo device!'
+                for meas in meas_list:
+                    self.flData.value = 0
+                    Addr = ct.c_short(self.info[self.meas_alias[meas]][0])
+                    t0 = time.time()
+                    if self.Transmit(Addr, self.ValFn):
+                        results[meas] = (self.flData.value, (t0 + time.time())/2.0)
+                    else:
+                        GMH_SESSIONS.Close()  # Re-open next time
+                        break
+        if is_open:
+            print'devices.MeasureMany():', self.Descr, results
+            return results
+        else:
+            assert self.demo is True, 'Illegal denial to demo device!'
+            demo_rtn = {'T': (20.5, 0.2), 'P': (1013, 5), 'RH': (50, 10)}
+            return dict((meas, (np.random.normal(*demo_rtn[meas]), time.time()))
+                        for meas in meas_list)
+
+    @timeline.traced('gmh')
     def Test(self, meas):
         """ Used to test that the device is functioning. """
         print'\ndevices.GMH_Sensor.Test()...'
@@ -316,6 +627,7 @@ data is loaded from Excel Parameters sheet.'.format(self.Descr)
         self.addr = INSTR_DATA[self.Descr]['addr']
         self.str_addr = INSTR_DATA[self.Descr]['str_addr']
         self.role = INSTR_DATA[self.Descr]['role']
+        self.driver = drivers.Match(self.Descr)  # Model capabilities, commands
 
         if 'init_str' in INSTR_DATA[self.Descr]:
             self.InitStr = INSTR_DATA[self.Descr]['init_str']  # tuple of str
@@ -333,8 +645,11 @@ data is loaded from Excel Parameters sheet.'.format(self.Descr)
             self.StbyStr = INSTR_DATA[self.Descr]['stby_str']
         else:
             self.StbyStr = ''
-        if 'chk_err_str' in INSTR_DATA[self.Descr]:
+        if 'chk_err_str' in INSTR_DATA[self.Descr]:  # (query, clear)
             self.ChkErrStr = INSTR_DATA[self.Descr]['chk_err_str']
+        elif self.driver.Can('err_queue'):
+            self.ChkErrStr = (self.driver.cmds['err?'],
+                              self.driver.cmds['clear_err'])
         else:
             self.ChkErrStr = ('',)
         if 'setV_str' in INSTR_DATA[self.Descr]:
@@ -342,13 +657,15 @@ data is loaded from Excel Parameters sheet.'.format(self.Descr)
         else:
             self.VStr = ''
 
+    @timeline.traced('instr')
     def Open(self):
+        LoadVisa()  # (Before the try - its except clause needs visa)
         try:
-            self.instr = RM.open_resource(self.str_addr)
+            self.instr = POOL.Get(self.str_addr)
             self.is_open = 1
-            if '3458A' in self.Descr:
-                self.instr.read_termination = '\r\n'
-                self.instr.write_termination = '\r\n'
+            if self.driver.term is not None:
+                self.instr.read_termination = self.driver.term
+                self.instr.write_termination = self.driver.term
             self.instr.timeout = 2000  # default 2 s timeout
             INSTR_DATA[self.Descr]['demo'] = False  # A real working instrument
             self.demo = False  # A real instrument ONLY on Open() success
@@ -362,6 +679,7 @@ data is loaded from Excel Parameters sheet.'.format(self.Descr)
             'opened in demo mode'
         return self.instr
 
+    @timeline.traced('instr')
     def Close(self):
         # Close comms with instrument
         if self.demo is True:
@@ -370,12 +688,13 @@ data is loaded from Excel Parameters sheet.'.format(self.Descr)
         elif self.instr is not None:
             print 'devices.instrument.Close(): Closing', self.Descr,
             '(session handle=', self.instr.session, ')'
-            self.instr.close()
+            POOL.Close(self.str_addr)
         else:
             print 'devices.instrument.Close():', self.Descr,
             'is "None" or already closed'
         self.is_open = 0
 
+    @timeline.traced('instr')
     def Init(self):
         # Send initiation string
         if self.demo is True:
@@ -396,13 +715,14 @@ data is loaded from Excel Parameters sheet.'.format(self.Descr)
             'initiated with cmd:', s
         return reply
 
+    @timeline.traced('instr')
     def SetV(self, V):
         '''
         Set output voltage (SRC) or input range (DVM)
         '''
         if self.demo is True:
             return 1
-        elif 'SRC:' in self.Descr:
+        elif self.driver.kind == 'SRC':
             # Set voltage-source to V
             s = str(V).join(self.VStr)
             print'devices.instrument.SetV(): V =',V
@@ -414,7 +734,7 @@ data is loaded from Excel Parameters sheet.'.format(self.Descr)
                 via handle %s' % (s, self.Descr, self.instr.session)
                 return -1
             return 1
-        elif 'DVM:' in self.Descr:
+        elif self.driver.kind == 'DVM':
             # Set DVM range to V
             s = str(V).join(self.VStr)
             self.instr.write(s)
@@ -423,11 +743,12 @@ data is loaded from Excel Parameters sheet.'.format(self.Descr)
             print 'Invalid function for instrument', self.Descr
             return -1
 
+    @timeline.traced('instr')
     def SetFn(self):
         # Set DVM function
         if self.demo is True:
             return 1
-        if 'DVM' in self.Descr:
+        if self.driver.kind == 'DVM':
             s = self.SetFnStr
             if s != '':
                 self.instr.write(s)
@@ -437,12 +758,13 @@ data is loaded from Excel Parameters sheet.'.format(self.Descr)
             print'devices.instrument.SetFn(): Invalid function for', self.Descr
             return -1
 
+    @timeline.traced('instr')
     def Oper(self):
         # Enable O/P terminals
         # For V-source instruments only
         if self.demo is True:
             return 1
-        if 'SRC' in self.Descr:
+        if self.driver.kind == 'SRC':
             s = self.OperStr
             if s != '':
                 try:
@@ -456,12 +778,13 @@ data is loaded from Excel Parameters sheet.'.format(self.Descr)
             print'devices.instrument.Oper(): Invalid function for', self.Descr
             return -1
 
+    @timeline.traced('instr')
     def Stby(self):
         # Disable O/P terminals
         # For V-source instruments only
         if self.demo is True:
             return 1
-        if 'SRC' in self.Descr:
+        if self.driver.kind == 'SRC':
             s = self.StbyStr
             if s != '':
                 self.instr.write(s)  # was: query(s)
@@ -471,22 +794,24 @@ data is loaded from Excel Parameters sheet.'.format(self.Descr)
             print'devices.instrument.Stby(): Invalid function for', self.Descr
             return -1
 
+    @timeline.traced('instr')
     def CheckErr(self):
         # Get last error string and clear error queue
-        # For V-source instruments only (F5520A)
+        # For instruments with an error queue only (F5520A) - using the
+        # Parameters sheet's chk_err_str, or else the driver's commands
         if self.demo is True:
             return 1
-        if 'F5520A' in self.Descr:
-            s = self.ChkErrStr
-            if s != ('',):
-                reply = self.instr.query(s[0])  # read error message
-                self.instr.write(s[1])  # clear registers
+        s = self.ChkErrStr
+        if s != ('',):
+            reply = self.instr.query(s[0])  # read error message
+            self.instr.write(s[1])  # clear registers
             return reply
         else:
             print'devices.instrument.CheckErr(): Invalid function for',
             self.Descr
             return -1
 
+    @timeline.traced('instr')
     def SendCmd(self, s):
         demo_reply = 'SendCmd(): '+self.Descr+' - DEMO resp. to '+s
         reply = 1
@@ -508,24 +833,185 @@ data is loaded from Excel Parameters sheet.'.format(self.Descr)
             self.instr.write(s)
             return reply
 
+    @timeline.traced('instr')
     def Read(self):
         reply = 0
         if self.demo is True:
             return reply
-        if 'DVM' in self.Descr:
+        if self.driver.kind == 'DVM':
             print'devices.instrument.Read(): from', self.Descr
-            if '3458A' in self.Descr:
+            cmd = self.driver.cmds.get('read')
+            if cmd is None:  # Free-running (auto-triggered)
                 reply = self.instr.read()
                 print reply
                 return reply
             else:
-                reply = self.instr.query('READ?')
+                reply = self.instr.query(cmd)
                 return reply
         else:
             print 'devices.instrument.Read(): Invalid function for', self.Descr
             return reply
 
+    def Can(self, cap):
+        # Does this model have capability cap (see drivers.py)?
+        if cap == 'err_queue':  # may be configured on the Parameters sheet
+            return self.ChkErrStr != ('',)
+        return self.driver.Can(cap)
+
+    @timeline.traced('instr')
+    def Cmd(self, op):
+        '''
+        Send the command for generic operation op (e.g. 'autorange' - see
+        drivers.py) and return any reply. Returns None if this model has
+        no such operation (or in demo mode).
+        '''
+        s = self.driver.cmds.get(op)
+        if s is None or self.demo is True:
+            return None
+        return self.SendCmd(s)
+
+    def GetRange(self):
+        # Current DCV range (0 if unknown)
+        reply = self.Cmd('range?')
+        if reply is None:
+            return 0
+        return replies.ParseReply(reply)
+
+    def IntegrationTime(self):
+        '''
+        Time (s) per reading: NPLC power-line cycles, doubled with
+        autozero on (a zero reading for every input reading).
+        '''
+        nplc = replies.ParseReply(self.Cmd('nplc?'))
+        reply = self.Cmd('line_freq?')
+        line_f = LINE_FREQ if reply is None else replies.ParseReply(reply)
+        azero = self.Cmd('azero?').strip().upper() in ('1', '+1', 'ON')
+        t = nplc/line_f
+        if azero:
+            t *= 2
+        return t
+
+    def DriverCmds(self, op, **fields):
+        # The command(s) for operation op (see drivers.py), fields filled in
+        s = self.driver.cmds[op]
+        if isinstance(s, basestring):
+            s = (s,)
+        return [c.format(**fields) for c in s]
+
+    def CanBurst(self):
+        # Only a real (non-demo) instrument with burst memory (HP3458A)
+        return self.demo is False and self.driver.Can('burst')
+
+    @timeline.traced('instr')
+    def ArmBurst(self, n, fmt='DREAL'):
+        '''
+        Set up a DVM with burst memory to take n readings into it (in
+        binary format fmt, on the present range), then trigger the burst -
+        with a GPIB Group Execute Trigger, if the model takes one. The
+        readings are collected by FetchBurst().
+        '''
+        assert self.CanBurst(), 'Burst mode not available for %s' % self.Descr
+        assert fmt in self.driver.formats, 'Burst format %s not available for %s' % (fmt, self.Descr)
+        self.burst_n = n
+        self.burst_fmt = fmt
+        self.burst_t_int = self.IntegrationTime()
+        for s in self.DriverCmds('burst_setup', fmt=fmt, n=n):  # (Fixes range)
+            self.instr.write(s)
+        self.burst_scale = 1.0
+        if replies.BINARY_FORMATS[fmt][1]:  # Integer format - scale for this format and range
+            self.burst_scale = replies.ParseReply(self.instr.query(self.driver.cmds['scale?']))
+        if 'GET' in self.driver.triggers:
+            self.instr.assert_trigger()
+        else:
+            self.instr.write(self.driver.cmds['burst_arm'])
+        self.burst_t0 = time.time()
+        self.burst_t_limit = self.burst_t0 + n*self.burst_t_int + BURST_MARGIN
+        return 1
+
+    @timeline.traced('instr')
+    def FetchBurst(self, stop_fn=None):
+        '''
+        Wait for the burst started by ArmBurst() to finish, then transfer
+        all readings in one binary block and restore normal (ASCII,
+        single-reading, auto-armed) operation.
+        If stop_fn() returns True while waiting, the burst is abandoned
+        and no readings are returned.
+        Returns (readings, times) - numpy arrays. Each reading's time is
+        the middle of its integration period, counted from the trigger at
+        the programmed interval (the integration time from ArmBurst()).
+        Raises BurstError if the burst takes longer than n integration
+        times plus BURST_MARGIN.
+        '''
+        n = self.burst_n
+        itemsize = np.dtype(replies.BINARY_FORMATS[self.burst_fmt][0]).itemsize
+        while replies.ParseReply(self.instr.query(self.driver.cmds['burst_count?'])) < n:
+            if time.time() > self.burst_t_limit:
+                raise BurstError('%s: burst of %d readings timed out after %.1f s' % (self.Descr, n, time.time() - self.burst_t0))
+            if stop_fn is not None and stop_fn():
+                for s in self.DriverCmds('burst_abandon'):
+                    self.instr.write(s)
+                return np.array([]), np.array([])
+            time.sleep(BURST_POLL)
+        for s in self.DriverCmds('burst_fetch', n=n):
+            self.instr.write(s)
+        raw = self.instr.read_bytes(n*itemsize)
+        for s in self.DriverCmds('burst_end'):
+            self.instr.write(s)
+        readings = replies.ParseBlock(raw, self.burst_fmt, self.burst_scale, n)
+        times = self.burst_t0 + self.burst_t_int*(np.arange(n) + 0.5)
+        print 'devices.instrument.FetchBurst():', n, 'readings from', self.Descr
+        return readings, times
+
+    @timeline.traced('instr')
     def Test(self, s):
         """ Used to test that the instrument is functioning. """
         return self.SendCmd(s)
 # __________________________________________
+
+
+def LoadInstrData(store, log=None):
+    """
+    Gather instrument info from the 'Parameters' sheet (the 'instrument'
+    block of params.ParamStore store) into INSTR_DATA.
+    """
+    global INSTR_DATA
+    instr_data = store.Plain('instrument')
+    for descr in store.descr['instrument']:
+        for param in sorted(instr_data[descr]):
+            print descr, ' : ', param, ' = ', instr_data[descr][param]
+            if log is not None:
+                print >>log, descr, ' : ', param, ' = ', instr_data[descr][param]
+        DESCR.append(descr)  # build description list
+        sublist.append(instr_data[descr])
+
+    print '----END OF PARAMETER LIST----'
+    if log is not None:
+        print >>log, '----END OF PARAMETER LIST----'
+
+    # Compile into a dictionary:
+    INSTR_DATA = dict(zip(DESCR, sublist))
+    return INSTR_DATA
+
+
+def CreateInstr(d, r):
+    """
+    Create the instrument with description d in role r and open its
+    visa session (GPIB/RS232 only). For GMH instruments, use the GMH dll,
+    not visa.
+    """
+    assert d in INSTR_DATA, 'Unknown instrument: %s - \
+    check Excel file is loaded.' % d
+    assert 'role' in INSTR_DATA[d], 'Unknown instrument parameter - \
+    check Excel Parameters sheet is populated.'
+    INSTR_DATA[d]['role'] = r  # update default role
+
+    if 'GMH' in r:
+        # create and open a GMH instrument instance
+        print'\ndevices.CreateInstr(): Creating GMH device (%s -> %s).' % (d, r)
+        ROLES_INSTR.update({r: GMH_Sensor(d)})
+    else:
+        # create a visa instrument instance
+        print'\ndevices.CreateInstr(): Creating VISA device (%s -> %s).' % (d, r)
+        ROLES_INSTR.update({r: instrument(d)})
+        ROLES_INSTR[r].Open()
+    return ROLES_INSTR[r]
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+drivers.py
+
+Instrument driver registry.
+Each supported instrument model has a Driver, which declares:
+* kind - 'SRC', 'DVM' or 'switch',
+* caps - what the model can do:
+  'burst'     - take a burst of readings into internal memory,
+  'err_queue' - has an error queue (read with cmds 'err?' and cleared
+                with cmds 'clear_err' by CheckErr(), unless the
+                Parameters sheet gives a chk_err_str),
+* formats - binary reading formats (see replies.BINARY_FORMATS), fastest
+  transfer first,
+* triggers - trigger modes: 'auto' (free-running - each read() returns a
+  fresh reading), 'query' (READ?) or 'GET' (GPIB Group Execute Trigger),
+* term - read/write termination, if not the VISA default and
+* cmds - the command strings for generic operations, e.g. 'autorange' or
+  'range?'. An operation a model doesn't have is simply absent. An
+  operation may be a tuple of commands, and commands may have fields
+  (e.g. '{n:d}') filled in by the caller - see instrument.DriverCmds().
+  A model with 'burst' has the burst operations: 'burst_setup' (fields
+  fmt, n - must leave the range fixed), 'scale?', 'burst_arm' (if it
+  can't be triggered by GET), 'burst_count?', 'burst_fetch' (field n),
+  'burst_end' and 'burst_abandon'.
+
+devices.instrument looks its driver up by model (Match()) and acquisition
+asks for operations by name (instrument.Cmd()) or checks capabilities
+(instrument.Can()), so a new meter only needs a new entry in DRIVERS.
+"""
+
+
+class Driver(object):
+    def __init__(self, model, kind, caps=(), formats=(), triggers=('query',),
+                 term=None, cmds=None):
+        self.model = model
+        self.kind = kind
+        self.caps = frozenset(caps)
+        self.formats = tuple(formats)
+        self.triggers = tuple(triggers)
+        self.term = term
+        self.cmds = cmds or {}
+
+    def Can(self, cap):
+        return cap in self.caps
+
+    def __repr__(self):
+        return 'Driver(%s, %s)' % (self.model, self.kind)
+
+
+DRIVERS = {
+    'F5520A': Driver('F5520A', 'SRC', caps=('err_queue',),
+                     cmds={'err?': 'ERR?', 'clear_err': '*CLS'}),
+    '3458A': Driver('3458A', 'DVM', caps=('burst',),
+                    formats=('SINT', 'DINT', 'SREAL', 'DREAL'),
+                    triggers=('auto', 'GET'), term='\r\n',
+                    cmds={'autorange': 'DCV AUTO',
+                          'line_sync': 'LFREQ LINE',
+                          'azero_once': 'AZERO ONCE',
+                          'azero_on': 'AZERO ON',
+                          'range?': 'RANGE?',
+                          'nplc?': 'NPLC?',
+                          'azero?': 'AZERO?',
+                          'line_freq?': 'LINE?',
+                          'read': None,
+                          # Burst mode (see devices.instrument.ArmBurst()):
+                          'burst_setup': ('TARM HOLD', 'ARANGE OFF',
+                                          'MEM FIFO', 'MFORMAT {fmt}',
+                                          'OFORMAT {fmt}',
+                                          'NRDGS {n:d},AUTO'),
+                          'scale?': 'ISCALE?',
+                          'burst_arm': 'TARM SGL',
+                          'burst_count?': 'MCOUNT?',
+                          'burst_fetch': 'RMEM 1,{n:d},1',
+                          'burst_end': ('MEM OFF', 'OFORMAT ASCII',
+                                        'NRDGS 1,AUTO', 'ARANGE ON',
+                                        'TARM AUTO'),
+                          'burst_abandon': ('TARM HOLD', 'MEM OFF',
+                                            'OFORMAT ASCII', 'NRDGS 1,AUTO',
+                                            'ARANGE ON', 'TARM AUTO')}),  # Free-running: just read()
+    '34401A': Driver('34401A', 'DVM',
+                     cmds={'autorange': 'VOLT:DC:RANG:AUTO ON',
+                           'azero_once': 'ZERO:AUTO ONCE',
+                           'azero_on': 'ZERO:AUTO ON',
+                           'range?': 'VOLT:DC:RANG?',
+                           'read': 'READ?'}),
+    'IV_box': Driver('IV_box', 'switch'),
+}
+
+# Generic drivers for unknown models, by description prefix
+GENERIC = {'SRC:': Driver('generic', 'SRC'),
+           'DVM:': Driver('generic', 'DVM', cmds={'read': 'READ?'}),
+           '': Driver('generic', 'none')}
+
+
+def Match(descr):
+    """
+    Return the driver for the instrument with description descr
+    (e.g. 'DVM: HP3458A, s/n518'), matched by model name. Unknown models
+    get a generic driver of the kind given by the description prefix.
+    """
+    for model in DRIVERS:
+        if model in descr:
+            return DRIVERS[model]
+    for prefix in ('SRC:', 'DVM:'):
+        if descr.startswith(prefix):
+            return GENERIC[prefix]
+    return GENERIC['']
+
+
+def BestFormat(drivers, preferred=None):
+    """
+    The binary format to use for bursts on all of drivers: preferred, if
+    they all support it, otherwise the fastest one they have in common
+    (None if there isn't one).
+    """
+    common = [f for f in drivers[0].formats
+              if all(f in d.formats for d in drivers[1:])]
+    if preferred in common:
+        return preferred
+    if len(common) > 0:
+        return common[0]
+    return None
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+environment.py
+
+Background sampling of environmental conditions.
+An EnvSampler thread polls the GMH probe (DUC temperature), the GMHroom
+probe (room T, P and RH) and the Pt-100 DVM (DVMT, Rs temperature) on its
+own schedule, so that none of this slow serial / GPIB traffic sits on the
+acquisition thread's critical path.
+
+Samples are timestamped. The acquisition thread marks the start of each
+data row with StartWindow() and, at the end of the row, calls Snapshot()
+to get values averaged over that row's window.
+"""
+
+from threading import Thread, Event, Lock
+import time
+import numpy as np
+
+import devices
+import replies
+
+ENV_PERIOD = 10  # Time between successive polls of all channels (s)
+
+'''
+CHANNELS: (name, role, measurement) for every quantity sampled.
+measurement is the GMH_Sensor.Measure() argument, or None for a DVM read.
+All of a GMH probe's channels are read together (GMH_Sensor.MeasureMany()).
+'''
+CHANNELS = (('T', 'GMH', 'T'),
+            ('Troom', 'GMHroom', 'T'),
+            ('Proom', 'GMHroom', 'P'),
+            ('RHroom', 'GMHroom', 'RH'),
+            ('PtR', 'DVMT', None))
+
+
+class EnvSampler(Thread):
+    """
+    Background environment sampler.
+    """
+    def __init__(self, log=None, period=ENV_PERIOD):
+        Thread.__init__(self)
+        self.daemon = True
+        self.log = log
+        self.period = period
+        self._stop_event = Event()
+        self._lock = Lock()  # Guards samples
+        self._io_lock = Lock()  # Serialises instrument reads
+        self.samples = dict((name, []) for (name, r, m) in CHANNELS)
+        self.window_start = time.time()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.Poll()
+            self._stop_event.wait(self.period)
+
+    def Stop(self):
+        self._stop_event.set()
+
+    def ReadChannel(self, role, meas):
+        instr = devices.ROLES_INSTR[role]
+        with self._io_lock:
+            if meas is not None:  # GMH probe (demo handled by Measure())
+                return instr.Measure(meas)
+            elif instr.demo is True:
+                return np.random.normal(108.0, 1.0e-2)
+            else:
+                return replies.ParseReply(instr.Read())
+
+    def ReadRole(self, role, channels):
+        """
+        Read channels [(name, measurement),...] of the instrument in role.
+        Returns {name: (value, time)}.
+        """
+        instr = devices.ROLES_INSTR[role]
+        if channels[0][1] is None:  # DVM: a single reading
+            t0 = time.time()
+            val = self.ReadChannel(role, None)
+            return {channels[0][0]: (val, (t0 + time.time())/2.0)}
+        with self._io_lock:
+            readings = instr.MeasureMany([meas for (name, meas) in channels])
+        return dict((name, readings[meas]) for (name, meas) in channels
+                    if meas in readings)
+
+    def Poll(self):
+        """
+        Read every channel once and store timestamped results.
+        A failed read is reported and skipped - it doesn't stop the sampler.
+        """
+        roles = []
+        for (name, role, meas) in CHANNELS:
+            if role not in roles:
+                roles.append(role)
+        for role in roles:
+            channels = [(name, meas) for (name, r, meas) in CHANNELS if r == role]
+            try:
+                readings = self.ReadRole(role, channels)
+            except Exception as err:
+                readings = {}
+                print'environment.EnvSampler.Poll(): %s read failed: %s' % (role, err)
+                if self.log is not None:
+                    print >>self.log, 'environment.EnvSampler.Poll(): %s read failed: %s' % (role, err)
+            missing = [name for (name, meas) in channels if name not in readings]
+            if 0 < len(missing) < len(channels):
+                print'environment.EnvSampler.Poll(): %s not read' % ', '.join(missing)
+            with self._lock:
+                for name in readings:
+                    val, t = readings[name]
+                    self.samples[name].append((t, val))
+
+    def StartWindow(self):
+        """
+        Mark the start of a new averaging window and discard samples
+        from earlier windows (except the most recent, kept as a fallback).
+        """
+        with self._lock:
+            self.window_start = time.time()
+            for name in self.samples:
+                del self.samples[name][:-1]
+
+    def Snapshot(self):
+        """
+        Return a dictionary of values (keyed by channel name), each the mean
+        of the samples taken since StartWindow(). If no sample was taken in
+        this window, the most recent one is used, failing that a fresh
+        reading is taken.
+        """
+        snap = {}
+        for (name, role, meas) in CHANNELS:
+            with self._lock:
+                vals = [v for (t, v) in self.samples[name]
+                        if t >= self.window_start]
+                if len(vals) == 0 and len(self.samples[name]) > 0:
+                    vals = [self.samples[name][-1][1]]
+            if len(vals) == 0:
+                vals = [self.ReadChannel(role, meas)]
+            snap[name] = np.mean(vals)
+            snap[name+'_n'] = len(vals)
+        return snap
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+journal.py
+
+Crash-safe run journal.
+A RunJournal is a write-ahead log of one acquisition run, kept as a JSON-
+lines file next to the Excel workbook. It holds:
+* a 'begin' record with the run configuration (run id, comment, DUC gain,
+  Rs, start row, settle delay),
+* one 'row' record per completed Data-sheet row, with its position in the
+  measurement sequence (abs_V3, node, V3_mask and the index of V3_mask in
+  TEST_V_MASK - the mask value 0 appears twice), the progress count and
+  the row's cell values and
+* an 'end' record ('completed' or 'aborted').
+Every record is flushed and fsync'd before the run moves on.
+
+If IVY or the PC dies part-way through a run, LoadJournal() recovers the
+configuration and the completed rows, so that a new AqnThread can restore
+those rows to the workbook and carry on from the next unfinished row.
+"""
+
+import os
+import json
+import time
+
+
+def JournalPath(xlfilename):
+    # E.g. 'IVY_data.xlsx' -> 'IVY_data_journal.jsonl'
+    return os.path.splitext(xlfilename)[0] + '_journal.jsonl'
+
+
+def StepKey(abs_V3, node, i_mask):
+    # Uniquely identifies one row of the measurement sequence
+    return '{0}|{1}|{2}'.format(abs_V3, node, i_mask)
+
+
+class RunJournal(object):
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+
+    def Begin(self, config):
+        """
+        Start a new journal (replacing any previous one) for a run with
+        configuration config (a dictionary).
+        """
+        self.f = open(self.path, 'w')
+        self.Append({'type': 'begin', 'config': config})
+
+    def Reopen(self):
+        # Continue appending to an existing journal (resumed run)
+        self.f = open(self.path, 'a')
+        self.Append({'type': 'resume'})
+
+    def Append(self, rec):
+        rec['t'] = time.time()
+        self.f.write(json.dumps(rec) + '\n')
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def RecordRow(self, abs_V3, node, V3_mask, i_mask, row, pbar, cells):
+        self.Append({'type': 'row', 'key': StepKey(abs_V3, node, i_mask),
+                     'abs_V3': abs_V3, 'node': node, 'V3_mask': V3_mask,
+                     'i_mask': i_mask, 'row': row, 'pbar': pbar,
+                     'cells': cells})
+
+    def End(self, status):
+        if self.f is None or self.f.closed:
+            return
+        self.Append({'type': 'end', 'status': status})
+        self.f.close()
+
+
+def LoadJournal(path):
+    """
+    Read a journal back. Returns a dictionary:
+    {'config': <run configuration>,
+     'done': {<step key>: <row record>, ...},
+     'status': 'running', 'completed' or 'aborted'}
+    or None if there is no usable journal at path.
+    A partly-written final record (e.g. power failure mid-write) is ignored.
+    """
+    if not os.path.exists(path):
+        return None
+    state = {'config': None, 'done': {}, 'status': 'running'}
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                break
+            if rec['type'] == 'begin':
+                state['config'] = rec['config']
+            elif rec['type'] == 'row':
+                state['done'][rec['key']] = rec
+            elif rec['type'] == 'end':
+                state['status'] = rec['status']
+            elif rec['type'] == 'resume':
+                state['status'] = 'running'
+    if state['config'] is None:
+        return None
+    return state
+
+
+def CanResume(path):
+    # True if there's a journalled run that didn't complete
+    state = LoadJournal(path)
+    return state is not None and state['status'] != 'completed'
@@ -13,27 +13,45 @@ import os
 import wx
 from wx.lib.masked import NumCtrl
 import datetime as dt
-import time
 import math
+from threading import Event
 
-import matplotlib
-matplotlib.use('WXAgg')  # Agg renderer for drawing on a wx canvas
-from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg as FigureCanvas
-# from matplotlib.backends.backend_wx import NavigationToolbar2Wx
-from matplotlib.figure import Figure
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-import matplotlib.ticker as mtick
-
-from openpyxl import load_workbook, cell
 import IVY_events as evts
-import acquisition as acq
 import devices
-
-import GTC
-from numbers import Number
-
-matplotlib.rc('lines', linewidth=1, color='blue')
+import xlwriter
+import xlstream
+import journal
+import batch
+import params
+import runcontrol
+
+GUI_TIMEOUT = 30  # Longest wait (s) for the GUI to act for a run (e.g. set V1)
+ANALYSIS_TIMEOUT = 600  # Longest wait (s) for a batch run's analysis
+
+
+def OpenWorkbook(top, path, directory, version):
+    '''
+    Open the day's log file (in directory) and the workbook at path, with
+    a background writer and its parameters (a params.ParamStore) - as
+    attributes log, wb, wb_writer and params of the top-level frame, top.
+    '''
+    # Finish with any previous workbook's writer (and log) first:
+    if top.wb_writer is not None:
+        top.wb_writer.Stop()  # (Queued saves are done before it stops)
+        top.wb_writer.join()
+    if top.log is not None:
+        top.log.close()
+
+    logname = 'IVYv'+str(version)+'_'+str(dt.date.today())+'.log'
+    logfile = os.path.join(directory, logname)
+    top.log = open(logfile, 'a')
+
+    top.wb = xlstream.Open(path)  # Cell VALUES (not formulae), streamed
+    top.params = params.Load(top.wb, path, top.log)
+
+    # All subsequent saves (and run-time writes) go via a writer thread:
+    top.wb_writer = xlwriter.WorkbookWriter(top.wb, top.log)
+    top.wb_writer.start()
 
 
 '''
@@ -370,62 +388,12 @@ class SetupPage(wx.Panel):
         '''
         self.XLFile.SetValue(e.XLpath)
 
-        # Open logfile
-        logname = 'IVYv'+str(e.v)+'_'+str(dt.date.today())+'.log'
-        logfile = os.path.join(e.d, logname)
-        self.GetTopLevelParent().log = open(logfile, 'a')
+        OpenWorkbook(self.GetTopLevelParent(), e.XLpath, e.d, e.v)
         self.log = self.GetTopLevelParent().log
-
-        # Read parameters sheet - gather instrument info:
-        self.GetTopLevelParent().wb = load_workbook(self.XLFile.GetValue(), data_only = True) # Need cell VALUE, not FORMULA, so set data_only = True
         self.wb = self.GetTopLevelParent().wb
-        self.ws_params = self.wb.get_sheet_by_name('Parameters')
-
-        headings = (None, u'description', u'Instrument Info:',
-                    u'parameter', u'value', u'uncert', u'dof', u'label')
-
-        # Determine colummn indices from column letters:
-        col_I = cell.cell.column_index_from_string('I') - 1
-        col_J = cell.cell.column_index_from_string('J') - 1
-        col_K = cell.cell.column_index_from_string('K') - 1
-        col_L = cell.cell.column_index_from_string('L') - 1
-        col_M = cell.cell.column_index_from_string('M') - 1
-        col_N = cell.cell.column_index_from_string('N') - 1
-
-        params = []
-        values = []
-
-        for r in self.ws_params.rows:  # a tuple of row objects
-            descr = r[col_I].value  # cell.value
-            param = r[col_J].value  # cell.value
-            v_u_d_l = [r[col_K].value, r[col_L].value, r[col_M].value, r[col_N].value]  # value,uncert,dof,label
-
-            if descr in headings and param in headings:
-                continue  # Skip this row
-            else:  # not header
-                params.append(param)
-                if v_u_d_l[1] is None:  # single-valued (no uncert)
-                    values.append(v_u_d_l[0])  # append value as next item
-                    print descr, ' : ', param, ' = ', v_u_d_l[0]
-                    print >>self.log, descr, ' : ', param, ' = ', v_u_d_l[0]
-                else:  # multi-valued
-                    while v_u_d_l[-1] is None:  # remove empty cells
-                        del v_u_d_l[-1]  # v_u_d_l.pop()
-                    values.append(v_u_d_l)  # append value-list as next item
-                    print descr, ' : ', param, ' = ', v_u_d_l
-                    print >>self.log, descr, ' : ', param, ' = ', v_u_d_l
-
-                if param == u'test':  # last parameter for this description
-                    devices.DESCR.append(descr)  # build description list
-                    devices.sublist.append(dict(zip(params, values)))
-                    del params[:]
-                    del values[:]
-
-        print '----END OF PARAMETER LIST----'
-        print >>self.log, '----END OF PARAMETER LIST----'
-
-        # Compile into a dictionary that lives in devices.py...
-        devices.INSTR_DATA = dict(zip(devices.DESCR, devices.sublist))
+
+        # Gather instrument info (from Parameters sheet) into devices.INSTR_DATA:
+        devices.LoadInstrData(self.GetTopLevelParent().params, self.log)
         self.BuildComboChoices()
         self.OnAutoPop(wx.EVT_BUTTON)  # Populate combo boxes immediately
 
@@ -435,13 +403,7 @@ class SetupPage(wx.Panel):
         Choose from instrument descriptions listed in devices.DESCR
         (Uses address assignments in devices.INSTR_DATA)
         '''
-        self.instrument_choice = {'SRC': 'SRC: F5520A',
-                                  'DVM12': 'DVM: HP3458A, s/n518',
-                                  'DVM3': 'DVM: HP3458A, s/n066',
-                                  'DVMT': 'DVM: HP34401A, s/n976',
-                                  'GMH': 'GMH: s/n627',
-                                  'GMHroom': 'GMH: s/n367',
-                                  'IVbox': 'IV_box'}
+        self.instrument_choice = dict(devices.DEFAULT_ROLES)
         for r in self.instrument_choice.keys():
             d = self.instrument_choice[r]
             devices.ROLES_WIDGETS[r]['icb'].SetValue(d)  # Update i_cb
@@ -463,33 +425,14 @@ class SetupPage(wx.Panel):
     def CreateInstr(self, d, r):
         # Called by both OnAutoPop() and UpdateInstr()
         # Create each instrument in software & open visa session (GPIB only)
-        # For GMH instruments, use GMH dll, not visa
-
-        if 'GMH' in r:  # Changed from d to r
-            # create and open a GMH instrument instance
-            print'\nnbpages.SetupPage.CreateInstr(): \
-            Creating GMH device (%s -> %s).' % (d, r)
-            devices.ROLES_INSTR.update({r: devices.GMH_Sensor(d)})
-        else:
-            # create a visa instrument instance
-            print'\nnbpages.SetupPage.CreateInstr(): \
-            Creating VISA device (%s -> %s).' % (d, r)
-            devices.ROLES_INSTR.update({r: devices.instrument(d)})
-            devices.ROLES_INSTR[r].Open()
+        devices.CreateInstr(d, r)
         self.SetInstr(d, r)
 
     def SetInstr(self, d, r):
         """
         Called by CreateInstr().
-        Updates internal info (INSTR_DATA) and Enables/disables testbuttons
-        as necessary.
+        Enables/disables testbuttons as necessary.
         """
-        assert d in devices.INSTR_DATA, 'Unknown instrument: %s - \
-        check Excel file is loaded.' % d
-        assert 'role' in devices.INSTR_DATA[d], 'Unknown instrument parameter - \
-        check Excel Parameters sheet is populated.'
-        devices.INSTR_DATA[d]['role'] = r  # update default role
-
         # Set the address cb to correct value (according to devices.INSTR_DATA)
         a_cb = devices.ROLES_WIDGETS[r]['acb']
         a_cb.SetValue((devices.INSTR_DATA[d]['str_addr']))
@@ -537,8 +480,9 @@ class SetupPage(wx.Panel):
     def OnIVBoxTest(self, e):
         resource = self.IVboxAddr.GetValue()
         config = str(devices.IVBOX_CONFIGS['V1'])
+        devices.LoadVisa()
         try:
-            instr = devices.RM.open_resource(resource)
+            instr = devices.POOL.Get(resource)
             instr.write(config)
         except devices.visa.VisaIOError:
             self.Response.SetValue('Couldn\'t open visa resource for IV_box!')
@@ -561,7 +505,7 @@ class SetupPage(wx.Panel):
         wx.PostEvent(RunPage, evt)
 
     def OnVisaList(self, e):
-        res_list = devices.RM.list_resources()
+        res_list = devices.GetRM().list_resources()
         del self.ResourceList[:]  # list of COM ports ('COM X') & GPIB addr's
         del self.ComList[:]  # list of COM ports (numbers only)
         del self.GPIBList[:]  # list of GPIB addresses (numbers only)
@@ -624,6 +568,7 @@ class RunPage(wx.Panel):
         self.Bind(evts.EVT_UPDATE_COM_STR, self.UpdateComment)
         self.Bind(evts.EVT_DATA, self.UpdateData)
         self.Bind(evts.EVT_START_ROW, self.UpdateStartRow)
+        self.Bind(evts.EVT_SET_V1, self.OnSetV1Event)
 
         self.RunThread = None
 
@@ -677,6 +622,18 @@ class RunPage(wx.Panel):
         self.StopBtn = wx.Button(self, id=wx.ID_ANY, label='Abort run')
         self.StopBtn.Bind(wx.EVT_BUTTON, self.OnAbort)
         self.StopBtn.Enable(False)
+        self.PauseBtn = wx.Button(self, id=wx.ID_ANY, label='Pause')
+        self.PauseBtn.Bind(wx.EVT_BUTTON, self.OnPause)
+        self.PauseBtn.Enable(False)
+        self.ResumeBtn = wx.Button(self, id=wx.ID_ANY, label='Resume run')
+        self.ResumeBtn.Bind(wx.EVT_BUTTON, self.OnResume)
+        self.BatchBtn = wx.Button(self, id=wx.ID_ANY, label='Run batch')
+        self.BatchBtn.Bind(wx.EVT_BUTTON, self.OnBatch)
+        BatchFileLbl = wx.StaticText(self, id=wx.ID_ANY, label='Batch file:')
+        self.BatchFile = wx.TextCtrl(self, id=wx.ID_ANY)
+        self.BatchFile.SetToolTipString('CSV file: gain,Rs,comment,settle')
+        self.BatchOrder = wx.CheckBox(self, id=wx.ID_ANY, label='Order by Rs')
+        self.BatchOrder.SetValue(True)
         NodeLbl = wx.StaticText(self, id=wx.ID_ANY, label='Node:')
         self.Node = wx.ComboBox(self, wx.ID_ANY, choices=self.VNODE_CHOICE,
                                 style=wx.CB_DROPDOWN)
@@ -765,6 +722,18 @@ class RunPage(wx.Panel):
                     flag=wx.ALL | wx.EXPAND, border=5)
         gbSizer.Add(self.Progress, pos=(7, 1), span=(1, 5),
                     flag=wx.ALL | wx.EXPAND, border=5)
+        gbSizer.Add(self.ResumeBtn, pos=(8, 0), span=(1, 1),
+                    flag=wx.ALL | wx.EXPAND, border=5)
+        gbSizer.Add(self.PauseBtn, pos=(8, 1), span=(1, 1),
+                    flag=wx.ALL | wx.EXPAND, border=5)
+        gbSizer.Add(self.BatchBtn, pos=(9, 0), span=(1, 1),
+                    flag=wx.ALL | wx.EXPAND, border=5)
+        gbSizer.Add(BatchFileLbl, pos=(9, 1), span=(1, 1),
+                    flag=wx.ALL | wx.EXPAND, border=5)
+        gbSizer.Add(self.BatchFile, pos=(9, 2), span=(1, 3),
+                    flag=wx.ALL | wx.EXPAND, border=5)
+        gbSizer.Add(self.BatchOrder, pos=(9, 5), span=(1, 1),
+                    flag=wx.ALL | wx.EXPAND, border=5)
 
         self.SetSizerAndFit(gbSizer)
 
@@ -811,9 +780,14 @@ class RunPage(wx.Panel):
             self.Row.SetValue(str(e.ud['row']))
         if 'progress' in e.ud:
             self.Progress.SetValue(e.ud['progress'])
-        if 'end_flag' in e.ud:  # Aborted or Finished
+        if e.ud.get('end_flag'):  # Aborted or Finished
             self.RunThread = None
             self.StartBtn.Enable(True)
+            self.StopBtn.Enable(False)
+            self.PauseBtn.Enable(False)
+            self.PauseBtn.SetLabel('Pause')
+            self.ResumeBtn.Enable(True)
+            self.BatchBtn.Enable(True)
 
     def UpdateStartRow(self, e):
         # Triggered by an 'update startrow' event
@@ -837,18 +811,23 @@ class RunPage(wx.Panel):
         else:  # '3'
             print'\nRunPage.OnNode():IGNORING IVbox cmd "', s, '"'
 
+    def OnSetV1Event(self, e):
+        # Triggered by AqnThread (RunUI.SetV1()), which waits for done
+        try:
+            self.V1Setting.SetValue(str(e.V))  # Calls OnV1Set()
+        except Exception as err:  # Reported to AqnThread
+            e.result['error'] = err
+            print'RunPage.OnSetV1Event(): FAILED to set V1:', err
+            print >>self.GetTopLevelParent().log, 'RunPage.OnSetV1Event(): FAILED to set V1:', err
+        finally:
+            e.done.set()
+
     def OnV1Set(self, e):
         # Called by change in value (manually OR by software!)
         V1 = e.GetValue()
         print'RunPage.OnV1Set(): V1 =',V1,'(',type(V1),')'
-        src = devices.ROLES_INSTR['SRC']
-        src.SetV(V1)
-        time.sleep(0.5)
-        if V1 == 0:
-            src.Stby()
-        else:
-            src.Oper()
-        time.sleep(0.5)
+        import acquisition as acq  # (Not loaded in analysis-only sessions)
+        acq.SetSource(V1)
 
     def OnZeroVolts(self, e):
         # V1:
@@ -868,112 +847,163 @@ class RunPage(wx.Panel):
         self.status.SetStatusText('Starting run', 0)
         if self.RunThread is None:
             self.StopBtn.Enable(True)  # Enable Stop button
+            self.PauseBtn.Enable(True)
             self.StartBtn.Enable(False)  # Disable Start button
+            self.ResumeBtn.Enable(False)
+            self.BatchBtn.Enable(False)
             # start acquisition thread here
-            self.RunThread = acq.AqnThread(self)
+            ui = RunUI(self)
+            config = {'run_id': self.run_id,
+                      'comment': self.Comment.GetValue(),
+                      'DUC_G': float(self.DUCgain.GetValue()),
+                      'Rs': self.Rs_val,
+                      'start_row': ui.StartRowFromXL(),
+                      'settle_time': self.SettleDel.GetValue()}
+            import acquisition as acq
+            self.RunThread = acq.AqnThread(ui, [config])
+
+    def OnResume(self, e):
+        # Continue an interrupted run from its journal
+        xlfile = self.GetParent().GetPage(0).XLFile.GetValue()
+        if not journal.CanResume(journal.JournalPath(xlfile)):
+            self.status.SetStatusText('No interrupted run to resume', 0)
+            return
+        self.Progress.SetValue(0)
+        self.status.SetStatusText('', 1)
+        self.status.SetStatusText('Resuming run', 0)
+        if self.RunThread is None:
+            self.StopBtn.Enable(True)
+            self.PauseBtn.Enable(True)
+            self.StartBtn.Enable(False)
+            self.ResumeBtn.Enable(False)
+            self.BatchBtn.Enable(False)
+            import acquisition as acq
+            self.RunThread = acq.AqnThread(RunUI(self), resume=True)
+
+    def OnBatch(self, e):
+        # Run every configuration in the batch file, back-to-back
+        try:
+            configs = batch.LoadBatch(self.BatchFile.GetValue())
+        except (IOError, ValueError, KeyError) as err:
+            print'RunPage.OnBatch():', err
+            self.status.SetStatusText('Batch file error: %s' % err, 0)
+            return
+        if len(configs) == 0:
+            self.status.SetStatusText('Batch file is empty', 0)
+            return
+        current_Rs = getattr(self, 'Rs_val', None)
+        if self.BatchOrder.GetValue():
+            configs = batch.OrderBatch(configs, current_Rs)
+        print'RunPage.OnBatch(): %d runs, %d Rs switch(es)' % (len(configs), batch.CountSwitches(configs, current_Rs))
+        self.Progress.SetValue(0)
+        self.status.SetStatusText('', 1)
+        self.status.SetStatusText('Starting batch of %d runs' % len(configs), 0)
+        if self.RunThread is None:
+            self.StopBtn.Enable(True)
+            self.PauseBtn.Enable(True)
+            self.StartBtn.Enable(False)
+            self.ResumeBtn.Enable(False)
+            self.BatchBtn.Enable(False)
+            ui = RunUI(self)
+            runs = batch.RunConfigs(configs, self.run_id, self.autocomstr,
+                                    ui.StartRowFromXL())
+            import acquisition as acq
+            self.RunThread = acq.AqnThread(ui, runs, is_batch=True)
 
     def OnAbort(self, e):
-        self.StartBtn.Enable(True)
+        # Buttons are re-enabled when the run has ended (see UpdateData())
         self.StopBtn.Enable(False)  # Disable Stop button
-        self.RunThread._want_abort = 1  # .abort
-
+        self.PauseBtn.Enable(False)
+        if self.RunThread is not None:
+            self.RunThread.abort()
 
-'''
-__________________________________________
-#-------------- End of Run Page ----------
-__________________________________________
-'''
-'''
------------------------
-# Plot Page definition:
------------------------
-'''
-
-
-class PlotPage(wx.Panel):
-    def __init__(self, parent):
-        wx.Panel.__init__(self, parent)
+    def OnPause(self, e):
+        # Pause (source to standby) or continue (restarting current row)
+        if self.RunThread is None:
+            return
+        if self.RunThread.ctrl.paused:
+            self.RunThread.ctrl.Resume()
+            self.PauseBtn.SetLabel('Pause')
+            self.status.SetStatusText('Run continuing', 0)
+        else:
+            self.RunThread.ctrl.Pause()
+            self.PauseBtn.SetLabel('Continue')
+            self.status.SetStatusText('Run paused', 0)
+
+
+class RunUI(object):
+    """
+    The wx front end of an acquisition run (see acquisition.AqnThread):
+    progress goes to the notebook pages through a rate-limited
+    evts.EventChannel.
+    """
+    def __init__(self, run_page):
+        self.RunPage = run_page
+        self.SetupPage = run_page.GetParent().GetPage(0)
+        self.PlotPage = run_page.GetParent().GetPage(2)
+        self.CalcPage = run_page.GetParent().GetPage(3)
+        self.TopLevel = run_page.GetTopLevelParent()
+        self.gui = evts.EventChannel()  # Rate-limited route to GUI widgets
+
+        self.xlfilename = self.SetupPage.XLFile.GetValue()  # Full path
+        self.wb = self.SetupPage.wb
+        self.writer = self.TopLevel.wb_writer
+        self.log = self.SetupPage.log
+
+    def StartRowFromXL(self):
+        return self.wb.get_sheet_by_name('Data')['B1'].value
+
+    def Roles(self):
+        # Instrument descriptions selected on the Setup page
+        return dict((r, devices.ROLES_WIDGETS[r]['icb'].GetValue())
+                    for r in devices.ROLES_WIDGETS)
+
+    def Status(self, msg, field):
+        self.gui.Post(self.TopLevel, evts.StatusEvent(msg=msg, field=field))
+
+    def Data(self, ud, urgent=False):
+        self.gui.Post(self.RunPage, evts.DataEvent(ud=ud), urgent)
+
+    def StartRow(self, row):
+        self.gui.Post(self.RunPage, evts.StartRowEvent(row=row))
+
+    def ClearPlot(self):
+        self.gui.Post(self.PlotPage, evts.ClearPlotEvent())
+
+    def Plot(self, t, V12, V3, clear, node):
+        plot_ev = evts.PlotEvent(t=t, V12=V12, V3=V3, clear=clear, node=node)
+        self.gui.Post(self.PlotPage, plot_ev)
+
+    def SetV1(self, V):
+        # Set V1 (and so the source) on the GUI thread and wait till it's
+        # done. Raises runcontrol.RunAborted if it fails or takes too long.
+        done = Event()
+        result = {}
+        self.gui.Post(self.RunPage, evts.SetV1Event(V=V, done=done, result=result))
+        if not done.wait(GUI_TIMEOUT):
+            raise runcontrol.RunAborted('V1 not set within %d s' % GUI_TIMEOUT)
+        if 'error' in result:
+            raise runcontrol.RunAborted('Failed to set V1: %s' % result['error'])
+
+    def Analyse(self, start_row):
+        # Have the Analysis page analyse the run (on the GUI thread) and wait
+        done = Event()
+        anal_ev = evts.AnalyzeEvent(start_row=start_row, done=done)
+        self.gui.Post(self.CalcPage, anal_ev)
+        if not done.wait(ANALYSIS_TIMEOUT):
+            raise runcontrol.RunAborted('Run not analysed within %d s' % ANALYSIS_TIMEOUT)
 
-        self.Bind(evts.EVT_PLOT, self.UpdatePlot)
-        self.Bind(evts.EVT_CLEARPLOT, self.ClearPlot)
-
-        self.figure = Figure()
-
-        self.figure.subplots_adjust(hspace=0.3)  # 0.3" v-space b/tw subplots
-
-        self.V3ax = self.figure.add_subplot(3, 1, 3)  # 3high x 1wide, 3rd plot down
-        self.V3ax.ticklabel_format(style='sci', useOffset=False, axis='y',
-                                   scilimits=(2, -2))  # Auto o/set to centre on data
-        self.V3ax.yaxis.set_major_formatter(mtick.ScalarFormatter(useMathText=True, useOffset=False))  # Scientific notation.
-        self.V3ax.autoscale(enable=True, axis='y',
-                            tight=False)  # Autoscale with 'buffer' around data extents
-        self.V3ax.set_xlabel('time')
-        self.V3ax.set_ylabel('V3')
-
-        self.V1ax = self.figure.add_subplot(3, 1, 1, sharex=self.V3ax)  # 3high x 1wide, 1st plot down
-        self.V1ax.ticklabel_format(useOffset=False,
-                                   axis='y')  # Auto o/set to centre on data
-        self.V1ax.autoscale(enable=True,
-                            axis='y',
-                            tight=False)  # Autoscale with data 'buffer'
-        plt.setp(self.V1ax.get_xticklabels(),
-                 visible=False)  # Hide x-axis labels
-        self.V1ax.set_ylabel('V1')
-        self.V1ax.set_ylim(auto=True)
-        V1_y_ost = self.V1ax.get_xaxis().get_offset_text()
-        V1_y_ost.set_visible(False)
-
-        self.V2ax = self.figure.add_subplot(3, 1, 2, sharex=self.V3ax)  # 3high x 1wide, 2nd plot down                            
-        self.V2ax.ticklabel_format(useOffset=False,
-                                   axis='y')  # Auto offset to centre on data
-        self.V2ax.autoscale(enable=True, axis='y', tight=False)  # Autoscale with 'buffer' around data extents
-        plt.setp(self.V2ax.get_xticklabels(),
-                 visible=False)  # Hide x-axis labels
-        self.V2ax.set_ylabel('V2')
-        self.V2ax.set_ylim(auto=True)
-        V2_y_ost = self.V2ax.get_xaxis().get_offset_text()
-        V2_y_ost.set_visible(False)
-
-        self.canvas = FigureCanvas(self, wx.ID_ANY, self.figure)
-        self.sizer = wx.BoxSizer(wx.VERTICAL)
-        self.sizer.Add(self.canvas, 1, wx.LEFT | wx.TOP | wx.GROW)
-        self.SetSizerAndFit(self.sizer)
-
-    def UpdatePlot(self, e):
-        print'PlotPage.UpdatePlot(): len(t)=', len(e.t)
-        print e.node, 'len(V1)=', len(e.V12), 'len(V3)=', len(e.V3)
-        if e.node == 'V1':
-            self.V1ax.plot_date(e.t, e.V12, 'bo')
-        else:  # V2 data
-            self.V2ax.plot_date(e.t, e.V12, 'go')
-        self.V3ax.plot_date(e.t, e.V3, 'ro')
-        self.figure.autofmt_xdate()  # default settings
-        self.V3ax.fmt_xdata = mdates.DateFormatter('%d-%m-%Y, %H:%M:%S')
-        self.canvas.draw()
-        self.canvas.Refresh()
-
-    def ClearPlot(self, e):
-        self.V1ax.cla()
-        self.V2ax.cla()
-        self.V3ax.cla()
-        self.V1ax.set_ylabel('V1')
-        self.V2ax.set_ylabel('V2')
-        self.V3ax.set_ylabel('V3')
-        self.canvas.draw()
-        self.canvas.Refresh()
 
 '''
 __________________________________________
--------------- End of Plot Page ----------
+#-------------- End of Run Page ----------
 __________________________________________
 '''
-
 '''
 ---------------------------
 # Analysis Page definition:
 ---------------------------
 '''
-SEARCH_LIMIT = 24
 
 
 class CalcPage(wx.Panel):
@@ -981,13 +1011,9 @@ class CalcPage(wx.Panel):
         wx.Panel.__init__(self, parent)
 
         self.version = self.GetTopLevelParent().version
-        self.Run_id = self.GetTopLevelParent().page2.run_id
 
-        self.Rs_VALUES = self.GetTopLevelParent().page2.Rs_VALUES
-        self.Rs_NAMES = ['I-V 1k', 'I-V 10k',
-                         'I-V 100k', 'I-V 1M', 'I-V 10M',
-                         'I-V 100M', 'I-V 1G']
-        self.Rs_VAL_NAME = dict(zip(self.Rs_VALUES, self.Rs_NAMES))
+        # Event bindings
+        self.Bind(evts.EVT_ANALYZE, self.OnAnalyzeEvent)
 
         gbSizer = wx.GridBagSizer()
 
@@ -1108,272 +1134,44 @@ class CalcPage(wx.Panel):
 
     def OnAnalyze(self, e):
         self.GetXL()
+        self.GetTopLevelParent().wb_writer.Flush()  # (Any new start row)
+        self.AnalyzeRun(self.ws_Data['B1'].value)
 
-        self.Data_start_row = self.ws_Data['B1'].value
-        print'Start row =', self.Data_start_row
-        self.StartRow.SetValue(str(self.Data_start_row))
-
-        self.Data_stop_row = self.GetStopRow()
-        print'Stop row =', self.Data_stop_row
-        self.StopRow.SetValue(str(self.Data_stop_row))
-
-        # Set start row for next acquisition run:
-        self.ws_Data['B1'].value = self.Data_stop_row + 4
-
-        self.Results_start_row = self.ws_Results['B1'].value
-
+    def OnAnalyzeEvent(self, e):
+        # Triggered by AqnThread at the end of each run of a batch
+        try:
+            self.GetXL()
+            self.AnalyzeRun(e.start_row)
+        except Exception as err:  # Don't stall the batch
+            print'CalcPage.OnAnalyzeEvent(): Analysis FAILED:', err
+            print >>self.GetTopLevelParent().log, 'CalcPage.OnAnalyzeEvent(): Analysis FAILED:', err
+        finally:
+            e.done.set()
+
+    def AnalyzeRun(self, start_row):
+        # Analyse the run whose data starts at row start_row of the Data sheet
+        self.StartRow.SetValue(str(start_row))
         for V in [0.1, 1, 10]:
             for i in range(5):
                 self.Vout_widgets[V][i].SetValue('')
 
-        self.GetInstrAssignments()  # Result: self.role_descr
-        self.GetParams()  # Result: self.I_INFO, self.R_INFO
-
-        # Correction for Pt-100 sensor DVM:
-        DVMT_cor = self.I_INFO[self.role_descr['DVMT']]['correction_100r']
-
-        '''
-        Pt sensor is a few cm away from input resistors, so assume a
-        fairly large type B Tdef of 0.1 deg C:
-        '''
-        Pt_T_def = GTC.ureal(0, GTC.type_b.distribution['gaussian'](0.1),
-                             3, label='Pt_T_def')
-        Pt_alpha = self.R_INFO['Pt 100r']['alpha']
-        Pt_beta = self.R_INFO['Pt 100r']['beta']
-        Pt_R0 = self.R_INFO['Pt 100r']['R0_LV']
-        Pt_TRef = self.R_INFO['Pt 100r']['TRef_LV']
-
-        '''
-        GMH sensor is a few cm away from DUC which, itself, has a size of
-        several cm, so assume a fairly large type B Tdef of 0.1 deg C:
-        '''
-        GMH_T_def = GTC.ureal(0, GTC.type_b.distribution['gaussian'](0.1),
-                              3, label='GMH_T_def')
-
-        Comment = self.ws_Data['A'+str(self.Data_start_row)].value
-        Run_Id = self.ws_Data['B'+str(self.Data_start_row-2)].value
-        DUC_name = self.GetNamefromComment(Comment)
-        DUC_gain = self.ws_Data['B'+str(self.Data_start_row)].value
-        self.Range.SetValue(str('{0:.2e}'.format(DUC_gain)))
-        Mean_date = self.GetMeanDate()
-
-        print'Comment:', Comment
-        print'Run_Id:', Run_Id
-        print'gain =', DUC_gain
-        print 'Mean_date:', Mean_date
-
-        # Determine mean env. conditions
-        GMH_Ts = []
-        GMHroom_RHs = []
-        GMHroom_Ps = []
-        row = self.Data_start_row
-        del GMH_Ts[:]
-        del GMHroom_RHs[:]
-        del GMHroom_Ps[:]
-        while row <= self.Data_stop_row:
-            GMH_Ts.append(self.ws_Data['L'+str(row)].value)
-            GMHroom_RHs.append(self.ws_Data['R'+str(row)].value)
-            GMHroom_Ps.append(self.ws_Data['Q'+str(row)].value)
-            row += 1
-
-        d = self.role_descr['GMH']
-        print'role:GMH ->', d
-        T_GMH_cor = self.I_INFO[d]['T_correction']  # deg C, additive, ureal
-        T_GMH_raw = GTC.ta.estimate_digitized(GMH_Ts, 0.01)
-        T_GMH = T_GMH_raw + T_GMH_cor + GMH_T_def
-
-        d = self.role_descr['GMHroom']
-        RH_cor = self.I_INFO[d]['RH_correction']
-        RH_raw = GTC.ta.estimate_digitized(GMHroom_RHs, 0.1)
-        RH = RH_raw*(1 + RH_cor)
-
-        # Re-use d (same instrument description)
-        if 'P_correction' in self.I_INFO[d].keys():
-            P_cor = self.I_INFO[d]['P_correction']
-        else:
-            P_cor = GTC.ureal(0, 0)
-
-        P_raw = GTC.ta.estimate_digitized(GMHroom_Ps, 0.1)
-        P = P_raw*(1 + P_cor)
-
-        self.result_row = self.Write_Summary(Comment, Run_Id, DUC_name,
-                                             DUC_gain, Mean_date, T_GMH, RH, P)
-
-        influencies = []
-        V1s = []
-        V2s = []
-        V3s = []
-        row = self.Data_start_row
-        while row < self.Data_stop_row:
-            gains = set()
-            # 'neg' and 'pos' refer to polarity of OUTPUT VOLTAGE, not
-            # input current!
-            neg_nom_Vout = self.ws_Data['G'+str(row+1)].value
-            pos_nom_Vout = self.ws_Data['G'+str(row+2)].value
-            abs_nom_Vout = pos_nom_Vout
-
-            # Construct ureals from raw voltage data, including gain correction
-            for n in range(4):
-                label_suffix_1 = self.ws_Data['D'+str(row+n)].value+'_'+str(n)
-                label_suffix_2 = self.ws_Data['D'+str(row+4+n)].value+'_'+str(n)
-                label_suffix_3 = 'V3' + '_' + str(n)
-
-                V1_v = self.ws_Data['J'+str(row+n)].value
-                V1_u = self.ws_Data['K'+str(row+n)].value
-                V1_d = self.ws_Data['F'+str(row+n)].value - 1
-                V1_l = 'OP'+str(abs_nom_Vout)+'_'+label_suffix_1
-                d1 = self.role_descr['DVM12']
-                gain_param = self.get_gain_err_param(V1_v)
-                gain = self.I_INFO[d1][gain_param]
-                gains.add(gain)
-                V1_raw = GTC.ureal(V1_v, V1_u, V1_d, label=V1_l)
-                V1s.append(GTC.result(V1_raw/gain))
-
-                V2_v = self.ws_Data['J'+str(row+4+n)].value
-                V2_u = self.ws_Data['K'+str(row+4+n)].value
-                V2_d = self.ws_Data['F'+str(row+4+n)].value - 1
-                V2_l = 'OP'+str(abs_nom_Vout)+'_'+label_suffix_2
-                d2 = self.role_descr['DVM12']
-                gain_param = self.get_gain_err_param(V2_v)
-                gain = self.I_INFO[d2][gain_param]
-                gains.add(gain)
-                V2_raw = GTC.ureal(V2_v, V2_u, V2_d, label=V2_l)
-                V2s.append(GTC.result(V2_raw/gain))
-
-                V3_v = self.ws_Data['H'+str(row+n)].value
-                V3_u = self.ws_Data['I'+str(row+n)].value
-                V3_d = self.ws_Data['F'+str(row+n)].value - 1
-                V3_l = 'OP'+str(abs_nom_Vout)+'_'+label_suffix_3
-                d3 = self.role_descr['DVM3']
-                gain_param = self.get_gain_err_param(V3_v)
-                gain = self.I_INFO[d3][gain_param]
-                gains.add(gain)
-                V3_raw = GTC.ureal(V3_v, V3_u, V3_d, label=V3_l)
-                V3s.append(GTC.result(V3_raw/gain))
-
-                GMH_Ts.append(self.ws_Data['L'+str(row)].value)
-                GMH_Ts.append(self.ws_Data['L'+str(row+4)].value)
-                influencies.extend([V1_raw, V2_raw, V3_raw])
-
-            influencies.extend(list(gains))  # A list of unique gain corrections - no copies.
-            print 'list of gains:'
-            for g in list(gains):
-                print g.s
-
-            # Offset-adjustment
-            V1_pos = GTC.result(V1s[2] - (V1s[0] + V1s[3]) / 2)
-            V1_neg = GTC.result(V1s[1] - (V1s[0] + V1s[3]) / 2)
-            V2_pos = GTC.result(V2s[2] - (V2s[0] + V2s[3]) / 2)
-            V2_neg = GTC.result(V2s[1] - (V2s[0] + V2s[3]) / 2)
-            V3_pos = GTC.result(V3s[2] - (V3s[0] + V3s[3]) / 2)
-            V3_neg = GTC.result(V3s[1] - (V3s[0] + V3s[3]) / 2)
-
-            # V-drop across Rs
-            V_Rs_pos = GTC.result(V1_pos - V2_pos)
-            V_Rs_neg = GTC.result(V1_neg - V2_neg)
-
-            # Rs Temperature
-            T_Rs = []
-            Pt_R_cor = []
-            for r in range(8):
-                Pt_R_raw = self.ws_Data['M'+str(row+r)].value
-                Pt_R_cor.append(GTC.result(Pt_R_raw * (1 + DVMT_cor),
-                                           label='Pt_Rcor'+str(r)))
-                T_Rs.append(GTC.result(self.R_to_T(Pt_alpha, Pt_beta,
-                                                      Pt_R_cor[r],
-                                                      Pt_R0, Pt_TRef)))
-
-            av_T_Rs = GTC.result(GTC.fn.mean(T_Rs),
-                                    label='av_T_Rs'+str(abs_nom_Vout))
-            influencies.extend(Pt_R_cor)
-            influencies.extend([Pt_alpha, Pt_beta, Pt_R0, Pt_TRef,
-                                DVMT_cor, Pt_T_def])  # av_T_Rs
-            assert Pt_alpha in influencies,'Pt_alpha missing from influencies!'
-            assert Pt_beta in influencies,'Pt_beta missing from influencies!'
-            assert Pt_R0 in influencies,'Pt_R0 missing from influencies!'
-            assert Pt_TRef in influencies,'Pt_TRef missing from influencies!'
-            assert DVMT_cor in influencies,'DVMT_cor missing from influencies!'
-            assert Pt_T_def in influencies,'Pt_T_def missing from influencies!'
-
-            # Value of Rs
-            nom_Rs = self.ws_Data['C'+str(row)].value
-            print '\nNominal Rs value:', nom_Rs, 'Abs. Nom. Vout:\
-', abs_nom_Vout, '\n'
-            Rs_name = self.Rs_VAL_NAME[nom_Rs]
-            Rs_0 = self.R_INFO[Rs_name]['R0_LV']  # a ureal
-            Rs_TRef = self.R_INFO[Rs_name]['TRef_LV']  # a ureal
-            Rs_alpha = self.R_INFO[Rs_name]['alpha']
-            Rs_beta = self.R_INFO[Rs_name]['beta']
-
-            # Correct Rs value for temperature
-            dT = GTC.result(av_T_Rs - Rs_TRef + Pt_T_def)
-            Rs = GTC.result(Rs_0*(1 + Rs_alpha*dT + Rs_beta*dT**2))
-
-            influencies.extend([Rs_0, Rs_alpha, Rs_beta, Rs_TRef])
-
-            '''
-            Finally, calculate current-change in,
-            for nominal voltage-change out:
-            '''
-            Iin_pos = GTC.result(V_Rs_pos/Rs)
-            Iin_neg = GTC.result(V_Rs_neg/Rs)
-
-
-            I_pos = GTC.result(Iin_pos*pos_nom_Vout / V3_pos)
-            I_pos_k = GTC.rp.k_factor(I_pos.df)  # P = 95% by default
-            I_pos_EU = I_pos_k * I_pos.u
-            I_neg = GTC.result(Iin_neg*neg_nom_Vout/V3_neg)
-
-            self.Vout_widgets[abs_nom_Vout][0].SetValue(str(abs_nom_Vout))
-            self.Vout_widgets[abs_nom_Vout][1].SetValue('{0:.8g}'.format(I_pos.x))
-            self.Vout_widgets[abs_nom_Vout][2].SetValue('{0:.8g}'.format(I_neg.x))
+        import analysis  # (and GTC) - slow, so not until first needed
+        top = self.GetTopLevelParent()
+        anal = analysis.RunAnalysis(top.wb, self.version, top.params)
+        top.wb_writer.Flush()  # All of the run's rows are in the workbook
+        with top.wb_writer.lock:  # No queued update or save meanwhile
+            summary = anal.AnalyzeRun(start_row)
+
+        self.StopRow.SetValue(str(summary['stop_row']))
+        self.Range.SetValue(str('{0:.2e}'.format(summary['DUC_gain'])))
+        for result in summary['results']:
+            widgets = self.Vout_widgets[result['Vout']]
+            widgets[0].SetValue(str(result['Vout']))
+            widgets[1].SetValue('{0:.8g}'.format(result['I_pos'].x))
+            widgets[2].SetValue('{0:.8g}'.format(result['I_neg'].x))
             # Just display positive value for now:
-            self.Vout_widgets[abs_nom_Vout][3].SetValue('{0:.3g}'.format(I_pos_EU))
-            self.Vout_widgets[abs_nom_Vout][4].SetValue(str(round(I_pos_k)))
-
-            this_result = {'Vout': abs_nom_Vout, 'I_pos': I_pos,
-                           'I_neg': I_neg}
-
-            # build uncertainty budget table
-            budget_table_pos = []
-            budget_table_neg = []
-            for i in influencies:
-                print'Working through influence variables:', i.label
-                if i.u == 0:
-                    sensitivity_pos = sensitivity_neg = 0
-                else:
-                    sensitivity_pos = GTC.component(I_pos, i)/i.u
-                    sensitivity_neg = GTC.component(I_neg, i)/i.u
-                # Only include non-zero influencies:
-                if abs(GTC.component(I_pos, i)) > 0:
-                    print 'Included component of I+:',GTC.component(I_pos, i)
-                    budget_table_pos.append([i.label, i.x, i.u, i.df,
-                                             sensitivity_pos,
-                                             GTC.component(I_pos, i)])
-                else:
-                    print'ZERO COMPONENT of I+'
-                if abs(GTC.component(I_neg, i)) > 0:
-                    print 'Included component of I_neg',GTC.component(I_neg, i)
-                    budget_table_neg.append([i.label, i.x, i.u, i.df,
-                                             sensitivity_neg,
-                                             GTC.component(I_neg, i)])
-                else:
-                    print'ZERO COMPONENT of I-'
-            self.budget_table_pos_sorted = sorted(budget_table_pos,
-                                                  key=self.by_u_cont,
-                                                  reverse=True)
-            self.budget_table_neg_sorted = sorted(budget_table_neg,
-                                                  key=self.by_u_cont,
-                                                  reverse=True)
-
-            # Write results (including budgets)
-            self.result_row = self.WriteThisResult(this_result)
-            time.sleep(0.1)
-            row += 8
-            del influencies[:]
-            del V1s[:]
-            del V2s[:]
-            del V3s[:]
+            widgets[3].SetValue('{0:.3g}'.format(result['EU']))
+            widgets[4].SetValue(str(round(result['k'])))
 
     def GetXL(self):
         '''
@@ -1390,352 +1188,4 @@ class CalcPage(wx.Panel):
 
     def OnStartRow(self, e):
         self.GetXL()
-        self.ws_Data['B1'].value = int(e.GetString())
-
-    def GetStopRow(self):
-        row = self.Data_start_row
-        self.Test_Vs = []
-        '''
-        Don't search forever and
-        ignore final row:
-        '''
-        while row < self.Data_start_row + SEARCH_LIMIT - 1:
-            NomVOP = self.ws_Data['G'+str(row)].value
-            if NomVOP in (None, 'Nom. Vout '):  # Ran out of data
-                print'Break row =', row
-                break
-            elif NomVOP in (0.1, 1, 10):
-                self.Test_Vs.append(NomVOP)
-                row += 1
-                continue
-            else:  # in (0,-0.1, -1, -10)
-                row += 1
-                continue
-        Test_V_set = set(self.Test_Vs)
-        if len(Test_V_set) < 1:
-            print'GetStopRow(): Incomplete data! - ', self.Test_Vs
-            return self.Data_start_row
-        else:
-            print 'GetStopRow(): Test Vs:', Test_V_set
-            return self.Data_start_row + 4 * len(self.Test_Vs) - 1
-
-    def GetNamefromComment(self, c):
-        return c[c.find('DUC: ') + 5: c.find(' monitored by GMH')]
-
-    def GetMeanDate(self):
-        r = self.Data_start_row
-        n = 0
-        t_av = 0.0
-        while r <= self.Data_stop_row:
-            s = self.ws_Data['E'+str(r)].value  # A unicode str
-            # Convert s to a Python datetime object:
-            t_dt = dt.datetime.strptime(s, '%d/%m/%Y %H:%M:%S')
-            t_tup = dt.datetime.timetuple(t_dt)  # A Python time tuple object
-            t_av += time.mktime(t_tup)  # time as float (seconds from epoch)
-            r += 1
-            n += 1
-        t_av /= n
-        t_av_dt = dt.datetime.fromtimestamp(t_av)
-        return t_av_dt.strftime('%d/%m/%Y %H:%M:%S')  # av. time as string
-
-    def Write_Summary(self, Comment, Run_Id, DUC_name,
-                      DUC_gain, date, T, RH, P):
-        '''
-        Write Run summary and result column-headings.
-        Return next row
-        '''
-        DELTA = u'\N{GREEK CAPITAL LETTER DELTA}'
-        row = self.Results_start_row
-        proc_date = dt.datetime.now().strftime('%d/%m/%Y %H:%M:%S')
-        proc_string = 'Processesed by IVY v{} on {}'.format(self.version, proc_date)
-        self.ws_Results['H'+str(row)].value = proc_string
-        self.ws_Results['A'+str(row)].value = 'Comment:'
-        self.ws_Results['B'+str(row)].value = Comment
-        self.ws_Results['A'+str(row+1)].value = 'Run Id:'
-        self.ws_Results['B'+str(row+1)].value = Run_Id
-        self.ws_Results['A'+str(row+2)].value = 'Date:'
-        self.ws_Results['B'+str(row+2)].value = date
-        self.ws_Results['A'+str(row+3)].value = 'DUC Name:'
-        self.ws_Results['B'+str(row+3)].value = DUC_name
-        self.ws_Results['A'+str(row+4)].value = 'Gain (V/A):'
-        self.ws_Results['B'+str(row+4)].value = DUC_gain
-
-        self.ws_Results['C'+str(row+2)].value = 'Condition:'
-        self.ws_Results['C'+str(row+3)].value = 'Value:'
-        self.ws_Results['C'+str(row+4)].value = 'Exp Uncert.:'
-        self.ws_Results['C'+str(row+5)].value = 'Cov. factor:'
-
-        T_k = GTC.rp.k_factor(T.df)
-        self.ws_Results['D'+str(row+2)].value = 'T (GMH)'
-        self.ws_Results['D'+str(row+3)].value = T.x
-        self.ws_Results['D'+str(row+4)].value = T_k*T.u
-        self.ws_Results['D'+str(row+5)].value = T_k
-
-        RH_k = GTC.rp.k_factor(RH.df)
-        self.ws_Results['E'+str(row+2)].value = 'RH (%)'
-        self.ws_Results['E'+str(row+3)].value = RH.x
-        self.ws_Results['E'+str(row+4)].value = RH_k*RH.u
-        self.ws_Results['E'+str(row+5)].value = RH_k
-
-        P_k = GTC.rp.k_factor(P.df)
-        self.ws_Results['F'+str(row+2)].value = 'P (mBar)'
-        self.ws_Results['F'+str(row+3)].value = P.x
-        self.ws_Results['F'+str(row+4)].value = P_k * P.u
-        self.ws_Results['F'+str(row+5)].value = P_k
-        # Add blank line below summary
-        self.ws_Results['H'+str(row+6)].value = 'Uncertainty Budget:'
-        self.ws_Results['A'+str(row+7)].value = 'Nom. ' + DELTA + 'V'
-        self.ws_Results['B'+str(row+7)].value = DELTA + 'I in'
-        self.ws_Results['C'+str(row+7)].value = 'Std. u'
-        self.ws_Results['D'+str(row+7)].value = 'dof'
-        self.ws_Results['E'+str(row+7)].value = 'Exp. U'
-        self.ws_Results['F'+str(row+7)].value = 'k'
-        self.ws_Results['H'+str(row+7)].value = 'Quantity (label)'
-        self.ws_Results['I'+str(row+7)].value = 'Value'
-        self.ws_Results['J'+str(row+7)].value = 'Std. u'
-        self.ws_Results['K'+str(row+7)].value = 'dof'
-        self.ws_Results['L'+str(row+7)].value = 'Sens. Co.'
-        self.ws_Results['M'+str(row+7)].value = 'Uncert. Cont.'
-
-        return row+8
-
-    def GetInstrAssignments(self):
-        N_ROLES = 7  # 7 roles in total
-        self.role_descr = {}
-        for row in range(self.Data_start_row, self.Data_start_row + N_ROLES):
-            # Read {role:description}
-            role = self.ws_Data['S' + str(row)].value
-            descrip = self.ws_Data['T' + str(row)].value
-            temp_dict = {role: descrip}
-            print temp_dict
-            assert temp_dict.keys()[-1] is not None, 'Instrument assignment: Missing role!'
-            assert temp_dict.values()[-1] is not None, 'Instrument assignment: Missing description!'
-            self.role_descr.update(temp_dict)
-
-    def Uncertainize(self, items):
-        '''
-        Convert a list of data to a ureal, where possible.
-        Expects items to be a list: [value, uncert, dof, label].
-        If uncert is missing or value is non-numeric return value.
-        Otherwise, return a ureal (with or without default dof)
-        '''
-        v = items[0]
-        if len(items) < 4:
-            return v
-        u = items[1]
-        d = items[2]
-        l = items[3]
-        if (u is not None) and isinstance(v, Number):
-            if d == u'inf':
-                un_num = GTC.ureal(v, u, label=l)  # default dof = inf
-            else:
-                un_num = GTC.ureal(v, u, d, l)
-            return un_num
-        else:  # non-numeric value or not enough info to make a ureal
-            return v
-
-    def GetParams(self):
-        '''
-        Extract resistor and instrument parameters
-        '''
-        print '\nReading parameters...'
-        # log.write('Reading parameters...')
-        headings = (u'Resistor Info:', u'Instrument Info:',
-                    u'description', u'parameter', u'value',
-                    u'uncert', u'dof', u'label', u'Comment / Reference')
-
-        # Determine colummn indices from column letters:
-        col_A = cell.cell.column_index_from_string('A') - 1
-        col_B = cell.cell.column_index_from_string('B') - 1
-        col_C = cell.cell.column_index_from_string('C') - 1
-        col_D = cell.cell.column_index_from_string('D') - 1
-        col_E = cell.cell.column_index_from_string('E') - 1
-        col_F = cell.cell.column_index_from_string('F') - 1
-        col_G = cell.cell.column_index_from_string('G') - 1
-
-        col_I = cell.cell.column_index_from_string('I') - 1
-        col_J = cell.cell.column_index_from_string('J') - 1
-        col_K = cell.cell.column_index_from_string('K') - 1
-        col_L = cell.cell.column_index_from_string('L') - 1
-        col_M = cell.cell.column_index_from_string('M') - 1
-        col_N = cell.cell.column_index_from_string('N') - 1
-        col_O = cell.cell.column_index_from_string('O') - 1
-
-        R_params = []
-        R_row_items = []
-        I_params = []
-        I_row_items = []
-        R_values = []
-        I_values = []
-        R_DESCR = []
-        I_DESCR = []
-        R_sublist = []
-        I_sublist = []
-
-        for r in self.ws_Params.rows:  # a tuple of row objects
-            R_end = 0
-
-            # description, parameter, value, uncert, dof, label:
-            R_row_items = [r[col_A].value, r[col_B].value, r[col_C].value,
-                           r[col_D].value, r[col_E].value, r[col_F].value,
-                           r[col_G].value]
-
-            I_row_items = [r[col_I].value, r[col_J].value, r[col_K].value,
-                           r[col_L].value, r[col_M].value, r[col_N].value,
-                           r[col_O].value]
-
-            if R_row_items[0] == None:  # end of R_list
-                R_end = 1
-
-            # check this row for heading text
-            if any(i in I_row_items for i in headings):
-                continue  # Skip headings
-
-            else:  # not header - main data
-                # Get instrument parameters first...
-                '''
-                Need to know last row if we write more data, post-analysis:
-                '''
-                last_I_row = r[col_I].row
-                I_params.append(I_row_items[1])
-                I_values.append(self.Uncertainize(I_row_items[2:6]))
-                '''
-                'test' is always the last parameter for each
-                instrument description:
-                '''
-                if I_row_items[1] == u'test':
-                    I_DESCR.append(I_row_items[0])  # build description list
-                    # Add parameter dictionary to sublist:
-                    I_sublist.append(dict(zip(I_params, I_values)))
-                    del I_params[:]
-                    del I_values[:]
-
-                # Now attend to resistor parameters...
-                if R_end == 0:  # If not at end of resistor data-block
-                    '''
-                    Need to know last row if we write more data, post-analysis:
-                    '''
-                    last_R_row = r[col_A].row
-                    R_params.append(R_row_items[1])
-                    R_values.append(self.Uncertainize(R_row_items[2:6]))
-                    '''
-                    'T_sensor' is always the last parameter for each
-                    resistor description:
-                    '''
-                    if R_row_items[1] == u'T_sensor':
-                        R_DESCR.append(R_row_items[0])  # build descr list
-                        # Add parameter dictionary to sublist:
-                        R_sublist.append(dict(zip(R_params, R_values)))
-                        del R_params[:]
-                        del R_values[:]
-
-        """
-        Compile into dictionaries:
-        There are two dictionaries; one for instruments (I_INFO) and one for
-        resistors (R_INFO). Each dictionary item is keyed by the description
-        (name) of the instrument (resistor). Each dictionary value is itself
-        a dictionary, keyed by parameter, such as 'address' (for an instrument)
-        or 'R_LV' (for a resistor value, measured at 'low voltage').
-        """
-        self.I_INFO = dict(zip(I_DESCR, I_sublist))
-        print len(self.I_INFO), 'instruments (%d rows)' % last_I_row
-
-        self.R_INFO = dict(zip(R_DESCR, R_sublist))
-        print len(self.R_INFO), 'resistors.(%d rows)\n' % last_R_row
-
-    def get_gain_err_param(self, V):
-        if abs(V) < 0.001:
-            nomV = '0.0001'
-            nomRange = '0.1'
-        elif abs(V) < 0.022:
-            nomV = '0.01'
-            nomRange = '0.1'
-        elif abs(V) < 0.071:
-            nomV = '0.05'
-            nomRange = '0.1'
-        elif abs(V) < 0.22:
-            nomV = '0.1'
-            nomRange = '0.1'
-        elif abs(V) < 0.71:
-            nomV = '0.5'
-            nomRange = '1'
-        elif abs(V) < 2.2:
-            nomV = nomRange = '1'
-        else:
-            nomV = nomRange = str(int(abs(round(V))))  # '1' or '10'
-        gain_param = 'Vgain_{0}r{1}'.format(nomV, nomRange)
-        return gain_param
-
-    def R_to_T(self, alpha, beta, R, R0, T0):
-        # Convert a resistive T-sensor reading from resistance to temperature
-        if (beta.x == 0 and beta.u == 0):  # No 2nd-order T-Co
-            T = GTC.result((R/R0 - 1)/alpha + T0)
-        else:
-            a = GTC.result(beta)
-            b = GTC.result(alpha - 2*beta*T0, True)
-            c = GTC.result(1 - alpha*T0 + beta*T0**2 - (R/R0))
-            T = GTC.result((-b + GTC.sqrt(b**2 - 4*a*c))/(2*a))
-        return T
-
-    def by_u_cont(self, line):
-        '''
-        A function required for budget-table sorting
-        by uncertainty contribution.
-        '''
-        return line[5]
-
-    def WriteThisResult(self, result):
-        '''
-        Write results and uncert. budget for nom.Vout (BOTH polarities)
-        '''
-        r = self.result_row
-        print'WriteThisResult(): Starting result_row =', r
-        sh = self.ws_Results
-
-        # Positive results 1st..
-        sh['A'+str(r)].value = result['Vout']
-        sh['B'+str(r)].value = result['I_pos'].x
-        sh['C'+str(r)].value = result['I_pos'].u
-        sh['D'+str(r)].value = result['I_pos'].df
-        k = GTC.rp.k_factor(result['I_pos'].df)
-        sh['E'+str(r)].value = k*result['I_pos'].u
-        sh['F'+str(r)].value = k
-
-        for line in self.budget_table_pos_sorted:
-            sh['H'+str(r)] = line[0]  # Quantity (label)
-            sh['I'+str(r)] = line[1]  # Value
-            sh['J'+str(r)] = line[2]  # Uncert.
-            if math.isinf(line[3]):
-                sh['K'+str(r)] = str(line[3])  # dof
-            else:
-                sh['K'+str(r)] = round(line[3])  # dof
-            sh['L'+str(r)] = line[4]  # Sens. coef.
-            sh['M'+str(r)] = line[5]  # Uncert. contrib.
-            r += 1
-
-        r += 1  # Blank line between polarities
-
-        # ...then negative results...
-        sh['A'+str(r)].value = -1*result['Vout']
-        sh['B'+str(r)].value = result['I_neg'].x
-        sh['C'+str(r)].value = result['I_neg'].u
-        sh['D'+str(r)].value = result['I_neg'].df
-        k = GTC.rp.k_factor(result['I_neg'].df)
-        sh['E'+str(r)].value = k*result['I_neg'].u
-        sh['F'+str(r)].value = k
-
-        for line in self.budget_table_neg_sorted:
-            sh['H'+str(r)] = line[0]  # Quantity (label)
-            sh['I'+str(r)] = line[1]  # Value
-            sh['J'+str(r)] = line[2]  # Uncert.
-            if math.isinf(line[3]):
-                sh['K'+str(r)] = str(line[3])  # dof
-            else:
-                sh['K'+str(r)] = round(line[3])  # dof
-            sh['L'+str(r)] = line[4]  # Sens. coef.
-            sh['M'+str(r)] = line[5]  # Uncert. contrib.
-            r += 1
-
-        print'WriteThisResult(): Final result_row =', r
-        self.ws_Results['B1'].value = r+1
-        return r+1  # Blank line between results
+        self.GetTopLevelParent().wb_writer.Put('Data', 'B1', int(e.GetString()))
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+params.py
+
+Parameter store.
+The Parameters sheet holds two blocks of calibration info, each a list of
+rows: description | parameter | value | uncert | dof | label.
+* 'resistor' - columns A - F, each description's last parameter is
+  'T_sensor',
+* 'instrument' - columns I - N, each description's last parameter is
+  'test'.
+Heading rows and rows without a description or parameter are skipped.
+
+Load() parses the sheet once into a ParamStore, which holds the raw
+items, indexed by block, description and parameter (with the row each
+came from), and hands out two views of a block:
+* Plain() - a value, or [value, uncert, dof, label] for a value with an
+  uncertainty (as devices.INSTR_DATA),
+* Uncertain() - a GTC ureal wherever there's a numeric value with an
+  uncertainty, otherwise the value (as used by analysis.RunAnalysis).
+
+Given the workbook's file name, the parsed items are also cached on disk
+('<workbook>_params.json' - plain data, never code), keyed by the SHA-1
+hash of the Parameters sheet's contents (its cells, with shared strings
+resolved). So re-opening a workbook skips the parse while its parameters
+are unchanged - however many Data rows have been saved since.
+"""
+
+import os
+import json
+import hashlib
+import zipfile
+from numbers import Number
+import xml.etree.ElementTree as ET
+
+from openpyxl import cell
+
+import xlstream
+
+'''
+BLOCKS: {block: (first column, last parameter of each description)}.
+Each block occupies 6 columns from its first: description, parameter,
+value, uncert, dof, label.
+'''
+BLOCKS = {'resistor': ('A', u'T_sensor'),
+          'instrument': ('I', u'test')}
+HEADINGS = (u'Resistor Info:', u'Instrument Info:', u'description',
+            u'parameter', u'value', u'uncert', u'dof', u'label',
+            u'Comment / Reference')
+CACHE_VERSION = 2  # Bump if the parsed format changes
+SHARED_STRINGS = 'xl/sharedStrings.xml'
+
+
+class ParamStore(object):
+    """
+    Parsed Parameters sheet.
+    items: {block: {description: {parameter: [value, uncert, dof, label]}}}
+    rows: {block: {description: {parameter: row}}}
+    descr: {block: [description,...]} (in sheet order)
+    """
+    def __init__(self, items, rows, descr):
+        self.items = items
+        self.rows = rows
+        self.descr = descr
+        self._uncertain = {}
+
+    def LastRow(self, block):
+        rows = [r for d in self.rows[block].values() for r in d.values()]
+        return max(rows) if len(rows) > 0 else 0
+
+    def Plain(self, block):
+        # {description: {parameter: value or [value, uncert, dof, label]}}
+        view = {}
+        for d in self.descr[block]:
+            view[d] = dict((p, PlainValue(v_u_d_l))
+                           for p, v_u_d_l in self.items[block][d].items())
+        return view
+
+    def Uncertain(self, block):
+        '''
+        {description: {parameter: ureal or value}}. Built once per store,
+        so every user of a parameter shares the same uncertain number.
+        '''
+        if block not in self._uncertain:
+            view = {}
+            for d in self.descr[block]:
+                view[d] = dict((p, Uncertainize(v_u_d_l))
+                               for p, v_u_d_l in self.items[block][d].items())
+            self._uncertain[block] = view
+        return self._uncertain[block]
+
+
+def PlainValue(v_u_d_l):
+    if v_u_d_l[1] is None:  # single-valued (no uncert)
+        return v_u_d_l[0]
+    v_u_d_l = list(v_u_d_l)
+    while v_u_d_l[-1] is None:  # remove empty cells
+        del v_u_d_l[-1]
+    return v_u_d_l
+
+
+def Uncertainize(items):
+    '''
+    Convert a list of data to a ureal, where possible.
+    Expects items to be a list: [value, uncert, dof, label].
+    If uncert is missing or value is non-numeric return value.
+    Otherwise, return a ureal (with or without default dof)
+    '''
+    v, u, d, l = items
+    if (u is not None) and isinstance(v, Number):
+        import GTC  # Only needed for the uncertain view
+        if d == u'inf':
+            return GTC.ureal(v, u, label=l)  # default dof = inf
+        else:
+            return GTC.ureal(v, u, d, l)
+    else:  # non-numeric value or not enough info to make a ureal
+        return v
+
+
+def Parse(ws):
+    '''
+    Walk the Parameters worksheet ws once, building a ParamStore.
+    '''
+    items = {}
+    rows = {}
+    descr = {}
+    cols = {}
+    pending = {}  # {block: (params, param_rows)} of the unfinished description
+    for block, (col, last) in BLOCKS.items():
+        first = cell.cell.column_index_from_string(col) - 1
+        cols[block] = range(first, first + 6)
+        items[block] = {}
+        rows[block] = {}
+        descr[block] = []
+        pending[block] = ({}, {})
+
+    for r in ws.rows:  # a tuple of row objects
+        for block, (col, last) in BLOCKS.items():
+            c = cols[block]
+            vals = [r[i].value if i < len(r) else None for i in c]  # (short rows)
+            d, p = vals[0], vals[1]
+            if d is None or p is None or d in HEADINGS or p in HEADINGS:
+                continue
+            params, param_rows = pending[block]
+            params[p] = vals[2:]  # value,uncert,dof,label
+            param_rows[p] = r[c[0]].row
+            if p == last:  # last parameter for this description
+                descr[block].append(d)
+                items[block][d] = params
+                rows[block][d] = param_rows
+                pending[block] = ({}, {})
+    return ParamStore(items, rows, descr)
+
+
+def CachePath(xlfilename):
+    # E.g. 'IVY_data.xlsx' -> 'IVY_data_params.json'
+    return os.path.splitext(xlfilename)[0] + '_params.json'
+
+
+def SharedStrings(zf):
+    # The workbook's shared strings table, as a list
+    if SHARED_STRINGS not in zf.namelist():
+        return []
+    si = xlstream.NS_MAIN + 'si'
+    t = xlstream.NS_MAIN + 't'
+    return [u''.join(e.text or u'' for e in s.iter(t))
+            for s in ET.fromstring(zf.read(SHARED_STRINGS)).iter(si)]
+
+
+def CacheKey(xlfilename):
+    '''
+    [version, SHA-1 of the Parameters sheet's cells] - each cell's
+    reference, type and value, with shared strings resolved, so the key
+    doesn't change when other sheets (or the string table) do.
+    '''
+    h = hashlib.sha1()
+    with zipfile.ZipFile(xlfilename) as zf:
+        sheet = ET.fromstring(zf.read(xlstream.SheetParts(zf)['Parameters']))
+        strings = None
+        for c in sheet.iter(xlstream.NS_MAIN + 'c'):
+            v = c.find(xlstream.NS_MAIN + 'v')
+            if v is not None and c.get('t') == 's':
+                if strings is None:
+                    strings = SharedStrings(zf)
+                value = strings[int(v.text)]
+            elif v is not None:
+                value = v.text or u''
+            else:  # (Inline string, or empty)
+                value = u''.join(e.text or u'' for e in c.iter(xlstream.NS_MAIN + 't'))
+            h.update(repr((c.get('r'), c.get('t'), value)))
+    return [CACHE_VERSION, h.hexdigest()]
+
+
+def Load(wb, xlfilename=None, log=None):
+    '''
+    The ParamStore for workbook wb: from the cache if xlfilename is given
+    and the cache matches it, otherwise parsed (and, given xlfilename,
+    cached).
+    '''
+    key = None
+    if xlfilename is not None:
+        try:
+            key = CacheKey(xlfilename)
+            with open(CachePath(xlfilename), 'rb') as f:
+                cached = json.load(f)
+            if cached['key'] == key:
+                print 'params.Load(): using cached parameters'
+                return ParamStore(cached['items'], cached['rows'],
+                                  cached['descr'])
+        except Exception:  # No (usable) cache - missing, stale or foreign
+            pass
+
+    store = Parse(wb.get_sheet_by_name('Parameters'))
+    for block in ('instrument', 'resistor'):
+        print 'params.Load(): %d %s descriptions (to row %d)' % (len(store.descr[block]), block, store.LastRow(block))
+        if log is not None:
+            print >>log, 'params.Load(): %d %s descriptions (to row %d)' % (len(store.descr[block]), block, store.LastRow(block))
+    if key is not None:
+        try:
+            cached = json.dumps({'key': key, 'items': store.items,
+                                 'rows': store.rows, 'descr': store.descr})
+            with open(CachePath(xlfilename), 'wb') as f:
+                f.write(cached)
+        except (IOError, TypeError, ValueError) as err:  # (E.g. a date value)
+            print 'params.Load(): parameters not cached (%s)' % err
+    return store
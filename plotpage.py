@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+""" plotpage.py - The Plots notebook page
+
+Kept apart from nbpages.py so that matplotlib (slow to import) is only
+loaded when the Plots page is created - not in analysis-only mode (see
+IVY_main.py).
+
+Created on Tue Jun 30 10:10:16 2015
+
+@author: t.lawson
+"""
+
+import wx
+
+import matplotlib
+matplotlib.use('WXAgg')  # Agg renderer for drawing on a wx canvas
+from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg as FigureCanvas
+# from matplotlib.backends.backend_wx import NavigationToolbar2Wx
+from matplotlib.figure import Figure
+import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
+import matplotlib.ticker as mtick
+
+import IVY_events as evts
+
+matplotlib.rc('lines', linewidth=1, color='blue')
+
+
+'''
+-----------------------
+# Plot Page definition:
+-----------------------
+'''
+
+
+class PlotPage(wx.Panel):
+    def __init__(self, parent):
+        wx.Panel.__init__(self, parent)
+
+        self.Bind(evts.EVT_PLOT, self.UpdatePlot)
+        self.Bind(evts.EVT_CLEARPLOT, self.ClearPlot)
+
+        self.figure = Figure()
+
+        self.figure.subplots_adjust(hspace=0.3)  # 0.3" v-space b/tw subplots
+
+        self.V3ax = self.figure.add_subplot(3, 1, 3)  # 3high x 1wide, 3rd plot down
+        self.V3ax.ticklabel_format(style='sci', useOffset=False, axis='y',
+                                   scilimits=(2, -2))  # Auto o/set to centre on data
+        self.V3ax.yaxis.set_major_formatter(mtick.ScalarFormatter(useMathText=True, useOffset=False))  # Scientific notation.
+        self.V3ax.autoscale(enable=True, axis='y',
+                            tight=False)  # Autoscale with 'buffer' around data extents
+        self.V3ax.set_xlabel('time')
+        self.V3ax.set_ylabel('V3')
+
+        self.V1ax = self.figure.add_subplot(3, 1, 1, sharex=self.V3ax)  # 3high x 1wide, 1st plot down
+        self.V1ax.ticklabel_format(useOffset=False,
+                                   axis='y')  # Auto o/set to centre on data
+        self.V1ax.autoscale(enable=True,
+                            axis='y',
+                            tight=False)  # Autoscale with data 'buffer'
+        plt.setp(self.V1ax.get_xticklabels(),
+                 visible=False)  # Hide x-axis labels
+        self.V1ax.set_ylabel('V1')
+        self.V1ax.set_ylim(auto=True)
+        V1_y_ost = self.V1ax.get_xaxis().get_offset_text()
+        V1_y_ost.set_visible(False)
+
+        self.V2ax = self.figure.add_subplot(3, 1, 2, sharex=self.V3ax)  # 3high x 1wide, 2nd plot down                            
+        self.V2ax.ticklabel_format(useOffset=False,
+                                   axis='y')  # Auto offset to centre on data
+        self.V2ax.autoscale(enable=True, axis='y', tight=False)  # Autoscale with 'buffer' around data extents
+        plt.setp(self.V2ax.get_xticklabels(),
+                 visible=False)  # Hide x-axis labels
+        self.V2ax.set_ylabel('V2')
+        self.V2ax.set_ylim(auto=True)
+        V2_y_ost = self.V2ax.get_xaxis().get_offset_text()
+        V2_y_ost.set_visible(False)
+
+        self.canvas = FigureCanvas(self, wx.ID_ANY, self.figure)
+        self.sizer = wx.BoxSizer(wx.VERTICAL)
+        self.sizer.Add(self.canvas, 1, wx.LEFT | wx.TOP | wx.GROW)
+        self.SetSizerAndFit(self.sizer)
+
+    def UpdatePlot(self, e):
+        print'PlotPage.UpdatePlot(): len(t)=', len(e.t)
+        print e.node, 'len(V1)=', len(e.V12), 'len(V3)=', len(e.V3)
+        if e.node == 'V1':
+            self.V1ax.plot_date(e.t, e.V12, 'bo')
+        else:  # V2 data
+            self.V2ax.plot_date(e.t, e.V12, 'go')
+        self.V3ax.plot_date(e.t, e.V3, 'ro')
+        self.figure.autofmt_xdate()  # default settings
+        self.V3ax.fmt_xdata = mdates.DateFormatter('%d-%m-%Y, %H:%M:%S')
+        self.canvas.draw()
+        self.canvas.Refresh()
+
+    def ClearPlot(self, e):
+        self.V1ax.cla()
+        self.V2ax.cla()
+        self.V3ax.cla()
+        self.V1ax.set_ylabel('V1')
+        self.V2ax.set_ylabel('V2')
+        self.V3ax.set_ylabel('V3')
+        self.canvas.draw()
+        self.canvas.Refresh()
+
+'''
+__________________________________________
+-------------- End of Plot Page ----------
+__________________________________________
+'''
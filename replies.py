@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+replies.py
+
+Decoding of instrument replies into numbers.
+Used for everything read back from DVMs (and other devices.instrument
+objects), whether a single ASCII reading, a comma-separated list of
+readings or a binary block of readings.
+
+Malformed replies are rejected with a ValueError, rather than being
+'cleaned up' by discarding unexpected characters.
+"""
+
+import re
+import numpy as np
+
+_NUM = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+SINGLE_RE = re.compile(r'^\s*' + _NUM + r'\s*$')
+MULTI_RE = re.compile(r'^\s*' + _NUM + r'(?:\s*,\s*' + _NUM + r')*\s*$')
+
+'''
+Binary reading formats: {format: (numpy dtype, needs scale factor)}.
+All are big-endian (HP3458A naming). Integer formats must be multiplied
+by a scale factor (HP3458A: ISCALE?), which depends on the range.
+'''
+BINARY_FORMATS = {'SINT': ('>i2', True),
+                  'DINT': ('>i4', True),
+                  'SREAL': ('>f4', False),
+                  'DREAL': ('>f8', False)}
+
+
+def ParseReply(reply):
+    """
+    Convert a single-reading reply, e.g. u' +1.00001234E+00\\r\\n', to a float.
+    """
+    if SINGLE_RE.match(reply) is None:
+        raise ValueError('Malformed instrument reply: %r' % reply)
+    return float(reply)
+
+
+def ParseReplies(reply):
+    """
+    Convert a comma-separated multi-reading reply to a numpy array.
+    """
+    if MULTI_RE.match(reply) is None:
+        raise ValueError('Malformed multi-reading reply: %r' % reply[:80])
+    return np.array(reply.split(','), dtype=float)
+
+
+def ParseBlock(raw, fmt, scale=1.0, n=None):
+    """
+    Convert a block of binary readings (a byte string) to a numpy array.
+    An IEEE-488.2 definite-length block header ('#<n><length>') is
+    stripped if present. If the number of readings n is given, the block
+    must hold exactly n readings (plus, at most, a line terminator).
+    """
+    assert fmt in BINARY_FORMATS, 'Unknown binary format %s' % fmt
+    dtype = np.dtype(BINARY_FORMATS[fmt][0])
+    if raw[:1] == b'#':
+        n_digits = int(raw[1:2])
+        length = int(raw[2:2 + n_digits])
+        raw = raw[2 + n_digits: 2 + n_digits + length]
+    if n is None:
+        n_bytes = len(raw) - len(raw) % dtype.itemsize
+    else:
+        n_bytes = n*dtype.itemsize
+    if len(raw) < n_bytes or raw[n_bytes:] not in (b'', b'\n', b'\r\n'):
+        raise ValueError('Binary block holds %d bytes, not a whole number of %s readings' % (len(raw), fmt))
+    readings = np.frombuffer(raw[:n_bytes], dtype=dtype).astype(float)
+    if BINARY_FORMATS[fmt][1]:
+        readings *= scale
+    return readings
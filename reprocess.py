@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+reprocess.py
+
+Archive-wide re-analysis.
+When a calibration parameter (e.g. a DVM Vgain_* correction or an Rs
+alpha) is revised, every affected result has to be re-calculated. This
+scans a directory of IVY workbooks, finds every run block on each Data
+sheet (a 'Run ID:' row, two rows above the run's first data row) and
+re-analyses them all (analysis.RunAnalysis) on a multiprocessing pool,
+e.g.:
+
+    python -m reprocess I:\\IVY\\archive
+    python -m reprocess I:\\IVY\\archive --params master.xlsx --by run
+
+GTC is pure Python, so the analysis is single-core bound - this is where
+extra cores pay off. Work is shared out one workbook (--by workbook, the
+default) or one run (--by run) per task.
+
+The source workbooks are never modified. The new results go to a separate
+output workbook ('reprocessed_<date>_<time>.xlsx' in the directory, or
+--out), with:
+* a Summary sheet - one row per nominal output voltage of each run (or
+  the error, if a run couldn't be analysed),
+* a Results sheet - each run's full results block, as it would have been
+  written to its own workbook's Results sheet.
+Parameters come from each workbook's own Parameters sheet, or all from
+the --params workbook (e.g. one holding the revised values).
+"""
+
+import os
+import sys
+import time
+import argparse
+import traceback
+import multiprocessing
+
+from openpyxl import Workbook, load_workbook
+
+import analysis
+import params
+import xlstream
+
+VERSION = "0.2"  # As IVY_main.VERSION (which can't be imported without wx)
+RESULTS_BASE = 2  # Results-sheet row each run's block is written from
+SUMMARY_HEADINGS = ['Workbook', 'Start row', 'Stop row', 'DUC gain',
+                    'Nom. Vout', 'I+', 'u(I+)', 'dof(I+)', 'I-', 'u(I-)',
+                    'dof(I-)', 'k', 'Exp. U', 'Error']
+
+
+def FindRuns(path):
+    # First data rows of all run blocks on the Data sheet of workbook path
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        if 'Data' not in wb.sheetnames:
+            return []
+        ws = wb.get_sheet_by_name('Data')
+        return [row[0].row + 2 for row in ws.iter_rows(min_col=1, max_col=1)
+                if row[0].value == 'Run ID:']
+    finally:
+        if hasattr(wb, 'close'):
+            wb.close()
+
+
+def FindWorkbooks(directory, recursive=False):
+    # IVY workbooks (.xlsx files, except Excel's lock files) in directory
+    paths = []
+    for (d, subdirs, files) in os.walk(directory):
+        paths.extend(os.path.join(d, f) for f in sorted(files)
+                     if f.endswith('.xlsx') and not f.startswith('~$'))
+        if not recursive:
+            break
+    return paths
+
+
+def AnalyseRuns(task):
+    '''
+    Pool worker: re-analyse runs start_rows of workbook path, using
+    ParamStore store (None: the workbook's own parameters).
+    Returns [(path, start_row, summary, results block, error),...], where
+    summary has plain numbers in place of GTC ureals and the results block
+    is [(row offset, {col: value}),...].
+    '''
+    path, start_rows, store = task
+    try:
+        book = xlstream.StreamBook(path)
+    except Exception:  # Not a readable workbook - all its runs fail
+        error = traceback.format_exc()
+        return [(path, start_row, None, [], error) for start_row in start_rows]
+    done = []
+    try:
+        if store is None:
+            store = params.Parse(book.get_sheet_by_name('Parameters'))
+        for start_row in start_rows:
+            book.Discard()  # (Never saved - the source stays as it was)
+            book.get_sheet_by_name('Results')['B1'].value = RESULTS_BASE
+            try:
+                summary = analysis.RunAnalysis(book, VERSION, store).AnalyzeRun(start_row)
+            except Exception:
+                done.append((path, start_row, None, [], traceback.format_exc()))
+                continue
+            for result in summary['results']:
+                for pol in ('I_pos', 'I_neg'):
+                    I = result[pol]
+                    result[pol] = (I.x, I.u, I.df)
+            edits = book.Edits('Results')
+            block = [(r - RESULTS_BASE, edits[r]) for r in sorted(edits)
+                     if r >= RESULTS_BASE]
+            done.append((path, start_row, summary, block, None))
+    except Exception:  # E.g. no Parameters or Results sheet - the rest fail
+        error = traceback.format_exc()
+        done.extend((path, start_row, None, [], error)
+                    for start_row in start_rows[len(done):])
+    finally:
+        book.CloseReadOnly()
+    return done
+
+
+def Tasks(paths, store, by):
+    tasks = []
+    for path in paths:
+        try:
+            runs = FindRuns(path)
+        except Exception as err:  # Not a workbook we can read
+            print 'reprocess.Tasks(): skipping %s (%s)' % (path, err)
+            continue
+        if len(runs) == 0:
+            continue
+        if by == 'run':
+            tasks.extend((path, [r], store) for r in runs)
+        else:
+            tasks.append((path, runs, store))
+    return tasks
+
+
+def WriteRun(ws_sum, ws_res, run):
+    path, start_row, summary, block, error = run
+    if error is not None:
+        ws_sum.append([path, start_row] + ['']*(len(SUMMARY_HEADINGS) - 3) +
+                      [error.strip().splitlines()[-1]])
+        return
+    for result in summary['results']:
+        ws_sum.append([path, start_row, summary['stop_row'],
+                       summary['DUC_gain'], result['Vout']] +
+                      list(result['I_pos']) + list(result['I_neg']) +
+                      [result['k'], result['EU'], ''])
+    ws_res.append(['Workbook:', path, 'Start row:', start_row])
+    next_offset = 0
+    for (offset, cells) in block:
+        while next_offset < offset:  # (Blank rows within the block)
+            ws_res.append([])
+            next_offset += 1
+        width = max(cells) if cells else 0
+        ws_res.append([cells.get(c) for c in range(1, width + 1)])
+        next_offset += 1
+    ws_res.append([])
+
+
+def Reprocess(paths, out, store=None, by='workbook', processes=None):
+    '''
+    Re-analyse every run in workbooks paths, writing the results to
+    workbook out. Returns (number of runs, number that failed).
+    '''
+    tasks = Tasks(paths, store, by)
+    print 'reprocess: %d task(s) from %d workbook(s)' % (len(tasks), len(paths))
+    wb_out = Workbook(write_only=True)  # Streamed to disk on save
+    ws_sum = wb_out.create_sheet('Summary')
+    ws_res = wb_out.create_sheet('Results')
+    ws_sum.append(SUMMARY_HEADINGS)
+    n_runs = n_failed = 0
+    t0 = time.time()
+    pool = multiprocessing.Pool(processes)
+    try:
+        for done in pool.imap(AnalyseRuns, tasks, 1):  # In task order
+            for run in done:
+                n_runs += 1
+                if run[4] is not None:
+                    n_failed += 1
+                    print 'reprocess: %s, start row %d FAILED:\n%s' % (run[0], run[1], run[4])
+                WriteRun(ws_sum, ws_res, run)
+    finally:
+        pool.close()
+        pool.join()
+    wb_out.save(out)
+    print 'reprocess: %d run(s) (%d failed) in %.0f s -> %s' % (n_runs, n_failed, time.time() - t0, out)
+    return n_runs, n_failed
+
+
+def ParseArgs(argv):
+    parser = argparse.ArgumentParser(description='Re-analyse archived IVY runs')
+    parser.add_argument('directory', help='directory of IVY workbooks')
+    parser.add_argument('--params', metavar='WORKBOOK',
+                        help='take all parameters from this workbook')
+    parser.add_argument('--by', choices=('workbook', 'run'), default='workbook',
+                        help='one task per workbook or per run')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='pool size (default: one per core)')
+    parser.add_argument('--recursive', action='store_true',
+                        help='include sub-directories')
+    parser.add_argument('--out', help='output workbook')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = ParseArgs(argv)
+    out = args.out or os.path.join(args.directory, time.strftime('reprocessed_%Y%m%d_%H%M%S.xlsx'))
+    store = None
+    if args.params is not None:
+        store = params.Load(xlstream.StreamBook(args.params), args.params)
+    paths = [p for p in FindWorkbooks(args.directory, args.recursive)
+             if os.path.abspath(p) != os.path.abspath(out)]
+    n_runs, n_failed = Reprocess(paths, out, store, args.by, args.processes)
+    return 1 if n_failed > 0 else 0
+
+
+if __name__ == '__main__':  # (Required for multiprocessing on Windows)
+    sys.exit(main())
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+runcontrol.py
+
+Abort, pause and resume for acquisition runs.
+A RunControl object is shared between the GUI (which calls Abort(),
+Pause() and Resume()) and AqnThread, which makes every wait through
+Wait() and checks Check() between steps. Waits are made in short slices
+(POLL), so an abort or pause takes effect within a fraction of a second.
+
+When a pause is noticed, the on_pause callback (e.g. put the source in
+standby) is called and the thread blocks until resumed or aborted.
+On resume:
+* if the thread is in the middle of measuring a row (restartable is
+  True) RowRestart is raised, so the row starts again - test voltage
+  re-applied and settling timed afresh,
+* otherwise the thread just carries on.
+An abort raises RunAborted.
+"""
+
+import time
+from threading import Event
+
+import timeline
+
+POLL = 0.2  # Longest time between checks for abort / pause (s)
+
+
+class RunAborted(Exception):
+    pass
+
+
+class RowRestart(Exception):
+    pass
+
+
+class RunControl(object):
+    def __init__(self, on_pause=None, log=None):
+        self.on_pause = on_pause
+        self.log = log
+        self._abort = Event()
+        self._pause = Event()
+        self._resume = Event()
+        self.restartable = False  # True while measuring a row
+
+    def Abort(self):
+        self._abort.set()
+        self._resume.set()  # Release a paused thread
+
+    def Pause(self):
+        self._resume.clear()
+        self._pause.set()
+
+    def Resume(self):
+        self._pause.clear()
+        self._resume.set()
+
+    @property
+    def aborted(self):
+        return self._abort.is_set()
+
+    @property
+    def paused(self):
+        return self._pause.is_set()
+
+    def Stopping(self):
+        # True if the thread should stop what it's doing (abort or pause)
+        return self._abort.is_set() or self._pause.is_set()
+
+    def Check(self):
+        """
+        Raise RunAborted if an abort has been requested. If a pause has
+        been requested, block until resumed (then raise RowRestart if
+        restartable) or aborted.
+        """
+        if self._abort.is_set():
+            raise RunAborted()
+        if not self._pause.is_set():
+            return
+        print'runcontrol.RunControl: Run paused'
+        if self.log is not None:
+            print >>self.log, 'runcontrol.RunControl: Run paused'
+        if self.on_pause is not None:
+            self.on_pause()
+        t0 = time.time()
+        with timeline.Span('paused', 'pause'):
+            while not self._resume.wait(POLL):
+                pass
+        if self._abort.is_set():
+            raise RunAborted()
+        print'runcontrol.RunControl: Run resumed after %.0f s' % (time.time() - t0)
+        if self.log is not None:
+            print >>self.log, 'runcontrol.RunControl: Run resumed after %.0f s' % (time.time() - t0)
+        if self.restartable:
+            raise RowRestart()
+
+    def Wait(self, t, name='sleep'):
+        # Sleep for t seconds, checking for abort / pause every POLL s
+        self.Check()
+        t_end = time.time() + t
+        with timeline.Span(name, 'sleep', requested=t):
+            while True:
+                remaining = t_end - time.time()
+                if remaining <= 0:
+                    break
+                time.sleep(min(remaining, POLL))
+                self.Check()
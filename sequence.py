@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+sequence.py
+
+Measurement sequence planner.
+A run progresses through three blocks with nominal output voltage of 0.1,
+1 or 10 V. In each block, both input nodes (V1 and V2) are measured with
+the output voltage masked to 0 V, each polarity, then 0 V again. Each
+block fills 8 consecutive Data-sheet rows:
+    row = block start + 4*(node index) + (mask index)
+- i.e. 4 V1 rows then 4 V2 rows - which is the layout analysis.RunAnalysis
+expects.
+
+Plan() turns this into a list of Blocks, each holding a list of Steps. A
+Step is one application of a test voltage, under which one or more rows
+are measured. The order of the steps within a block depends on ORDER:
+* 'node-major' - select V1 and step through the mask, then do the same
+  for V2 (8 steps of 1 row). Every test voltage is applied (and settled)
+  twice.
+* 'interleaved' - step through the mask once, measuring V1 then V2 under
+  each test voltage (4 steps of 2 rows). Each test voltage is applied
+  (and settled) once; only the IV-box node relay changes between rows.
+Both orders produce the same row layout.
+"""
+
+from collections import namedtuple
+
+TEST_V_OUT = [0.1, 1, 10]  # O/P test voltage selection
+NODES = ['V1', 'V2']  # Input node selection
+TEST_V_MASK = [0, -1, 1, 0]  # Polarity / zero selection
+I_MIN = 1e-11  # 10 pA (S/N issues, noise limit)
+I_MAX = 0.01  # 10 mA (Opamp overheating limit)
+V1_MIN = 0.01  # 10 mV (S/N issues, noise limit)
+V1_MAX = 10  # 10 V (Opamp output limit)
+ORDERS = ('node-major', 'interleaved')
+ORDER = 'interleaved'
+
+'''
+Block: one output-voltage block. skip is None, or the reason the block is
+out of scope (its steps are then still listed, for progress accounting).
+Step: one test-voltage application; rows = [(node, Data-sheet row),...].
+'''
+Block = namedtuple('Block', 'abs_V3 V1_nom I_nom skip steps')
+Step = namedtuple('Step', 'abs_V3 i_mask V3_mask rows')
+
+
+def CheckScope(abs_V3, Rs, DUC_G):
+    """
+    Nominal input voltage and current are calculated from the nominal DUC
+    gain and Rs. Returns (V1_nom, I_nom, reason), where reason is None if
+    the block is in scope, otherwise a warning message.
+    """
+    V1_nom = Rs*abs_V3/DUC_G
+    I_nom = V1_nom/Rs
+    reason = None
+    if abs(I_nom) <= I_MIN or abs(I_nom) >= I_MAX:
+        reason = 'Nominal I/P test-I outside scope! (%.1g A)' % I_nom
+    elif abs(V1_nom) < V1_MIN or abs(V1_nom) > V1_MAX:
+        reason = 'Nom. I/P test-V outside scope! (%.1g V)' % V1_nom
+    return V1_nom, I_nom, reason
+
+
+def Plan(start_row, Rs, DUC_G, order=ORDER):
+    """
+    Return the list of Blocks for a run starting at Data-sheet row
+    start_row. Skipped blocks don't use any rows.
+    """
+    assert order in ORDERS, 'Unknown sequence order "%s"' % order
+    blocks = []
+    block_start = start_row
+    for abs_V3 in TEST_V_OUT:
+        V1_nom, I_nom, reason = CheckScope(abs_V3, Rs, DUC_G)
+        steps = []
+        if order == 'node-major':
+            for i_node, node in enumerate(NODES):
+                for i_mask, V3_mask in enumerate(TEST_V_MASK):
+                    row = block_start + len(TEST_V_MASK)*i_node + i_mask
+                    steps.append(Step(abs_V3, i_mask, V3_mask, [(node, row)]))
+        else:  # 'interleaved'
+            for i_mask, V3_mask in enumerate(TEST_V_MASK):
+                rows = [(node, block_start + len(TEST_V_MASK)*i_node + i_mask)
+                        for i_node, node in enumerate(NODES)]
+                steps.append(Step(abs_V3, i_mask, V3_mask, rows))
+        blocks.append(Block(abs_V3, V1_nom, I_nom, reason, steps))
+        if reason is None:
+            block_start += len(NODES)*len(TEST_V_MASK)
+    return blocks
+
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+settle.py
+
+Adaptive settle detection.
+A SettleDetector watches a running stream of timestamped DVM readings and
+decides when the signal has settled, i.e. when a straight-line fit to the
+most recent WINDOW readings shows both:
+* a small drift (fitted slope * window duration) and
+* a small scatter (stdev of residuals about the fitted line).
+Both limits are of the form rel_tol*|V_nom| + abs_tol, so that zero-volt
+rows and low-level inputs still have a sensible, finite target.
+"""
+
+import numpy as np
+
+WINDOW = 10  # Number of most recent readings used for each fit
+DRIFT_REL = 1e-5  # Max. drift over window, relative to |V_nom|
+DRIFT_ABS = 2e-6  # Max. drift over window (V)
+NOISE_REL = 1e-5  # Max. residual stdev, relative to |V_nom|
+NOISE_ABS = 2e-6  # Max. residual stdev (V)
+
+
+class SettleDetector(object):
+    """
+    Decides whether a stream of readings (nominally V_nom) has settled.
+    Feed readings in with Add(t, V) then test with IsSettled().
+    """
+    def __init__(self, V_nom, window=WINDOW):
+        self.V_nom = V_nom
+        self.window = window
+        self.drift_lim = DRIFT_REL*abs(V_nom) + DRIFT_ABS
+        self.noise_lim = NOISE_REL*abs(V_nom) + NOISE_ABS
+        self.t = []
+        self.V = []
+        self.drift = None
+        self.noise = None
+
+    def Reset(self):
+        del self.t[:]
+        del self.V[:]
+        self.drift = None
+        self.noise = None
+
+    def Add(self, t, V):
+        self.t.append(t)
+        self.V.append(V)
+        if len(self.V) > self.window:  # Only keep what we need
+            del self.t[0]
+            del self.V[0]
+
+    def IsSettled(self):
+        """
+        Fit a line to the last window readings and compare drift and
+        scatter with their limits. Returns False until window readings
+        are available.
+        """
+        if len(self.V) < self.window:
+            return False
+        t = np.array(self.t) - self.t[0]
+        V = np.array(self.V)
+        slope, intercept = np.polyfit(t, V, 1)
+        resid = V - (slope*t + intercept)
+        self.drift = abs(slope*t[-1])
+        self.noise = np.std(resid, ddof=2)
+        return self.drift < self.drift_lim and self.noise < self.noise_lim
+
+    def Summary(self):
+        if self.drift is None:
+            return 'no fit yet'
+        return 'drift = {0:.3g} V (lim {1:.3g}), noise = {2:.3g} V (lim {3:.3g})'.format(self.drift, self.drift_lim, self.noise, self.noise_lim)
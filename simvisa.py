@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+simvisa.py
+
+Simulated VISA backend.
+SimResourceManager is a stand-in for visa.ResourceManager(). Its
+instruments answer the commands IVY sends to the Fluke F5520A
+calibrator, HP3458A and HP34401A DVMs and the IV-box, with realistic
+timing:
+* every write/query costs a per-model LATENCY (GPIB/serial overhead),
+* every DVM reading costs its integration time (NPLC power-line cycles,
+  doubled with auto-zero on) and
+* readings settle exponentially (time constant TAU) after the source
+  voltage, node or Rs changes, with NOISE_REL/NOISE_ABS Gaussian noise.
+
+All instruments share one Bench, which models the test circuit:
+V1 (source output), V2 (DUC input, ~virtual earth) and
+V3 = -(V1/Rs)*DUC_GAIN (DUC output). The IV-box selects the node seen by
+DVM12 and the Rs (1k-1G) in circuit. DVMT sees a Pt-100 at ~20 degC.
+
+An instrument's model and role are found from its description in
+devices.INSTR_DATA (matched by VISA address) when it's opened.
+
+Select this backend by setting the environment variable
+IVY_VISA_BACKEND=sim before starting IVY (see devices.py).
+GMH probes don't use VISA, so aren't simulated.
+"""
+
+import re
+import math
+import time
+from threading import Lock
+import numpy as np
+from pyvisa import constants
+import visa
+
+import devices
+import replies
+
+LATENCY = {'F5520A': 0.02, '3458A': 0.005, '34401A': 0.01,
+           'IVbox': 0.05, 'none': 0.01}  # Per-command overhead (s)
+LINE_FREQ = 50  # Power-line frequency (Hz) - sets integration time
+NPLC_DEFAULT = 10  # Integration time (power-line cycles) until set
+NOISE_REL = 1e-6  # Reading noise: relative part...
+NOISE_ABS = 1e-7  # ...and absolute part (V or Ohm)
+TAU = 2.0  # Settling time-constant after a change (s)
+DUC_GAIN = 1e6  # Simulated DUC transimpedance gain (V/A)
+V2_OFFSET = 2e-6  # DUC input offset (V)
+PT100_R = 107.79  # Simulated Pt-100 resistance (Ohm)
+RANGES = (0.1, 1, 10, 100, 1000)  # DCV ranges
+RS_CONFIGS = {'3': 1e3, '4': 1e4, '5': 1e5, '6': 1e6,
+              '7': 1e7, '8': 1e8, '9': 1e9}  # IV-box cmd -> Rs
+
+_NUM_RE = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+
+
+class Bench(object):
+    """
+    The simulated test circuit - shared by all simulated instruments.
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self.V_src = 0.0  # Programmed source voltage
+        self.oper = False  # Source output enabled?
+        self.node = 'V1'  # Node selected for DVM12
+        self.Rs = 1e6
+        self.V1_from = 0.0  # V1 at last change...
+        self.t_change = time.time()  # ...and time of last change
+
+    def V1Target(self):
+        if self.oper:
+            return self.V_src
+        return 0.0
+
+    def V1(self, t):
+        # Source output, settling exponentially to its target
+        a = math.exp(-max(t - self.t_change, 0.0)/TAU)
+        return self.V1Target() + (self.V1_from - self.V1Target())*a
+
+    def Change(self, **kw):
+        # Change circuit state (V_src, oper, node or Rs) at time now
+        with self._lock:
+            t = time.time()
+            self.V1_from = self.V1(t)
+            self.t_change = t
+            for k in kw:
+                setattr(self, k, kw[k])
+
+    def Value(self, role, t):
+        # Noise-free value seen by the DVM in role, at time t
+        with self._lock:
+            V1 = self.V1(t)
+            a = math.exp(-max(t - self.t_change, 0.0)/TAU)
+            if role == 'DVM12':
+                if self.node == 'V1':
+                    return V1
+                return V2_OFFSET + V1*a*1e-3  # Glitch decays after a switch
+            elif role == 'DVM3':
+                return -V1*DUC_GAIN/self.Rs
+            elif role == 'DVMT':
+                return PT100_R
+            return 0.0
+
+
+BENCH = Bench()
+
+
+class SimInstrument(object):
+    """
+    Simulated message-based VISA resource (the parts of
+    pyvisa.resources.MessageBasedResource that IVY uses).
+    """
+    _next_session = 1
+
+    def __init__(self, resource_name, descr, role):
+        self.resource_name = resource_name
+        self.descr = descr
+        self.role = role
+        self.model = 'none'
+        for m in ('F5520A', '3458A', '34401A'):
+            if m in descr:
+                self.model = m
+        if role == 'IVbox':
+            self.model = 'IVbox'
+        self.session = SimInstrument._next_session
+        SimInstrument._next_session += 1
+        self.timeout = 2000  # ms
+        self.read_termination = '\n'
+        self.write_termination = '\n'
+        self.latency = LATENCY[self.model]
+
+        self.nplc = NPLC_DEFAULT
+        self.azero = True
+        self.range = 10.0
+        self.autorange = True
+        self.ohms = role == 'DVMT'
+        self.out_buf = []  # Pending ASCII replies
+        self.bin_buf = ''  # Pending binary reply
+        self.nrdgs = 1
+        self.tarm = 'AUTO'
+        self.mem = 'OFF'
+        self.fmt = 'ASCII'
+        self.burst_t0 = None
+        self.err = []
+
+    def close(self):
+        self.session = None
+
+    def clear(self):
+        self.out_buf = []
+        self.bin_buf = ''
+
+    def IntegrationTime(self):
+        t = float(self.nplc)/LINE_FREQ
+        if self.azero:
+            t *= 2
+        return t
+
+    def Reading(self, t):
+        # One noisy reading, taken at time t
+        V = BENCH.Value(self.role, t)
+        if self.autorange and not self.ohms:
+            self.range = [r for r in RANGES if abs(V) <= 1.2*r or r == RANGES[-1]][0]
+        return np.random.normal(V, NOISE_REL*abs(V) + NOISE_ABS)
+
+    def write(self, s):
+        time.sleep(self.latency)
+        for cmd in s.split(';'):
+            self.Do(cmd.strip())
+        return len(s), constants.StatusCode.success
+
+    def read(self):
+        time.sleep(self.latency)
+        if len(self.out_buf) > 0:
+            return self.out_buf.pop(0) + self.read_termination
+        if self.model in ('3458A', '34401A') and self.tarm != 'HOLD':
+            return self.Measure() + self.read_termination
+        raise visa.VisaIOError(constants.VI_ERROR_TMO)
+
+    def query(self, s):
+        self.write(s)
+        return self.read()
+
+    def read_bytes(self, count):
+        time.sleep(self.latency + count*1e-6)  # ~1 MB/s transfer
+        raw = self.bin_buf[:count]
+        self.bin_buf = self.bin_buf[count:]
+        return raw
+
+    def assert_trigger(self):
+        time.sleep(self.latency)
+        if self.model == '3458A':
+            self.burst_t0 = time.time()
+
+    def Measure(self):
+        # A triggered ASCII reading: wait for the integration time
+        t_int = self.IntegrationTime()
+        time.sleep(t_int)
+        return '{0: .8E}'.format(self.Reading(time.time() - t_int/2))
+
+    def Do(self, cmd):
+        if cmd == '':
+            return
+        u = cmd.upper()
+        if self.model == 'IVbox':
+            if u in ('1', '2'):
+                BENCH.Change(node='V' + u)
+            elif u in RS_CONFIGS:
+                BENCH.Change(Rs=RS_CONFIGS[u])
+        elif self.model == 'F5520A':
+            self.DoSource(u)
+        else:
+            self.DoDVM(u)
+
+    def DoSource(self, u):
+        if u.startswith('OUT'):
+            V = _NUM_RE.search(u[3:])
+            if V is not None:
+                BENCH.Change(V_src=float(V.group()))
+        elif u.startswith('OPER'):
+            BENCH.Change(oper=True)
+        elif u.startswith('STBY'):
+            BENCH.Change(oper=False)
+        elif u.startswith('ERR?'):
+            if len(self.err) > 0:
+                self.out_buf.append(self.err.pop(0))
+            else:
+                self.out_buf.append('0,"No Error"')
+        elif u.startswith('*CLS'):
+            self.err = []
+        elif u.startswith('*IDN?'):
+            self.out_buf.append('FLUKE,5520A,SIM,1.0')
+
+    def DoDVM(self, u):
+        words = u.replace(',', ' ').split()
+        head = words[0]
+        args = words[1:]
+        if head in ('DCV', 'CONF:VOLT:DC', 'VOLT:DC:RANG'):
+            self.ohms = False
+            if len(args) > 0 and args[0] not in ('AUTO', 'DEF'):
+                self.autorange = False
+                self.range = [r for r in RANGES if float(args[0]) <= r or r == RANGES[-1]][0]
+            else:
+                self.autorange = True
+        elif head == 'ARANGE' and len(args) > 0:
+            self.autorange = args[0] in ('ON', '1')
+        elif head == 'VOLT:DC:RANG:AUTO':
+            self.ohms = False
+            self.autorange = len(args) == 0 or args[0] in ('ON', '1')
+        elif head in ('OHMF', 'OHM', 'FUNC') and 'OHM' in u:
+            self.ohms = True
+        elif head in ('NPLC', 'VOLT:DC:NPLC') and len(args) > 0:
+            self.nplc = float(args[0])
+        elif head in ('AZERO', 'ZERO:AUTO') and len(args) > 0:
+            self.azero = args[0] in ('ON', '1')
+        elif head in ('RANGE?', 'VOLT:DC:RANG?'):
+            self.out_buf.append('{0: .8E}'.format(self.range))
+        elif head == 'NPLC?':
+            self.out_buf.append('{0: .8E}'.format(self.nplc))
+        elif head == 'AZERO?':
+            self.out_buf.append('1' if self.azero else '0')
+        elif head == 'LINE?':
+            self.out_buf.append('{0: .8E}'.format(LINE_FREQ))
+        elif head == 'ISCALE?':
+            self.out_buf.append('{0: .8E}'.format(self.range/1.2e8))
+        elif head == 'TARM' and len(args) > 0:
+            self.tarm = args[0]
+            if args[0] == 'SGL':
+                self.assert_trigger()
+        elif head == 'MEM' and len(args) > 0:
+            self.mem = args[0]
+        elif head in ('OFORMAT', 'MFORMAT') and len(args) > 0:
+            self.fmt = args[0]
+        elif head == 'NRDGS' and len(args) > 0:
+            self.nrdgs = int(args[0])
+        elif head == 'MCOUNT?':
+            self.out_buf.append(str(self.BurstCount()))
+        elif head == 'RMEM':
+            self.ReadMemory(int(args[0]), int(args[1]))
+        elif head in ('ID?', '*IDN?'):
+            self.out_buf.append('HP' + self.model)
+        elif head == 'READ?':
+            self.out_buf.append(self.Measure())
+
+    def BurstCount(self):
+        # Number of burst readings completed so far
+        if self.burst_t0 is None:
+            return 0
+        n = int((time.time() - self.burst_t0)/self.IntegrationTime())
+        return min(n, self.nrdgs)
+
+    def ReadMemory(self, first, count):
+        # Put readings first..first+count-1 of the burst in bin_buf
+        t_int = self.IntegrationTime()
+        t = self.burst_t0 + t_int*(np.arange(first - 1, first - 1 + count) + 0.5)
+        vals = np.array([self.Reading(ti) for ti in t])
+        dtype, needs_scale = replies.BINARY_FORMATS[self.fmt]
+        if needs_scale:
+            vals = np.round(vals/(self.range/1.2e8))
+        self.bin_buf = vals.astype(dtype).tostring()
+
+
+class SimResourceManager(object):
+    """
+    Stand-in for visa.ResourceManager().
+    """
+    def list_resources(self):
+        addrs = [devices.INSTR_DATA[d]['str_addr'] for d in devices.INSTR_DATA
+                 if 'str_addr' in devices.INSTR_DATA[d]]
+        return tuple(sorted(set(a for a in addrs if a)))
+
+    def open_resource(self, resource_name):
+        descr = 'none'
+        role = None
+        for d in devices.INSTR_DATA:
+            if devices.INSTR_DATA[d].get('str_addr') == resource_name:
+                descr = d
+                role = devices.INSTR_DATA[d].get('role')
+                if 'GMH' not in d:
+                    break
+        if 'GMH' in descr:  # Not a VISA instrument
+            raise visa.VisaIOError(constants.VI_ERROR_RSRC_NFOUND)
+        print 'simvisa.SimResourceManager: opened', resource_name, 'as', descr
+        return SimInstrument(resource_name, descr, role)
+
+    def close(self):
+        pass
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+test_xlstream.py
+
+Tests of xlstream.StreamBook on a copy of IVY_template.xlsx: each edited
+workbook is re-loaded with openpyxl and compared with what was written.
+Run from the IVY directory with:
+    python -m unittest discover tests
+"""
+
+import os
+import re
+import sys
+import shutil
+import zipfile
+import tempfile
+import unittest
+import datetime as dt
+
+from openpyxl import load_workbook
+from openpyxl.styles import Font, Border, Side
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import xlstream
+import sequence
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'IVY_template.xlsx')
+START_ROW = 105  # Data-sheet start_row in the template
+
+
+class StreamBookTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'IVY_test.xlsx')
+        shutil.copy(TEMPLATE, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def Reload(self):
+        return load_workbook(self.path)
+
+    def RowNumbers(self, sheet):
+        # Row numbers of sheet, in the order they appear in the file
+        with zipfile.ZipFile(self.path) as zf:
+            xml = zf.read(xlstream.SheetParts(zf)[sheet])
+        return [int(r) for r in re.findall(r'<row\b[^>]*?\br="(\d+)"', xml)]
+
+    def testReadOnDemand(self):
+        book = xlstream.StreamBook(self.path)
+        ws = book.get_sheet_by_name('Data')
+        self.assertEqual(ws['B1'].value, 105)
+        self.assertEqual(ws['S105'].value, 'SRC')
+        self.assertEqual(ws['D100'].value, 'V2')
+        self.assertIsNone(ws['A102'].value)
+        self.assertRaises(KeyError, book.get_sheet_by_name, 'NoSuchSheet')
+        book.CloseReadOnly()
+
+    def testValues(self):
+        when = dt.datetime(2017, 12, 8, 8, 12, 10)
+        book = xlstream.StreamBook(self.path)
+        ws = book.get_sheet_by_name('Data')
+        ws['B1'] = 130  # Existing cell, in an existing row
+        ws['A130'] = u'Résumé <&> "quoted"'
+        ws['B130'] = 1000000
+        ws['H130'] = -0.266312895085
+        ws['E130'] = when
+        ws['F130'] = True
+        ws['D101'] = 'V1'  # Edit amongst the template's data
+        ws['A100'] = None  # Clear a cell
+        book.save()
+
+        wb = self.Reload()
+        data = wb['Data']
+        self.assertEqual(data['B1'].value, 130)
+        self.assertEqual(data['A130'].value, u'Résumé <&> "quoted"')
+        self.assertEqual(data['B130'].value, 1000000)
+        self.assertAlmostEqual(data['H130'].value, -0.266312895085, places=15)
+        serial = (when - xlstream.EXCEL_EPOCH).total_seconds()/86400.0
+        self.assertAlmostEqual(data['E130'].value, serial, places=9)
+        self.assertIs(data['F130'].value, True)
+        self.assertEqual(data['D101'].value, 'V1')
+        self.assertIsNone(data['A100'].value)
+        # Untouched cells and sheets are kept
+        self.assertEqual(data['B100'].value, 1000000)
+        self.assertEqual(data['T111'].value, 'DVM: HP3458A, s/n518')
+        template = load_workbook(TEMPLATE)
+        for name in ('Parameters', 'Results', 'Comments'):
+            for row, t_row in zip(wb[name].iter_rows(), template[name].iter_rows()):
+                self.assertEqual([c.value for c in row], [c.value for c in t_row])
+
+    def testFontsAndBorders(self):
+        thin_tl = Border(top=Side(style='thin'), left=Side(style='thin'))
+        book = xlstream.StreamBook(self.path)
+        ws = book.get_sheet_by_name('Data')
+        ws['A130'] = 'Run ID:'
+        ws['A130'].font = Font(b=True)
+        ws['S130'] = 'SRC'
+        ws['S130'].border = thin_tl
+        ws['T105'].border = thin_tl  # Style only - keeps the value
+        book.save()
+
+        data = self.Reload()['Data']
+        self.assertTrue(data['A130'].font.b)
+        self.assertEqual(data['S130'].border.top.style, 'thin')
+        self.assertEqual(data['S130'].border.left.style, 'thin')
+        self.assertIsNone(data['S130'].border.right.style)
+        self.assertEqual(data['T105'].value, 'SRC: F5520A')
+        self.assertEqual(data['T105'].border.top.style, 'thin')
+        self.assertFalse(data['B130'].font.b)
+
+        # The same style again re-uses the cellXfs entry added above
+        book.get_sheet_by_name('Data')['A131'].font = Font(b=True)
+        with zipfile.ZipFile(self.path) as zf:
+            n_xf = zf.read(xlstream.STYLES_PART).count('<xf ')
+        book.save()
+        with zipfile.ZipFile(self.path) as zf:
+            self.assertEqual(zf.read(xlstream.STYLES_PART).count('<xf '), n_xf)
+        self.assertTrue(self.Reload()['Data']['A131'].font.b)
+
+    def testInterleavedRows(self):
+        # Rows written in the interleaved planner's (non-ascending) order
+        order = []
+        for block in sequence.Plan(START_ROW, 1e5, 1e6, order='interleaved'):
+            for step in block.steps:
+                order += [row for (node, row) in step.rows]
+        self.assertNotEqual(order, sorted(order))
+        book = xlstream.StreamBook(self.path)
+        ws = book.get_sheet_by_name('Data')
+        for row in order:
+            ws['A%d' % row] = 'row %d' % row
+            ws['H%d' % row] = row/10.0
+            book.save()  # A save per row, as during a run
+
+        data = self.Reload()['Data']
+        for row in order:
+            self.assertEqual(data['A%d' % row].value, 'row %d' % row)
+            self.assertEqual(data['H%d' % row].value, row/10.0)
+        self.assertEqual(data['S108'].value, 'DVMT')  # Merged, not replaced
+        rows = self.RowNumbers('Data')
+        self.assertEqual(rows, sorted(set(rows)))  # Ascending, no duplicates
+        self.assertTrue(set(order) <= set(rows))
+
+    def testSmallChunks(self):
+        # Rows and edits split across read boundaries splice the same way
+        chunk = xlstream.CHUNK
+        book = xlstream.StreamBook(self.path)
+        ws = book.get_sheet_by_name('Data')
+        for row in (110, 3, 140, 50, 105):
+            ws['C%d' % row] = row
+        try:
+            xlstream.CHUNK = 97
+            book.save()
+        finally:
+            xlstream.CHUNK = chunk
+        data = self.Reload()['Data']
+        for row in (110, 3, 140, 50, 105):
+            self.assertEqual(data['C%d' % row].value, row)
+        self.assertEqual(data['S110'].value, 'DVM3')
+        self.assertEqual(data['E100'].value, '08/12/2017 08:12:10')
+
+    def testSaveAs(self):
+        book = xlstream.StreamBook(self.path)
+        book.get_sheet_by_name('Results')['A600'] = 'saved as'
+        new = os.path.join(self.dir, 'IVY_copy.xlsx')
+        book.save(new)
+        self.assertEqual(load_workbook(new)['Results']['A600'].value, 'saved as')
+        self.assertIsNone(self.Reload()['Results']['A600'].value)
+        self.assertEqual(book.get_sheet_by_name('Results')['A600'].value, 'saved as')
+
+    def testDiscard(self):
+        book = xlstream.StreamBook(self.path)
+        ws = book.get_sheet_by_name('Data')
+        ws['A130'] = 'not saved'
+        ws['A130'].font = Font(b=True)
+        book.Discard()
+        self.assertEqual(book.Edits('Data'), {})
+        book.save()
+        self.assertIsNone(self.Reload()['Data']['A130'].value)
+
+
+if __name__ == '__main__':
+    unittest.main()
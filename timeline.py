@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+timeline.py
+
+Opt-in run timeline tracer.
+When the environment variable IVY_TRACE is set (to anything but '' or
+'0'), timed spans are recorded around:
+* every devices.instrument and devices.GMH_Sensor method call,
+* every sleep in the acquisition thread,
+* AqnThread methods such as WriteDataThisRow() and PlotThisRow() and
+* workbook saves (xlwriter).
+Each span is tagged with the thread it ran on and the Data-sheet row being
+measured at the time (see SetRow()).
+
+At the end of each run, Export() writes the spans as a Chrome trace-event
+JSON file (view in chrome://tracing or https://ui.perfetto.dev) and a
+per-row summary table of time spent in each category of span.
+
+When tracing is off, traced() returns functions unchanged and Sleep() is
+time.sleep(), so there's no overhead.
+"""
+
+import os
+import json
+import time
+import functools
+from threading import Lock, current_thread
+
+ENABLED = os.environ.get('IVY_TRACE', '') not in ('', '0')
+
+
+class Tracer(object):
+    def __init__(self):
+        self._lock = Lock()
+        self.Reset()
+
+    def Reset(self):
+        with self._lock:
+            self.events = []  # [(name, cat, t_start, t_end, tid, row, args),...]
+            self.row = None
+            self.row_tid = None  # Thread that sets the row (AqnThread)
+
+    def SetRow(self, row):
+        self.row = row
+        self.row_tid = current_thread().name
+
+    def Add(self, name, cat, t0, t1, args=None):
+        with self._lock:
+            self.events.append((name, cat, t0, t1, current_thread().name,
+                                self.row, args or {}))
+
+    def ChromeTrace(self):
+        # Spans as a Chrome trace-event ('X' complete events, times in us)
+        tids = {}
+        trace = []
+        with self._lock:
+            events = list(self.events)
+        for (name, cat, t0, t1, tid, row, args) in events:
+            tids.setdefault(tid, len(tids) + 1)
+            a = dict(args)
+            a['row'] = row
+            trace.append({'name': name, 'cat': cat, 'ph': 'X',
+                          'ts': t0*1e6, 'dur': (t1 - t0)*1e6,
+                          'pid': 1, 'tid': tids[tid], 'args': a})
+        for tid in tids:  # Label threads
+            trace.append({'name': 'thread_name', 'ph': 'M', 'pid': 1,
+                          'tid': tids[tid], 'args': {'name': tid}})
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+    def RowSummary(self):
+        """
+        Per-row breakdown of the acquisition thread's time.
+        Returns (categories, rows), where rows is a list of
+        (row, wall time, {category: exclusive time}) tuples. A span's
+        exclusive time excludes any spans nested within it, so the
+        category times of a row add up to (at most) its wall time.
+        """
+        with self._lock:
+            events = [e for e in self.events if e[4] == self.row_tid and
+                      e[5] is not None]
+        events.sort(key=lambda e: (e[2], -e[3]))
+        excl = {}  # {row: {cat: s}}
+        span = {}  # {row: [t_first, t_last]}
+        cats = []
+        stack = []  # Open spans: [[event, child time],...]
+        for e in events + [None]:
+            while len(stack) > 0 and (e is None or e[2] >= stack[-1][0][3]):
+                ev, child = stack.pop()
+                dur = ev[3] - ev[2]
+                r = excl.setdefault(ev[5], {})
+                r[ev[1]] = r.get(ev[1], 0.0) + dur - child
+                if len(stack) > 0:
+                    stack[-1][1] += dur
+            if e is None:
+                break
+            if e[1] not in cats:
+                cats.append(e[1])
+            s = span.setdefault(e[5], [e[2], e[3]])
+            s[0] = min(s[0], e[2])
+            s[1] = max(s[1], e[3])
+            stack.append([e, 0.0])
+        rows = [(row, span[row][1] - span[row][0], excl[row])
+                for row in sorted(span)]
+        return cats, rows
+
+    def SummaryTable(self):
+        cats, rows = self.RowSummary()
+        lines = ['\t'.join(['row', 'wall(s)'] + [c + '(s)' for c in cats])]
+        for (row, wall, t) in rows:
+            lines.append('\t'.join([str(row), '%.3f' % wall] +
+                                   ['%.3f' % t.get(c, 0.0) for c in cats]))
+        return '\n'.join(lines)
+
+
+TRACER = Tracer()
+
+
+class Span(object):
+    """
+    Context manager recording one timed span, e.g.:
+    with timeline.Span('wb.save', 'xl'):
+        wb.save(path)
+    """
+    def __init__(self, name, cat, **args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.t0 = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        if ENABLED:
+            TRACER.Add(self.name, self.cat, self.t0, time.time(), self.args)
+        return False
+
+
+def traced(cat):
+    """
+    Method decorator: record a span (category cat) for every call.
+    The span is named Class.method, with the object's Descr (if any) as
+    an argument.
+    """
+    def wrap(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            t0 = time.time()
+            try:
+                return fn(self, *args, **kwargs)
+            finally:
+                name = self.__class__.__name__ + '.' + fn.__name__
+                a = {'args': repr(args)[:80]}
+                if hasattr(self, 'Descr'):
+                    a['descr'] = self.Descr
+                TRACER.Add(name, cat, t0, time.time(), a)
+        return wrapper
+    return wrap
+
+
+def Sleep(t, name='sleep'):
+    # time.sleep(t), recorded as a span of category 'sleep'
+    if not ENABLED:
+        time.sleep(t)
+        return
+    t0 = time.time()
+    time.sleep(t)
+    TRACER.Add(name, 'sleep', t0, time.time(), {'requested': t})
+
+
+def SetRow(row):
+    # Attribute subsequent spans to Data-sheet row (None between rows)
+    if ENABLED:
+        TRACER.SetRow(row)
+
+
+def Export(xlfilename, log=None):
+    """
+    Write the spans recorded so far to '<workbook>_trace_<time>.json' and
+    the per-row summary to '<workbook>_trace_<time>.txt', then start a
+    fresh trace. Does nothing if tracing is off.
+    """
+    if not ENABLED or len(TRACER.events) == 0:
+        return
+    stem = '%s_trace_%s' % (os.path.splitext(xlfilename)[0],
+                            time.strftime('%Y%m%d_%H%M%S'))
+    with open(stem + '.json', 'w') as f:
+        json.dump(TRACER.ChromeTrace(), f)
+    table = TRACER.SummaryTable()
+    with open(stem + '.txt', 'w') as f:
+        f.write(table + '\n')
+    print 'timeline.Export(): trace written to', stem + '.json'
+    print table
+    if log is not None:
+        print >>log, 'timeline.Export(): trace written to', stem + '.json'
+        print >>log, table
+    TRACER.Reset()
@@ -0,0 +1,561 @@
+# -*- coding: utf-8 -*-
+"""
+xlstream.py
+
+Streaming access to large IVY workbooks.
+load_workbook() builds every cell of every sheet in memory, so with years
+of Data and Results rows, opening a workbook is slow and takes a lot of
+RAM. A StreamBook never does that:
+* Cells are read on demand, a block of BLOCK_ROWS rows at a time, from a
+  read-only (openpyxl read_only=True) view of the file - so Parameters
+  and the B1 row pointers are read without touching the rest of the
+  sheet's history.
+* Cell changes are held as pending edits. save() streams each edited
+  sheet's XML from the old file to the new one, splicing in the edited
+  and new rows, and copies every other part of the file unchanged. Only
+  the edited rows are ever parsed.
+So memory use depends on the size of the new data, not on the workbook's
+history.
+
+StreamBook provides the (small) part of the openpyxl workbook interface
+that IVY uses: get_sheet_by_name(), ws[ref].value (get and set),
+ws[ref] = value, ws[ref].font / .border (set), ws.rows and save(path).
+Edited cells keep their existing style unless a font or border is set:
+each new (font, border) combination is then added to styles.xml (a font,
+a border and a cellXfs entry) and the cell written with its index.
+
+Open() returns a StreamBook if STREAMING is True, otherwise a workbook
+loaded by openpyxl as before.
+"""
+
+import os
+import re
+import shutil
+import zipfile
+import tempfile
+import datetime as dt
+from numbers import Number
+from threading import RLock
+from xml.sax.saxutils import escape
+import xml.etree.ElementTree as ET
+
+from openpyxl import load_workbook
+from openpyxl.xml.functions import tostring
+
+STREAMING = True  # If False, Open() loads the whole workbook into memory
+BLOCK_ROWS = 64  # Rows read at a time
+CHUNK = 1 << 20  # Bytes read at a time when streaming a sheet
+COPY_IN_MEMORY = 1 << 22  # Larger unchanged parts are copied via a temp file
+
+NS_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+NS_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+NS_PKG_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+REF_RE = re.compile(r'^([A-Z]+)(\d+)$')
+ROW_RE = re.compile(r'<row\b[^>]*?(?:/>|>.*?</row>)', re.S)
+ROW_START_RE = re.compile(r'<row\b[^>]*?\br="(\d+)"')
+CELL_RE = re.compile(r'<c\b[^>]*?(?:/>|>.*?</c>)', re.S)
+CELL_REF_RE = re.compile(r'\br="([A-Z]+)\d+"')
+STYLE_RE = re.compile(r'\bs="(\d+)"')
+SPANS_RE = re.compile(r'\s+spans="[^"]*"')
+DIM_RE = re.compile(r'<dimension ref="([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?"\s*/>')
+SHEETDATA_RE = re.compile(r'<sheetData\s*(/?)>')
+EXCEL_EPOCH = dt.datetime(1899, 12, 30)
+STYLES_PART = 'xl/styles.xml'
+STYLE_ITEMS = {'fonts': 'font', 'borders': 'border', 'cellXfs': 'xf'}
+
+
+class XLStreamError(IOError):  # (So save failures are handled as IOErrors)
+    pass
+
+
+def ColIndex(letters):
+    # 'A' -> 1, 'AA' -> 27
+    n = 0
+    for ch in letters:
+        n = n*26 + ord(ch) - ord('A') + 1
+    return n
+
+
+def ColLetter(n):
+    # 1 -> 'A', 27 -> 'AA'
+    s = ''
+    while n > 0:
+        n, rem = divmod(n - 1, 26)
+        s = chr(ord('A') + rem) + s
+    return s
+
+
+def SplitRef(ref):
+    # 'B12' -> (12, 2)
+    m = REF_RE.match(ref.upper())
+    if m is None:
+        raise XLStreamError('Bad cell reference: %s' % ref)
+    return int(m.group(2)), ColIndex(m.group(1))
+
+
+def CellXML(row, col, value, style=None):
+    '''
+    The <c> element for value at (row, col) ('' for None, unless there's a
+    style to keep). Strings are written inline, so sharedStrings is never
+    touched. Dates are written as Excel serial numbers, in the cell's
+    existing number format (IVY writes its dates as strings).
+    '''
+    ref = ColLetter(col) + str(row)
+    s = '' if style is None else ' s="%s"' % style
+    if value is None:
+        return '' if style is None else '<c r="%s"%s/>' % (ref, s)
+    if isinstance(value, bool):
+        return '<c r="%s"%s t="b"><v>%d</v></c>' % (ref, s, value)
+    if isinstance(value, (dt.datetime, dt.date)):
+        if not isinstance(value, dt.datetime):
+            value = dt.datetime(value.year, value.month, value.day)
+        value = (value - EXCEL_EPOCH).total_seconds()/86400.0
+    if isinstance(value, Number):
+        v = float(value)
+        if v == v and abs(v) != float('inf'):  # Not NaN or inf
+            if v == int(v) and abs(v) < 1e15:
+                return '<c r="%s"%s><v>%d</v></c>' % (ref, s, int(v))
+            return '<c r="%s"%s><v>%.17g</v></c>' % (ref, s, v)
+        value = str(value)
+    if not isinstance(value, basestring):
+        value = str(value)
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    if value.startswith('='):
+        return '<c r="%s"%s><f>%s</f></c>' % (ref, s, escape(value[1:]))
+    return '<c r="%s"%s t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>' % (ref, s, escape(value))
+
+
+def RowXML(row, cells, styles=None):
+    # A new <row> from {col: value}, with cell styles {col: xf index}
+    styles = styles or {}
+    xml = ''.join(CellXML(row, c, cells[c], styles.get(c)) for c in sorted(cells))
+    return '<row r="%d">%s</row>' % (row, xml) if xml else ''
+
+
+def MergeRow(row_xml, row, cells, styles=None):
+    '''
+    Apply edits {col: value} to an existing <row> element, keeping the
+    row's attributes (except spans) and each edited cell's style (unless
+    a new one is given in styles {col: xf index}).
+    '''
+    styles = styles or {}
+    head = row_xml[:row_xml.index('>') + 1]
+    if head.endswith('/>'):
+        head = head[:-2].rstrip() + '>'
+    head = SPANS_RE.sub('', head)
+    existing = {}
+    for m in CELL_RE.finditer(row_xml, len(head)):
+        ref = CELL_REF_RE.search(m.group(0)[:m.group(0).index('>')+1])
+        if ref is None:
+            raise XLStreamError('Cell without reference in row %d' % row)
+        existing[ColIndex(ref.group(1))] = m.group(0)
+    for col in cells:
+        style = None
+        if col in existing:
+            tag = existing[col][:existing[col].index('>')+1]
+            s = STYLE_RE.search(tag)
+            style = s.group(1) if s is not None else None
+        existing[col] = CellXML(row, col, cells[col], styles.get(col, style))
+    return head + ''.join(existing[c] for c in sorted(existing)) + '</row>'
+
+
+def SpliceSheet(src, dst, edits, styles=None):
+    '''
+    Copy sheet XML from file-like src to dst, applying edits
+    {row: {col: value}} and cell styles {row: {col: xf index}}. Rows with
+    no edits are copied byte for byte.
+    '''
+    styles = styles or {}
+    pending = sorted(edits)
+    max_row = pending[-1] if pending else 0
+    max_col = max([max(edits[r]) for r in pending] or [0])
+
+    def Flush(before=None):
+        # Write new rows numbered below before (all if None)
+        while pending and (before is None or pending[0] < before):
+            r = pending.pop(0)
+            dst.write(RowXML(r, edits[r], styles.get(r)))
+
+    buf = ''
+    eof = False
+
+    def More():
+        data = src.read(CHUNK)
+        return data, len(data) == 0
+
+    # Up to and including <sheetData>, fixing the dimension on the way
+    while True:
+        m = SHEETDATA_RE.search(buf)
+        if m is not None:
+            break
+        if eof:
+            raise XLStreamError('No <sheetData> in sheet')
+        data, eof = More()
+        buf += data
+    head = buf[:m.start()]
+    d = DIM_RE.search(head)
+    if d is not None:
+        c0, r0 = d.group(1), d.group(2)
+        c1, r1 = d.group(3) or c0, d.group(4) or r0
+        ref = '%s%s:%s%d' % (c0, r0, ColLetter(max(ColIndex(c1), max_col)),
+                              max(int(r1), max_row))
+        head = head[:d.start()] + '<dimension ref="%s"/>' % ref + head[d.end():]
+    dst.write(head)
+    dst.write('<sheetData>')
+    buf = buf[m.end():]
+    if m.group(1) == '/':  # Empty <sheetData/>
+        Flush()
+        dst.write('</sheetData>')
+    else:
+        while True:
+            if buf[:1].isspace():
+                buf = buf.lstrip()
+            if buf.startswith('</sheetData>'):
+                Flush()
+                dst.write('</sheetData>')
+                buf = buf[len('</sheetData>'):]
+                break
+            # Fast path: copy all complete rows, if they're below the next edit
+            last = buf.rfind('<row')
+            end = None
+            while last >= 0 and end is None:
+                end = ROW_RE.match(buf, last)
+                if end is None:
+                    last = buf.rfind('<row', 0, last)
+            if end is not None:
+                r_last = int(ROW_START_RE.match(buf, last).group(1))
+                if not pending or r_last < pending[0]:
+                    dst.write(buf[:end.end()])
+                    buf = buf[end.end():]
+                    continue
+            m = ROW_RE.match(buf)
+            if m is None:  # Incomplete row - need more
+                if eof:
+                    raise XLStreamError('Unexpected end of sheet')
+                data, eof = More()
+                buf += data
+                continue
+            row_xml = m.group(0)
+            row = int(ROW_START_RE.match(row_xml).group(1))
+            Flush(row)
+            if pending and pending[0] == row:
+                pending.pop(0)
+                dst.write(MergeRow(row_xml, row, edits[row], styles.get(row)))
+            else:
+                dst.write(row_xml)
+            buf = buf[m.end():]
+    while True:  # The rest of the sheet
+        dst.write(buf)
+        buf, eof = More()
+        if eof:
+            break
+
+
+def SheetParts(zf):
+    # {sheet name: part name in the zip}
+    wb = ET.fromstring(zf.read('xl/workbook.xml'))
+    rels = ET.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+    targets = dict((rel.get('Id'), rel.get('Target'))
+                   for rel in rels.iter(NS_PKG_REL + 'Relationship'))
+    parts = {}
+    for sheet in wb.iter(NS_MAIN + 'sheet'):
+        target = targets[sheet.get(NS_REL + 'id')]
+        if target.startswith('/'):
+            parts[sheet.get('name')] = target[1:]
+        else:
+            parts[sheet.get('name')] = 'xl/' + target
+    return parts
+
+
+def CopyPart(zin, zout, info):
+    if info.file_size <= COPY_IN_MEMORY:
+        zout.writestr(info, zin.read(info.filename))
+        return
+    fd, tmp = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(zin.open(info.filename), f, CHUNK)
+        zout.write(tmp, info.filename, info.compress_type)
+    finally:
+        os.remove(tmp)
+
+
+def AppendStyle(xml, group, element):
+    '''
+    Append element to the <group> list (e.g. fonts) of styles.xml text
+    xml. Returns (new xml, element's index in the list).
+    '''
+    m = re.search(r'(<%s\b[^>]*>)(.*?)(</%s>)' % (group, group), xml, re.S)
+    if m is None:
+        raise XLStreamError('No <%s> in %s' % (group, STYLES_PART))
+    n = len(re.findall(r'<%s\b' % STYLE_ITEMS[group], m.group(2)))
+    head = re.sub(r'\bcount="\d+"', 'count="%d"' % (n + 1), m.group(1))
+    return xml[:m.start()] + head + m.group(2) + element + m.group(3) + xml[m.end():], n
+
+
+def AddStyles(xml, keys):
+    '''
+    Add a cellXfs entry (with its font and border, if any) to styles.xml
+    text xml for each (font XML, border XML) in keys.
+    Returns (new xml, {key: xf index}).
+    '''
+    index = {}
+    for key in keys:
+        font, border = key
+        font_id = border_id = 0  # (The defaults)
+        if font:
+            xml, font_id = AppendStyle(xml, 'fonts', font)
+        if border:
+            xml, border_id = AppendStyle(xml, 'borders', border)
+        xf = '<xf numFmtId="0" fontId="%d" fillId="0" borderId="%d" xfId="0"%s%s/>' % (
+            font_id, border_id, ' applyFont="1"' if font else '',
+            ' applyBorder="1"' if border else '')
+        xml, index[key] = AppendStyle(xml, 'cellXfs', xf)
+    return xml, index
+
+
+def Replace(tmp, path):
+    '''
+    Move file tmp to path. Windows has no atomic replace, so there the
+    original is first renamed to a backup, which is put back if tmp can't
+    be moved into place and deleted only once it has been.
+    '''
+    if os.name != 'nt' or not os.path.exists(path):
+        os.rename(tmp, path)
+        return
+    backup = os.path.splitext(tmp)[0] + '.bak'  # (tmp's name is unique)
+    os.rename(path, backup)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        os.rename(backup, path)
+        raise
+    try:
+        os.remove(backup)
+    except OSError as err:
+        print 'xlstream.Replace(): backup %s not removed (%s)' % (backup, err)
+
+
+class StreamCell(object):
+    # Just enough of an openpyxl cell: value, and font and border (set only)
+    def __init__(self, sheet, row, col):
+        self._sheet = sheet
+        self._row = row
+        self._col = col
+
+    def _SetStyle(self, attr, style):
+        self._sheet.book.SetStyle(self._sheet.title, self._row, self._col,
+                                  attr, style)
+
+    font = property(None, lambda self, f: self._SetStyle('font', f))
+    border = property(None, lambda self, b: self._SetStyle('border', b))
+
+    @property
+    def value(self):
+        return self._sheet.Get(self._row, self._col)
+
+    @value.setter
+    def value(self, v):
+        self._sheet.Set(self._row, self._col, v)
+
+
+class StreamSheet(object):
+    def __init__(self, book, name):
+        self.book = book
+        self.title = name
+
+    def __getitem__(self, ref):
+        row, col = SplitRef(ref)
+        return StreamCell(self, row, col)
+
+    def __setitem__(self, ref, value):
+        row, col = SplitRef(ref)
+        self.Set(row, col, value)
+
+    def cell(self, row, column):
+        return StreamCell(self, row, column)
+
+    def Get(self, row, col):
+        return self.book.Get(self.title, row, col)
+
+    def Set(self, row, col, value):
+        self.book.Set(self.title, row, col, value)
+
+    @property
+    def rows(self):
+        # All rows, read-only (e.g. for params.Parse())
+        return self.book.ReadOnly().get_sheet_by_name(self.title).rows
+
+
+class StreamBook(object):
+    """
+    A workbook file, read on demand and saved by streaming edits into it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = RLock()
+        self.pending = {}  # {sheet: {row: {col: value}}}
+        self.cache = {}  # {sheet: {row: {col: value}}} of rows read so far
+        self.styles = {}  # {sheet: {row: {col: {attr: XML}}}} pending
+        self.xf = {}  # {(font XML, border XML): cellXfs index} in the file
+        self.blocks = {}  # {sheet: set of block numbers read}
+        self._ro = None
+        with zipfile.ZipFile(path) as zf:
+            self.parts = SheetParts(zf)
+
+    def get_sheet_by_name(self, name):
+        if name not in self.parts:
+            raise KeyError('Worksheet {0} does not exist.'.format(name))
+        return StreamSheet(self, name)
+
+    def ReadOnly(self):
+        # The read-only openpyxl view of the file (opened on first use)
+        with self.lock:
+            if self._ro is None:
+                self._ro = load_workbook(self.path, read_only=True,
+                                         data_only=True)
+            return self._ro
+
+    def CloseReadOnly(self):
+        with self.lock:
+            if self._ro is not None:
+                if hasattr(self._ro, 'close'):
+                    self._ro.close()
+                elif hasattr(self._ro, '_archive'):
+                    self._ro._archive.close()
+                self._ro = None
+
+    def Get(self, sheet, row, col):
+        with self.lock:
+            edits = self.pending.get(sheet, {}).get(row, {})
+            if col in edits:
+                return edits[col]
+            block = (row - 1)//BLOCK_ROWS
+            if block not in self.blocks.setdefault(sheet, set()):
+                self.ReadBlock(sheet, block)
+            return self.cache[sheet].get(row, {}).get(col)
+
+    def Set(self, sheet, row, col, value):
+        with self.lock:
+            self.pending.setdefault(sheet, {}).setdefault(row, {})[col] = value
+
+    def Edits(self, sheet):
+        # Unsaved edits to sheet: {row: {col: value}}
+        with self.lock:
+            return dict((r, dict(cells)) for r, cells
+                        in self.pending.get(sheet, {}).items())
+
+    def Discard(self):
+        # Forget all unsaved edits (and styles)
+        with self.lock:
+            self.pending = {}
+            self.styles = {}
+
+    def SetStyle(self, sheet, row, col, attr, style):
+        # Set a cell's font or border (attr) to style (an openpyxl object)
+        with self.lock:
+            if col not in self.pending.get(sheet, {}).get(row, {}):
+                self.Set(sheet, row, col, self.Get(sheet, row, col))  # (Keep its value)
+            cell = self.styles.setdefault(sheet, {}).setdefault(row, {}).setdefault(col, {})
+            cell[attr] = tostring(style.to_tree())
+
+    def StyleIndexes(self, zin):
+        '''
+        The pending styles, as {part: {row: {col: xf index}}}, and the new
+        styles.xml text (None if no new styles are needed).
+        '''
+        keys = set()
+        for rows in self.styles.values():
+            for cols in rows.values():
+                for attrs in cols.values():
+                    keys.add((attrs.get('font', ''), attrs.get('border', '')))
+        new = [k for k in keys if k not in self.xf]
+        xml = None
+        xf = dict(self.xf)
+        if new:
+            xml, added = AddStyles(zin.read(STYLES_PART), new)
+            xf.update(added)
+        styles = {}
+        for sheet, rows in self.styles.items():
+            styles[self.parts[sheet]] = dict(
+                (r, dict((c, xf[(a.get('font', ''), a.get('border', ''))])
+                         for c, a in cols.items()))
+                for r, cols in rows.items())
+        return styles, xml, xf
+
+    def ReadBlock(self, sheet, block):
+        first = block*BLOCK_ROWS + 1
+        last = first + BLOCK_ROWS - 1
+        ws = self.ReadOnly().get_sheet_by_name(sheet)
+        cache = self.cache.setdefault(sheet, {})
+        for cells in ws.iter_rows(min_row=first, max_row=last):
+            row = None
+            values = {}
+            for i, c in enumerate(cells):
+                if c.value is not None:
+                    values[i + 1] = c.value
+                    row = getattr(c, 'row', row)
+            if row is not None:
+                cache[row] = values
+        self.blocks[sheet].add(block)
+
+    def save(self, path=None):
+        '''
+        Write the file (to path, if given - otherwise in place), with all
+        pending edits. Raises IOError if it can't be written (e.g. it's
+        open in Excel), in which case the edits are kept.
+        '''
+        path = path or self.path
+        with self.lock:
+            edits = dict((self.parts[s], self.pending[s])
+                         for s in self.pending if self.pending[s])
+            if not edits and os.path.abspath(path) == os.path.abspath(self.path):
+                return
+            self.CloseReadOnly()  # Release the file (Windows)
+            fd, tmp = tempfile.mkstemp(suffix='.xlsx',
+                                       dir=os.path.dirname(os.path.abspath(path)))
+            os.close(fd)
+            try:
+                with zipfile.ZipFile(self.path) as zin:
+                    styles, styles_xml, xf = self.StyleIndexes(zin)
+                    with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zout:
+                        for info in zin.infolist():
+                            if info.filename in edits:
+                                self.WritePart(zin, zout, info, edits[info.filename],
+                                               styles.get(info.filename))
+                            elif info.filename == STYLES_PART and styles_xml is not None:
+                                zout.writestr(info, styles_xml)
+                            else:
+                                CopyPart(zin, zout, info)
+                Replace(tmp, path)
+            except OSError as err:
+                raise IOError(str(err))
+            finally:
+                if os.path.exists(tmp) and os.path.exists(path):
+                    os.remove(tmp)  # (Else tmp may be the only copy)
+            for sheet in self.pending:  # Saved edits are now the file's contents
+                cache = self.cache.setdefault(sheet, {})
+                for row, cells in self.pending[sheet].items():
+                    cache.setdefault(row, {}).update(cells)
+            self.pending = {}
+            self.styles = {}
+            self.xf = xf
+            self.path = path
+
+    def WritePart(self, zin, zout, info, edits, styles=None):
+        fd, tmp = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as dst:
+                SpliceSheet(zin.open(info.filename), dst, edits, styles)
+            zout.write(tmp, info.filename, zipfile.ZIP_DEFLATED)
+        finally:
+            os.remove(tmp)
+
+
+def Open(path):
+    # The workbook at path (cell values, not formulae)
+    if STREAMING:
+        return StreamBook(path)
+    return load_workbook(path, data_only=True)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+xlwriter.py
+
+Background workbook writer.
+A WorkbookWriter thread owns all changes to, and saves of, one openpyxl
+workbook (or xlstream.StreamBook). Other threads (AqnThread, the GUI) queue cell updates and save
+requests rather than touching the workbook themselves, so that:
+* the acquisition thread never blocks on openpyxl serialization,
+* the GUI (File -> Save) and the acquisition thread can't race on
+  wb.save() and
+* save requests that pile up while a save is in progress are merged -
+  there is never more than one save in flight and never a queue of
+  redundant saves behind it.
+Code that has to read and write the workbook directly (e.g. the analysis
+of a run, which reads Data and writes Results) first calls Flush(), then
+holds the writer's lock - so no queued update or save runs meanwhile.
+"""
+
+from threading import Thread, Event, RLock
+import Queue
+import time
+
+import timeline
+
+
+class WorkbookWriter(Thread):
+    """
+    Applies queued cell updates to workbook wb and saves it on request.
+    """
+    def __init__(self, wb, log=None):
+        Thread.__init__(self)
+        self.daemon = True
+        self.wb = wb
+        self.log = log
+        self.q = Queue.Queue()
+        self.lock = RLock()  # Held while the workbook is changed or saved
+        self.save_latency = []  # Duration of every save (s)
+
+    def Put(self, sheet, ref, value, **style):
+        """
+        Queue a cell update: sheet['ref'] = value. Any keyword arguments
+        (e.g. font=..., border=...) are set as cell attributes.
+        """
+        self.q.put(('put', sheet, ref, value, style))
+
+    def PutRow(self, sheet, row, cells):
+        """
+        Queue updates for several cells in one row.
+        cells is a dictionary of values, keyed by column letter.
+        """
+        for c in cells:
+            self.q.put(('put', sheet, c+str(row), cells[c], {}))
+
+    def Save(self, path, wait=False):
+        """
+        Queue a save of the workbook to path. If wait is True, block until
+        the workbook (including all updates queued before now) is saved.
+        """
+        done = Event()
+        self.q.put(('save', path, done))
+        if wait:
+            done.wait()
+        return done
+
+    def Flush(self):
+        # Block until all updates queued so far have been applied
+        done = Event()
+        self.q.put(('sync', done))
+        done.wait()
+
+    def Stop(self):
+        self.q.put(('stop',))
+
+    def run(self):
+        running = True
+        while running:
+            ops = [self.q.get()]
+            while True:  # Gather everything else already waiting
+                try:
+                    ops.append(self.q.get_nowait())
+                except Queue.Empty:
+                    break
+
+            saves = []  # [(path, done-event),...]
+            synced = []
+            for op in ops:
+                if op[0] == 'put':
+                    with self.lock:
+                        self.Apply(*op[1:])
+                elif op[0] == 'save':
+                    saves.append(op[1:])
+                elif op[0] == 'sync':
+                    synced.append(op[1])
+                elif op[0] == 'stop':
+                    running = False
+
+            # One save per distinct path, however many were requested
+            paths = []
+            for (path, done) in saves:
+                if path not in paths:
+                    paths.append(path)
+            for path in paths:
+                with self.lock:
+                    self.DoSave(path, len([p for (p, d) in saves if p == path]))
+            for (path, done) in saves:
+                done.set()
+            for done in synced:
+                done.set()
+
+    def Apply(self, sheet, ref, value, style):
+        cell = self.wb.get_sheet_by_name(sheet)[ref]
+        for attr in style:
+            setattr(cell, attr, style[attr])
+        cell.value = value
+
+    def DoSave(self, path, n_requests):
+        t0 = time.time()
+        try:
+            with timeline.Span('wb.save', 'xl', requests=n_requests):
+                self.wb.save(path)
+        except IOError as err:  # E.g. file open in Excel
+            print 'xlwriter.WorkbookWriter: FAILED to save %s: %s' % (path, err)
+            if self.log is not None:
+                print >>self.log, 'xlwriter.WorkbookWriter: FAILED to save %s: %s' % (path, err)
+            return
+        latency = time.time() - t0
+        self.save_latency.append(latency)
+        msg = 'xlwriter.WorkbookWriter: saved %s in %.2f s (%d request(s) merged)' % (path, latency, n_requests)
+        print msg
+        if self.log is not None:
+            print >>self.log, msg